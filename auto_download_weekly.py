@@ -3,31 +3,50 @@ Automated Weekly Download Script for Gilles Peterson Archive
 Finds, downloads, renames, and uploads the latest episode to R2
 
 Usage:
-    python auto_download_weekly.py
+    python auto_download_weekly.py            # download to downloads/, then upload
+    python auto_download_weekly.py --stream   # pipe straight into R2 (no local file)
+    python auto_download_weekly.py --audio-format m4a   # keep BBC's AAC, no re-encode
+
+The episode is a job in the shared job queue (see job_queue.py): a failed
+run is retried by the next one after a back-off, and an episode that was
+downloaded but not uploaded is uploaded without downloading it again.
+
+An interrupted download resumes from its partial file on the next run
+(see fetch.py). Nothing is uploaded until it passes the checks in
+verify.py: size, frame sync, and a full decode matching BBC's listed
+duration. With --stream there is no file to check beforehand, so the
+upload is only completed if the encoder wrote the listed duration with
+no more than a few decode errors.
 
 Requirements:
     - CyberGhost VPN connected to UK
     - yt-dlp installed: pip install yt-dlp
     - boto3 installed: pip install boto3
+    - ffmpeg on PATH (for --stream)
 """
 
+import argparse
 import subprocess
-import json
-import boto3
+import time
 from pathlib import Path
 from datetime import datetime
 import sys
 
+import multipart_upload
+from bbc_metadata import list_episodes, resolve_episode
+from catalog import publish_catalog
+from fetch import discard, download_audio
+from ingest import analyze_object, check_upload, ingest_file
+from job_queue import FAILED, get_job_queue
+from manifest import get_manifest
+from naming import AUDIO_FORMAT, content_type
+from r2_storage import object_size
+from transcode import drain_stderr, m4a_remuxer, mp3_encoder, ytdlp_audio_args
+from verify import IntegrityError, check_decode, format_report, verify_audio
+
 # Set UTF-8 encoding for console output
 sys.stdout.reconfigure(encoding='utf-8')
 
-# Cloudflare R2 credentials
-ACCESS_KEY = "3fe1d0fac3028b108dfb1434fbeda5ab"
-SECRET_KEY = "7e39e93560a2555e2e20c57a6ea094746212d3360ee13395d8ddb40c69924516"
-ACCOUNT_ID = "daa5cfc7d0326ab77077899860d9ae03"
-BUCKET_NAME = "gparchive"
-ENDPOINT_URL = f"https://{ACCOUNT_ID}.r2.cloudflarestorage.com"
-
 # BBC Programme ID for Gilles Peterson
 GP_PROGRAMME_ID = "b01fm4ss"
 
@@ -35,6 +54,9 @@ GP_PROGRAMME_ID = "b01fm4ss"
 DOWNLOAD_DIR = Path(__file__).parent / "downloads"
 DOWNLOAD_DIR.mkdir(exist_ok=True)
 
+# Re-list the bucket if the local manifest is older than this (seconds)
+MANIFEST_MAX_AGE = 3600
+
 
 def log(message):
     """Print with timestamp"""
@@ -46,48 +68,32 @@ def find_latest_episode():
     """Find the latest Gilles Peterson episode using BBC API"""
     log("Searching for latest episode...")
 
-    # Use yt-dlp to get the latest episode info
+    # Newest entry from the (briefly cached) listing, then its full
+    # metadata (cached for good once fetched)
     url = f"https://www.bbc.co.uk/programmes/{GP_PROGRAMME_ID}/episodes/player"
 
     try:
-        result = subprocess.run(
-            ['python', '-m', 'yt_dlp', '--playlist-items', '1', '--dump-json', '--skip-download', url],
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
-
-        if result.returncode != 0:
-            log(f"Error finding episode: {result.stderr}")
+        latest = list_episodes(url, limit=1)
+        if not latest:
+            log("No episode data found")
             return None
 
-        # Parse the first line of JSON output
-        for line in result.stdout.strip().split('\n'):
-            if line.strip():
-                data = json.loads(line)
-                episode_id = data.get('id')
-                title = data.get('title', 'Gilles Peterson')
-                upload_date = data.get('upload_date', '')
-
-                # Format date from YYYYMMDD to YYYY-MM-DD
-                if upload_date and len(upload_date) == 8:
-                    formatted_date = f"{upload_date[0:4]}-{upload_date[4:6]}-{upload_date[6:8]}"
-                else:
-                    formatted_date = datetime.now().strftime("%Y-%m-%d")
-
-                log(f"Found: {title}")
-                log(f"Date: {formatted_date}")
-                log(f"Episode ID: {episode_id}")
-
-                return {
-                    'id': episode_id,
-                    'title': title,
-                    'date': formatted_date,
-                    'url': f"https://www.bbc.co.uk/programmes/{episode_id}"
-                }
-
-        log("No episode data found")
-        return None
+        episode_id = latest[0]['id']
+        info = resolve_episode(episode_id) or latest[0]
+        title = info['title'] or 'Gilles Peterson'
+        formatted_date = info['date'] or datetime.now().strftime("%Y-%m-%d")
+
+        log(f"Found: {title}")
+        log(f"Date: {formatted_date}")
+        log(f"Episode ID: {episode_id}")
+
+        return {
+            'id': episode_id,
+            'title': title,
+            'date': formatted_date,
+            'duration': info.get('duration'),
+            'url': f"https://www.bbc.co.uk/programmes/{episode_id}"
+        }
 
     except Exception as e:
         log(f"Error finding latest episode: {e}")
@@ -95,27 +101,18 @@ def find_latest_episode():
 
 
 def check_if_exists_in_r2(filename):
-    """Check if file already exists in R2 bucket"""
+    """Check if file already exists in R2 bucket (via the local manifest)"""
     try:
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=ENDPOINT_URL,
-            aws_access_key_id=ACCESS_KEY,
-            aws_secret_access_key=SECRET_KEY,
-            region_name='auto'
-        )
-
-        s3_client.head_object(Bucket=BUCKET_NAME, Key=filename)
-        return True
-    except:
+        manifest = get_manifest()
+        manifest.refresh(max_age=MANIFEST_MAX_AGE)
+        return manifest.has_key(filename)
+    except Exception as e:
+        log(f"Could not check R2 for {filename}: {e}")
         return False
 
 
-def download_episode(episode):
-    """Download episode using yt-dlp"""
-    log("Downloading episode...")
-
-    # Generate filename: YYYY-MM-DD Gilles Peterson - Title.mp3
+def output_filename(episode, ext='.mp3'):
+    """Archive filename: YYYY-MM-DD Gilles Peterson - Title.mp3"""
     # Clean the title
     clean_title = episode['title'].replace('Gilles Peterson, ', '').replace('Gilles Peterson: ', '')
     clean_title = clean_title.strip()
@@ -126,13 +123,22 @@ def download_episode(episode):
 
     # Generate filename
     if clean_title and clean_title != 'Gilles Peterson':
-        filename = f"{episode['date']} Gilles Peterson - {clean_title}.mp3"
+        filename = f"{episode['date']} Gilles Peterson - {clean_title}{ext}"
     else:
-        filename = f"{episode['date']} Gilles Peterson.mp3"
+        filename = f"{episode['date']} Gilles Peterson{ext}"
 
     # Remove invalid filename characters
     filename = re.sub(r'[<>:"/\\|?*]', '', filename)
 
+    return filename
+
+
+def download_episode(episode, audio_format=AUDIO_FORMAT):
+    """Download episode using yt-dlp; returns its path, or None if it's already in R2"""
+    log("Downloading episode...")
+
+    filename = output_filename(episode, f'.{audio_format}')
+
     # Check if already exists
     if check_if_exists_in_r2(filename):
         log(f"Episode already exists in R2: {filename}")
@@ -140,77 +146,172 @@ def download_episode(episode):
 
     output_path = DOWNLOAD_DIR / filename
 
-    # Download with yt-dlp
+    # Download with yt-dlp under the episode ID (resumable), then check it
+    # before it gets its archive name
+    src = download_audio(episode['url'], episode['id'], DOWNLOAD_DIR, ytdlp_audio_args(audio_format))
     try:
-        result = subprocess.run(
-            [
-                'python', '-m', 'yt_dlp',
-                '--format', 'bestaudio',
-                '--extract-audio',
-                '--audio-format', 'mp3',
-                '--output', str(output_path),
-                episode['url']
-            ],
-            capture_output=True,
-            text=True,
-            timeout=600  # 10 minute timeout
-        )
+        report = verify_audio(src, episode.get('duration'))
+    except IntegrityError:
+        # A damaged download can't be resumed: the retry starts from scratch
+        discard(DOWNLOAD_DIR, episode['id'])
+        raise
+    log(f"✓ Verified: {format_report(report)}")
+    src.replace(output_path)
 
-        if result.returncode != 0:
-            log(f"Download failed: {result.stderr}")
-            return None
+    size_mb = output_path.stat().st_size / (1024 * 1024)
+    log(f"Downloaded: {filename} ({size_mb:.1f} MB)")
+    return output_path
 
-        if output_path.exists():
-            size_mb = output_path.stat().st_size / (1024 * 1024)
-            log(f"Downloaded: {filename} ({size_mb:.1f} MB)")
-            return output_path
-        else:
-            log("Download failed: file not found")
-            return None
 
-    except Exception as e:
-        log(f"Error downloading: {e}")
-        return None
+def upload_to_r2(file_path, episode_id=None):
+    """Upload file to R2 bucket, check it arrived whole, then remove the local copy"""
+    log("Uploading to R2...")
 
+    filename = file_path.name
 
-def upload_to_r2(file_path):
-    """Upload file to R2 bucket"""
-    log("Uploading to R2...")
+    _, loudness = ingest_file(
+        file_path,
+        filename,
+        episode_id=episode_id,
+        progress=lambda bytes: print('.', end='', flush=True)
+    )
+
+    print()  # New line after progress dots
+    check_upload(filename)
+    log(f"✓ Successfully uploaded: {filename}")
+    if loudness:
+        log(f"Loudness: {loudness['integrated']:.1f} LUFS, ReplayGain {loudness['replaygain']:+.2f} dB")
+    update_catalog()
+
+    # Delete local file after successful upload
+    file_path.unlink()
+    log("Local file cleaned up")
 
-    try:
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=ENDPOINT_URL,
-            aws_access_key_id=ACCESS_KEY,
-            aws_secret_access_key=SECRET_KEY,
-            region_name='auto'
-        )
 
-        filename = file_path.name
+def stream_episode(episode, audio_format=AUDIO_FORMAT):
+    """Pipe yt-dlp -> ffmpeg -> R2 without writing the episode to disk
 
-        s3_client.upload_file(
-            str(file_path),
-            BUCKET_NAME,
+    Parts are uploaded while the download is still running, so the whole
+    job takes about as long as the slower of the two.
+    """
+    filename = output_filename(episode, f'.{audio_format}')
+    if check_if_exists_in_r2(filename):
+        log(f"Episode already exists in R2: {filename}")
+        return False
+
+    log(f"Streaming to R2: {filename}")
+    fetch = subprocess.Popen(
+        [
+            'python', '-m', 'yt_dlp',
+            '--format', 'bestaudio',
+            '--quiet', '--no-progress',
+            '--output', '-',
+            episode['url']
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    # Read from the start: a chatty yt-dlp would otherwise block on a full stderr pipe
+    fetch_drain, fetched = drain_stderr(fetch)
+    encode = m4a_remuxer(fetch.stdout) if audio_format == 'm4a' else mp3_encoder(fetch.stdout)
+    # ffmpeg owns the read end now; closing ours lets yt-dlp see SIGPIPE
+    fetch.stdout.close()
+    drain, encoded = drain_stderr(encode)
+
+    def check_producers():
+        if encode.wait() != 0:
+            drain.join()
+            raise RuntimeError(f"ffmpeg failed: {' '.join(encoded['errors'])}")
+        if fetch.wait() != 0:
+            fetch_drain.join()
+            raise RuntimeError(f"yt-dlp failed: {' '.join(fetched['errors'])[-2000:]}")
+        # Last chance to keep a short or damaged stream out of the bucket
+        drain.join()
+        problems = check_decode(encoded['duration'], encoded['errors'], episode.get('duration'))
+        if problems:
+            raise IntegrityError(f"{filename} failed verification: {'; '.join(problems)}")
+
+    try:
+        etag, size = multipart_upload.upload_stream(
+            encode.stdout,
             filename,
-            Callback=lambda bytes: print('.', end='', flush=True)
+            extra_args={'ContentType': content_type(filename)},
+            progress=lambda bytes: print('.', end='', flush=True),
+            before_complete=check_producers,
         )
+    except Exception:
+        print()
+        raise
+    finally:
+        for proc in (encode, fetch):
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
+    print()  # New line after progress dots
+    if object_size(filename) != size:
+        raise RuntimeError(f"{filename} in R2 doesn't match the streamed size")
+    log(f"✓ Successfully uploaded: {filename} ({size / (1024 * 1024):.1f} MB)")
+    get_manifest().add(filename, size=size, etag=etag, episode_id=episode['id'])
+
+    # No local copy to analyse alongside the upload, so stream it back from R2
+    try:
+        loudness = analyze_object(filename)
+        log(f"Loudness: {loudness['integrated']:.1f} LUFS, ReplayGain {loudness['replaygain']:+.2f} dB")
+    except Exception as e:
+        log(f"✗ Loudness analysis failed: {e}")
+
+    update_catalog()
+    return True
 
-        print()  # New line after progress dots
-        log(f"✓ Successfully uploaded: {filename}")
 
-        # Delete local file after successful upload
-        file_path.unlink()
-        log("Local file cleaned up")
+def archive_episode(episode, stream=False, audio_format=AUDIO_FORMAT):
+    """Take the episode's job from its last completed stage into R2
 
-        return True
+    Returns True once uploaded, False if it was already there. Raises on
+    failure, which the job queue records for a retry.
+    """
+    queue = get_job_queue()
+    if stream:
+        # Steps 2+3 at once: download straight into R2
+        with queue.attempt(episode['id'], 'downloading'):
+            return stream_episode(episode, audio_format)
 
+    # Step 2: Download episode (unless an earlier run already did)
+    file_path = queue.local_file(episode['id'])
+    if file_path:
+        log(f"Resuming: {file_path.name} was downloaded by an earlier run")
+    else:
+        with queue.attempt(episode['id'], 'downloading'):
+            file_path = download_episode(episode, audio_format)
+        if file_path is None:
+            return False
+        queue.advance(episode['id'], 'downloaded', path=str(file_path))
+
+    # Step 3: Upload to R2
+    with queue.attempt(episode['id'], 'uploading'):
+        upload_to_r2(file_path, episode_id=episode['id'])
+    return True
+
+
+def update_catalog():
+    """Rebuild the episode catalog served by /api/episodes"""
+    try:
+        if publish_catalog():
+            log("✓ Episode catalog updated")
     except Exception as e:
-        log(f"✗ Upload failed: {e}")
-        return False
+        log(f"✗ Catalog update failed: {e}")
 
 
 def main():
     """Main automation workflow"""
+    parser = argparse.ArgumentParser(description="Download the latest GP episode and upload it to R2")
+    parser.add_argument('--stream', action='store_true',
+                        help="pipe the download straight into R2 instead of staging it in downloads/")
+    parser.add_argument('--audio-format', choices=('mp3', 'm4a'), default=AUDIO_FORMAT,
+                        help=f"mp3 re-encode or m4a remux of BBC's AAC stream (default {AUDIO_FORMAT})")
+    args = parser.parse_args()
+
     log("=" * 60)
     log("GP Archive - Automated Weekly Download")
     log("=" * 60)
@@ -221,21 +322,31 @@ def main():
         log("No episode found. Exiting.")
         return
 
-    # Step 2: Download episode
-    file_path = download_episode(episode)
-    if not file_path:
-        log("Download failed or episode already exists. Exiting.")
+    queue = get_job_queue()
+    job = queue.discover(episode)
+    if job['state'] == FAILED:
+        log(f"✗ Gave up on {episode['id']} after {job['attempts']} attempts: {job['last_error']}")
+        log("Run `python job_queue.py --retry-failed` to try again")
+        return
+    if job['next_attempt'] > time.time():
+        retry_at = datetime.fromtimestamp(job['next_attempt']).strftime("%Y-%m-%d %H:%M")
+        log(f"Last attempt failed ({job['last_error']}); next retry after {retry_at}")
         return
 
-    # Step 3: Upload to R2
-    success = upload_to_r2(file_path)
+    try:
+        uploaded = archive_episode(episode, args.stream, args.audio_format)
+    except Exception as e:
+        log(f"✗ Automation failed: {e}")
+        log("It will be retried on the next run")
+        return
+    queue.advance(episode['id'], 'verified')
 
-    if success:
+    if uploaded:
         log("=" * 60)
         log("✓ Automation complete!")
         log("=" * 60)
     else:
-        log("Automation failed during upload")
+        log("Episode already exists in R2. Exiting.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,267 @@
+"""
+Server-side batch rename engine for the R2 bucket
+
+R2 has no rename, so each rename is a copy_object followed by a delete of
+the old key. This engine:
+  - runs the copies concurrently,
+  - verifies every copy (size, and ETag where R2 preserves it) before the
+    old key is eligible for deletion,
+  - never deletes a source whose target already held different content,
+  - deletes verified sources with delete_objects in batches of up to 1,000,
+  - appends every step to a journal so a crashed run can be resumed or
+    rolled back.
+
+Usage:
+    from batch_rename import run_renames, resume, rollback
+    journal = run_renames({'old.mp3': 'new.mp3'})
+    resume(journal)      # finish an interrupted run
+    rollback(journal)    # put every key back where it was
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from botocore.exceptions import ClientError
+
+from manifest import get_manifest
+from naming import DATE_PREFIX_RE, episode_filename, is_audio_key
+from r2_storage import delete_keys, get_client, iter_objects, BUCKET_NAME
+
+JOURNAL_DIR = Path(__file__).parent / "rename_journals"
+
+COPY_WORKERS = 8
+
+
+class RenameJournal:
+    """Append-only JSON-lines log of a rename run"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls):
+        JOURNAL_DIR.mkdir(exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        return cls(JOURNAL_DIR / f"rename-{stamp}.jsonl")
+
+    @classmethod
+    def latest(cls):
+        journals = sorted(JOURNAL_DIR.glob("rename-*.jsonl"))
+        return cls(journals[-1]) if journals else None
+
+    def write(self, op, **fields):
+        line = json.dumps({'op': op, 'at': datetime.now().isoformat(), **fields}, ensure_ascii=False)
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def entries(self):
+        """Latest state of every rename in the journal, keyed by old name"""
+        renames = {}
+        if not self.path.exists():
+            return renames
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last line from a crash
+                    continue
+                old = record.get('old')
+                if old is None:
+                    continue
+                entry = renames.setdefault(old, {'old': old})
+                entry.update({k: v for k, v in record.items() if k not in ('op', 'at')})
+                entry['state'] = record['op']
+        return renames
+
+
+def _object_info(key):
+    """(size, etag) of a key, or None if it does not exist"""
+    try:
+        response = get_client().head_object(Bucket=BUCKET_NAME, Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+    return response['ContentLength'], response['ETag'].strip('"')
+
+
+def _same_content(source, target):
+    """Compare (size, etag) pairs from a source and its copy
+
+    A copy of a single-part object keeps its MD5 ETag. Copies of multipart
+    objects get a new ETag, so for those only the size can be compared.
+    """
+    if source is None or target is None or source[0] != target[0]:
+        return False
+    return '-' in source[1] or source[1] == target[1]
+
+
+def _copy(old, new, source, journal):
+    """Copy and verify one rename; returns the target's (size, etag) or None"""
+    s3 = get_client()
+    existing = _object_info(new)
+
+    if existing is not None:
+        if _same_content(source, existing):
+            journal.write('verified', old=old, new=new, target_size=existing[0], target_etag=existing[1], copied=False)
+            return existing
+        journal.write('conflict', old=old, new=new, target_size=existing[0], target_etag=existing[1])
+        print(f"  ✗ {new} already exists with different content, keeping {old}")
+        return None
+
+    s3.copy_object(Bucket=BUCKET_NAME, CopySource={'Bucket': BUCKET_NAME, 'Key': old}, Key=new)
+    copied = _object_info(new)
+    if not _same_content(source, copied):
+        journal.write('copy_mismatch', old=old, new=new)
+        print(f"  ✗ Copy of {old} did not verify, keeping source")
+        return None
+
+    journal.write('verified', old=old, new=new, target_size=copied[0], target_etag=copied[1], copied=True)
+    print(f"  ✓ {old}\n    → {new}")
+    return copied
+
+
+def _finish(journal, mapping, sources, workers, verified=None):
+    """Copy/verify every pending rename, then delete verified sources
+
+    `verified` maps renames whose copy a previous run already verified to
+    the target's (size, etag); they go straight to deletion.
+    """
+    manifest = get_manifest()
+    targets = dict(verified or {})
+
+    def copy_one(old):
+        return old, _copy(old, mapping[old], sources[old], journal)
+
+    to_copy = [old for old in mapping if old not in targets]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for old, target in pool.map(copy_one, to_copy):
+            if target is not None:
+                targets[old] = target
+
+    failed = set(delete_keys(list(targets)))
+    for old, (size, etag) in targets.items():
+        if old in failed:
+            continue
+        journal.write('deleted', old=old, new=mapping[old])
+        row = manifest.get(old) or {}
+        manifest.remove(old)
+        manifest.add(mapping[old], size=size, etag=etag, episode_id=row.get('episode_id'))
+        if row.get('meta'):
+            manifest.update_meta(mapping[old], **row['meta'])
+
+    return len(targets) - len(failed)
+
+
+def run_renames(mapping, workers=COPY_WORKERS, journal=None):
+    """Rename every `old -> new` in `mapping`; returns the journal used"""
+    journal = journal or RenameJournal.create()
+    mapping = {old: new for old, new in mapping.items() if old != new}
+
+    # One listing gives the size/ETag of every source for verification
+    sources = {}
+    wanted = set(mapping)
+    for obj in iter_objects(delimiter='/'):
+        if obj['Key'] in wanted:
+            sources[obj['Key']] = (obj['Size'], obj['ETag'].strip('"'))
+
+    pending = {}
+    for old, new in mapping.items():
+        if old not in sources:
+            print(f"  - {old} not found in bucket, skipping")
+            journal.write('missing', old=old, new=new)
+            continue
+        size, etag = sources[old]
+        journal.write('planned', old=old, new=new, size=size, etag=etag)
+        pending[old] = new
+
+    renamed = _finish(journal, pending, sources, workers)
+    journal.write('run_complete', renamed=renamed)
+    print(f"\nRenamed {renamed}/{len(mapping)} files (journal: {journal.path})")
+    return journal
+
+
+def resume(journal, workers=COPY_WORKERS):
+    """Finish the renames an interrupted run left incomplete"""
+    pending = {}
+    sources = {}
+    verified = {}
+    for old, entry in journal.entries().items():
+        if entry['state'] not in ('planned', 'verified'):
+            continue
+        pending[old] = entry['new']
+        sources[old] = (entry['size'], entry['etag'])
+        if entry['state'] == 'verified':
+            verified[old] = (entry['target_size'], entry['target_etag'])
+
+    renamed = _finish(journal, pending, sources, workers, verified=verified)
+    journal.write('resume_complete', renamed=renamed)
+    print(f"\nResumed: renamed {renamed} more files")
+    return renamed
+
+
+def rollback(journal):
+    """Undo a rename run: restore every old key and drop the new ones"""
+    s3 = get_client()
+    manifest = get_manifest()
+    to_delete = []
+
+    for old, entry in journal.entries().items():
+        if entry['state'] not in ('verified', 'deleted'):
+            continue
+        new = entry['new']
+
+        if _object_info(old) is None:
+            # Source already deleted - copy it back first
+            source = _object_info(new)
+            if source is None:
+                print(f"  ✗ Neither {old} nor {new} exists, cannot roll back")
+                continue
+            s3.copy_object(Bucket=BUCKET_NAME, CopySource={'Bucket': BUCKET_NAME, 'Key': new}, Key=old)
+            if not _same_content(source, _object_info(old)):
+                print(f"  ✗ Restored copy of {old} did not verify, keeping {new}")
+                continue
+            row = manifest.get(new) or {}
+            manifest.add(old, size=source[0], etag=source[1], episode_id=row.get('episode_id'))
+            if row.get('meta'):
+                manifest.update_meta(old, **row['meta'])
+
+        if entry.get('copied', True):
+            to_delete.append(new)
+            journal.write('rolled_back', old=old, new=new)
+            print(f"  ↺ {new}\n    → {old}")
+
+    failed = set(delete_keys(to_delete))
+    for new in to_delete:
+        if new not in failed:
+            manifest.remove(new)
+    print(f"\nRolled back {len(to_delete) - len(failed)} renames")
+
+
+def dated_name_rule(manifest=None):
+    """Derive a mapping from the manifest: give undated keys a date prefix
+
+    Keys whose broadcast date is known (from a BBC title date such as
+    "10⧸01⧸2026" or recorded at upload) but which don't start with it are
+    renamed to the `YYYY-MM-DD Gilles Peterson - Title.mp3` convention.
+    """
+    manifest = manifest or get_manifest()
+    mapping = {}
+    for obj in manifest.objects():
+        key = obj['key']
+        if not is_audio_key(key) or DATE_PREFIX_RE.match(key) or not obj['date']:
+            continue
+        ext = key[key.rfind('.'):]
+        mapping[key] = episode_filename(obj['date'], key, ext=ext)
+    return mapping
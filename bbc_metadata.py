@@ -0,0 +1,290 @@
+"""
+Batched BBC episode metadata lookups via yt-dlp
+
+Resolves many BBC episode IDs at once with yt-dlp used as a library
+(YoutubeDL.extract_info) on a small thread pool, instead of paying the
+interpreter + extractor start-up cost of one `python -m yt_dlp` subprocess
+per episode. If yt-dlp can't be imported, all IDs go through a single
+subprocess call instead.
+
+Results are kept in a local SQLite cache (bbc_cache.db). Per-episode
+metadata never changes once published, so it never expires; programme
+listing pages are re-fetched after LISTING_TTL. The cache is bounded to
+CACHE_MAX_ENTRIES, evicting the least recently used entries.
+
+Usage:
+    python bbc_metadata.py [--clear]    # print cache stats (or empty it)
+
+    from bbc_metadata import resolve_episodes, list_episodes
+    info = resolve_episodes(['m002x2b1', 'm002xdzt'])
+    info['m002x2b1']['date']   # '2026-06-06'
+    latest = list_episodes(url, limit=1)
+"""
+
+import json
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import yt_dlp
+except ImportError:
+    yt_dlp = None
+
+EPISODE_URL = "https://www.bbc.co.uk/programmes/{}"
+# Gilles Peterson on BBC Sounds, and the programme's full episode guide
+PROGRAMME_ID = "b01fm4ss"
+BRAND_URL = f"https://www.bbc.co.uk/sounds/brand/{PROGRAMME_ID}"
+GUIDE_URL = f"https://www.bbc.co.uk/programmes/{PROGRAMME_ID}/episodes/guide"
+# Episodes stay on BBC Sounds for about this long after broadcast
+AVAILABILITY_DAYS = 30
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+# Concurrent lookups (each is mostly waiting on BBC over the VPN)
+RESOLVE_WORKERS = 4
+
+CACHE_PATH = Path(__file__).parent / "bbc_cache.db"
+# Listing pages change when a new episode airs; episode pages never do
+LISTING_TTL = 30 * 60
+CACHE_MAX_ENTRIES = 5000
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value TEXT,
+    fetched_at REAL,
+    accessed_at REAL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries(accessed_at);
+"""
+
+_local = threading.local()
+
+
+class MetadataCache:
+    """Persistent LRU cache of BBC lookups, keyed by episode ID or URL"""
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._db:
+            self._db.executescript(CACHE_SCHEMA)
+
+    def get(self, key, ttl=None):
+        """Cached value for `key`, or None if missing or older than `ttl` seconds"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, fetched_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or (ttl is not None and now - row[1] > ttl):
+                return None
+            with self._db:
+                self._db.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, fetched_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self._db.execute(
+                """
+                DELETE FROM entries WHERE key IN (
+                    SELECT key FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM entries")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide metadata cache, opening it on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = MetadataCache()
+    return _cache
+
+
+def format_date(yyyymmdd):
+    """YYYYMMDD -> YYYY-MM-DD (or '' if missing/malformed)"""
+    if yyyymmdd and len(yyyymmdd) == 8 and yyyymmdd.isdigit():
+        return f"{yyyymmdd[0:4]}-{yyyymmdd[4:6]}-{yyyymmdd[6:8]}"
+    return ''
+
+
+def summarize(info):
+    """The fields the scripts use from a yt-dlp info dict"""
+    return {
+        'id': info.get('id'),
+        'title': info.get('title', ''),
+        'upload_date': info.get('upload_date') or '',
+        'release_date': info.get('release_date') or '',
+        'date': format_date(info.get('upload_date') or info.get('release_date') or ''),
+        'description': info.get('description') or '',
+        'duration': info.get('duration'),
+    }
+
+
+def _ydl():
+    # YoutubeDL instances aren't thread-safe, so keep one per worker thread
+    if getattr(_local, 'ydl', None) is None:
+        _local.ydl = yt_dlp.YoutubeDL({
+            'quiet': True,
+            'no_warnings': True,
+            'skip_download': True,
+            'noplaylist': True,
+            'http_headers': {'User-Agent': USER_AGENT},
+        })
+    return _local.ydl
+
+
+def _resolve_in_process(episode_id):
+    try:
+        info = _ydl().extract_info(EPISODE_URL.format(episode_id), download=False)
+    except Exception as e:
+        print(f"  Error getting info for {episode_id}: {e}")
+        return episode_id, None
+    return episode_id, summarize(info)
+
+
+def _resolve_subprocess(ids):
+    result = subprocess.run(
+        [
+            'python', '-m', 'yt_dlp',
+            '--dump-json', '--skip-download', '--no-playlist', '--ignore-errors',
+            '--user-agent', USER_AGENT,
+            *[EPISODE_URL.format(i) for i in ids],
+        ],
+        capture_output=True,
+        text=True,
+        encoding='utf-8',
+        timeout=60 + 30 * len(ids),
+    )
+
+    resolved = {}
+    for line in result.stdout.splitlines():
+        if line.strip():
+            info = summarize(json.loads(line))
+            resolved[info['id']] = info
+    return resolved
+
+
+def resolve_episodes(ids, workers=RESOLVE_WORKERS, refresh=False):
+    """Resolve BBC episode IDs to metadata dicts; failed lookups map to None
+
+    IDs already in the cache are answered locally unless `refresh` is set.
+    """
+    ids = [i for i in dict.fromkeys(ids) if i]
+    if not ids:
+        return {}
+
+    cache = get_cache()
+    resolved = {}
+    if not refresh:
+        for i in ids:
+            info = cache.get(f"episode:{i}")
+            if info is not None:
+                resolved[i] = info
+
+    todo = [i for i in ids if i not in resolved]
+    if todo:
+        if yt_dlp is None:
+            fetched = _resolve_subprocess(todo)
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                fetched = dict(pool.map(_resolve_in_process, todo))
+        for i, info in fetched.items():
+            # Failures aren't cached so the next run tries again
+            if info is not None:
+                cache.put(f"episode:{i}", info)
+                resolved[i] = info
+
+    return {i: resolved.get(i) for i in ids}
+
+
+def resolve_episode(episode_id, refresh=False):
+    """Single-ID convenience wrapper around resolve_episodes()"""
+    return resolve_episodes([episode_id], refresh=refresh).get(episode_id)
+
+
+def _list_in_process(url, limit):
+    options = {
+        'quiet': True,
+        'no_warnings': True,
+        'skip_download': True,
+        'extract_flat': 'in_playlist',
+        'playlistend': limit,
+        'http_headers': {'User-Agent': USER_AGENT},
+    }
+    with yt_dlp.YoutubeDL(options) as ydl:
+        info = ydl.extract_info(url, download=False)
+    return list(info.get('entries') or [])[:limit]
+
+
+def _list_subprocess(url, limit):
+    result = subprocess.run(
+        [
+            'python', '-m', 'yt_dlp',
+            '--flat-playlist', '--dump-json',
+            '--playlist-items', f'1-{limit}',
+            '--user-agent', USER_AGENT,
+            url,
+        ],
+        capture_output=True,
+        text=True,
+        encoding='utf-8',
+        timeout=120,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or f"yt-dlp exited with {result.returncode}")
+    return [json.loads(line) for line in result.stdout.splitlines() if line.strip()]
+
+
+def list_episodes(url, limit=20, ttl=LISTING_TTL):
+    """First `limit` episodes of a BBC programme/brand page (flat: id, title, date)
+
+    Listings are cached for `ttl` seconds (None = use any cached copy).
+    """
+    cache = get_cache()
+    key = f"listing:{url}#{limit}"
+    episodes = cache.get(key, ttl=ttl)
+    if episodes is not None:
+        return episodes
+
+    entries = _list_in_process(url, limit) if yt_dlp is not None else _list_subprocess(url, limit)
+    episodes = [summarize(entry) for entry in entries if entry.get('id')]
+    if episodes:
+        cache.put(key, episodes)
+    return episodes
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    cache = get_cache()
+    if '--clear' in sys.argv[1:]:
+        cache.clear()
+        print(f"Cleared {cache.path}")
+    else:
+        print(f"{cache.path}: {cache.count()} entries (max {cache.max_entries})")
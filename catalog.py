@@ -0,0 +1,141 @@
+"""
+Pre-built episode catalog served by functions/api/episodes.js
+
+Instead of listing and sorting the whole bucket on every page load, the
+upload scripts regenerate a sorted episodes.json from the local manifest
+and upload it as a single compressed object (gzip, plus brotli when the
+`brotli` package is installed). The Pages Function serves that object with
+ETag / If-None-Match support and only falls back to a live listing if the
+catalog is missing.
+
+Usage:
+    python catalog.py             # refresh the manifest and republish
+
+    from catalog import publish_catalog
+    publish_catalog()
+"""
+
+import gzip
+import hashlib
+import json
+import sys
+from urllib.parse import quote
+
+from manifest import get_manifest
+from naming import AUDIO_EXTENSIONS, audio_ext, audio_stem, content_type, is_audio_key
+from r2_storage import get_client, BUCKET_NAME
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CATALOG_KEY = "catalog/episodes.json"
+GZIP_KEY = CATALOG_KEY + ".gz"
+BROTLI_KEY = CATALOG_KEY + ".br"
+
+
+# When an episode is stored in several formats, the first one found here is
+# the primary `url` (native AAC needs no re-encode and is usually smaller)
+PREFERRED_EXTENSIONS = ('.m4a', '.mp3')
+
+
+def catalog_entry(obj, alternates=()):
+    """One catalog row, in the shape the frontend expects from /api/episodes
+
+    `alternates` are other renditions of the same episode (e.g. an mp3 copy
+    of an m4a) for players that can't play the primary format.
+    """
+    entry = {
+        'name': obj['key'],
+        'size': obj['size'],
+        'modified': obj['last_modified'],
+        'url': f"/audio/{quote(obj['key'], safe='')}",
+        'type': content_type(obj['key']),
+        'source': 'r2',
+    }
+    meta = obj.get('meta', {})
+    if meta.get('peaks'):
+        entry['peaks'] = f"/audio/{quote(meta['peaks'], safe='')}"
+    if meta.get('chapters'):
+        entry['chapters'] = f"/audio/{quote(meta['chapters'], safe='')}"
+        # Lets the frontend search episodes by the artists they played
+        entry['artists'] = meta.get('artists', [])
+    if meta.get('hls'):
+        # Keep the slashes so the playlists' relative URIs resolve
+        entry['hls'] = f"/audio/{quote(meta['hls'], safe='/')}"
+    loudness = meta.get('loudness')
+    if loudness:
+        # Clients apply `replayGain` (dB) instead of analysing audio themselves
+        entry['loudness'] = {
+            'integrated': loudness['integrated'],
+            'truePeak': loudness['true_peak'],
+            'replayGain': loudness['replaygain'],
+        }
+    if alternates:
+        entry['alternates'] = [
+            {
+                'url': f"/audio/{quote(alt['key'], safe='')}",
+                'type': content_type(alt['key']),
+                'size': alt['size'],
+            }
+            for alt in alternates
+        ]
+    return entry
+
+
+def build_catalog(manifest=None):
+    """Catalog entries sorted by filename (YYYY-MM-DD first), newest first"""
+    manifest = manifest or get_manifest()
+
+    renditions = {}
+    for obj in manifest.objects():
+        if is_audio_key(obj['key']):
+            renditions.setdefault(audio_stem(obj['key']), []).append(obj)
+
+    order = PREFERRED_EXTENSIONS + tuple(e for e in AUDIO_EXTENSIONS if e not in PREFERRED_EXTENSIONS)
+    entries = []
+    for objs in renditions.values():
+        objs.sort(key=lambda obj: order.index(audio_ext(obj['key'])))
+        entries.append(catalog_entry(objs[0], alternates=objs[1:]))
+    entries.sort(key=lambda e: e['name'], reverse=True)
+    return entries
+
+
+def publish_catalog(manifest=None, refresh=False, force=False):
+    """Upload the compressed catalog if it changed; returns True if uploaded"""
+    manifest = manifest or get_manifest()
+    if refresh:
+        manifest.refresh()
+
+    body = json.dumps(build_catalog(manifest), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    digest = hashlib.sha256(body).hexdigest()
+    if not force and manifest.get_state('catalog_sha256') == digest:
+        return False
+
+    s3 = get_client()
+    common = {
+        'Bucket': BUCKET_NAME,
+        'ContentType': 'application/json; charset=utf-8',
+        'CacheControl': 'no-cache',
+        'Metadata': {'sha256': digest},
+    }
+    s3.put_object(Key=GZIP_KEY, Body=gzip.compress(body, 9), ContentEncoding='gzip', **common)
+    if brotli is not None:
+        s3.put_object(Key=BROTLI_KEY, Body=brotli.compress(body, quality=11), ContentEncoding='br', **common)
+    else:
+        # Don't leave a stale brotli copy for the Function to prefer
+        s3.delete_object(Bucket=BUCKET_NAME, Key=BROTLI_KEY)
+
+    manifest.set_state('catalog_sha256', digest)
+    return True
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    print("Refreshing manifest and publishing episode catalog...")
+    uploaded = publish_catalog(refresh=True, force='--force' in sys.argv)
+    print(f"  {'Uploaded' if uploaded else 'Unchanged'}: {GZIP_KEY}"
+          f"{' + ' + BROTLI_KEY if brotli is not None else ''}"
+          f" ({len(build_catalog())} episodes)")
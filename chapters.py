@@ -0,0 +1,330 @@
+"""
+Per-episode tracklists stored as chapters
+
+A tracklist (start time, artist and title per track) comes either from the
+BBC's segment data for the episode or from a supplied text file, e.g. one
+copied from 1001tracklists, one track per line:
+
+    00:00 Artist - Title
+    1:02:30 Artist - Title
+
+At ingest the tracklist is written into mp3 files as ID3v2 chapters (a CTOC
+frame plus one CHAP frame per track, with exact byte offsets found by
+mp3frames.py), and uploaded as a small `<name>.chapters.json` sidecar. The
+player lists the tracks from the sidecar and jumps straight to one, and
+each episode's artists go into the catalog so it can be searched by artist.
+
+Usage:
+    python chapters.py FILE [--episode-id ID | --tracklist TXT]   # tag a local mp3, write FILE.chapters.json
+    python chapters.py --missing [--limit N]   # sidecars for episodes in R2, from BBC segment data
+
+    from chapters import prepare_file
+    sidecar = prepare_file(path, episode_id='m002x2b1')
+
+Requirements:
+    - mutagen (optional; without it only the sidecar is written)
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import urllib.request
+from pathlib import Path
+
+import mp3frames
+from bbc_metadata import USER_AGENT, get_cache, resolve_episode
+from catalog import publish_catalog
+from manifest import get_manifest
+from naming import audio_ext, audio_stem, episode_id as key_episode_id, is_audio_key
+from r2_storage import get_client, BUCKET_NAME, DERIVED_CACHE_CONTROL
+from transcode import probe_duration
+
+try:
+    from mutagen.id3 import CHAP, CTOC, CTOCFlags, ID3, ID3NoHeaderError, TIT2, TPE1
+except ImportError:
+    ID3 = None
+
+CHAPTERS_SUFFIX = '.chapters.json'
+SIDECAR_VERSION = 1
+
+PLAYLIST_URL = "https://www.bbc.co.uk/programmes/{}/playlist.json"
+SEGMENTS_URL = "https://rms.api.bbc.co.uk/v2/versions/{}/segments"
+REQUEST_TIMEOUT = 30
+
+# "1:02:30 Artist - Title", "[62:30] Artist – Title", "00:00. Artist - Title"
+TRACK_LINE_RE = re.compile(r'^\s*\[?(\d{1,2}(?::\d{2}){1,2})\]?\s*[.)-]?\s*(.+?)\s*$')
+ARTIST_TITLE_RE = re.compile(r'\s+[-–—]\s+')
+
+# ID3 CHAP offsets use this when they're unknown
+NO_OFFSET = 0xFFFFFFFF
+
+
+def chapters_key(key):
+    """Sidecar key for an audio key: `<name>.chapters.json`"""
+    return audio_stem(key) + CHAPTERS_SUFFIX
+
+
+def parse_timestamp(text):
+    """'1:02:30' / '62:30' -> seconds"""
+    seconds = 0
+    for part in text.split(':'):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def parse_tracklist(text):
+    """Tracks from a text tracklist; lines without a timestamp are ignored"""
+    tracks = []
+    for line in text.splitlines():
+        m = TRACK_LINE_RE.match(line)
+        if not m:
+            continue
+        parts = ARTIST_TITLE_RE.split(m.group(2), maxsplit=1)
+        artist, title = parts if len(parts) == 2 else ('', parts[0])
+        tracks.append({'start': parse_timestamp(m.group(1)), 'artist': artist, 'title': title})
+    return tracks
+
+
+def _get_json(url):
+    request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+    with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+        return json.load(response)
+
+
+def fetch_bbc_tracklist(episode_id):
+    """Tracks from the BBC's segment data for an episode ([] if it has none)
+
+    Non-empty results are cached like episode metadata; an empty tracklist
+    is re-checked next time, as segment data can be added after broadcast.
+    """
+    cache = get_cache()
+    cache_key = f"segments:{episode_id}"
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Segments hang off the broadcast version, not the episode itself
+    version = (_get_json(PLAYLIST_URL.format(episode_id)).get('defaultAvailableVersion') or {}).get('pid')
+    if not version:
+        return []
+
+    tracks = []
+    for item in _get_json(SEGMENTS_URL.format(version)).get('data', []):
+        titles = item.get('titles') or {}
+        start = (item.get('offset') or {}).get('start')
+        if item.get('segment_type', 'music') != 'music' or start is None:
+            continue
+        tracks.append({'start': start, 'artist': titles.get('primary') or '', 'title': titles.get('secondary') or ''})
+
+    if tracks:
+        cache.put(cache_key, tracks)
+    return tracks
+
+
+def resolve_tracklist(episode_id=None, tracklist_path=None):
+    """(tracks, source) from a supplied file, else BBC segment data; ([], None) if neither has one"""
+    if tracklist_path:
+        return parse_tracklist(Path(tracklist_path).read_text(encoding='utf-8')), 'file'
+    if episode_id:
+        tracks = fetch_bbc_tracklist(episode_id)
+        if tracks:
+            return tracks, 'bbc'
+    return [], None
+
+
+def finalize(tracks, duration=None):
+    """Sort tracks and give each an end time (the next track's start, or the episode end)"""
+    tracks = sorted(tracks, key=lambda t: t['start'])
+    for track, following in zip(tracks, tracks[1:] + [None]):
+        track['end'] = following['start'] if following else duration
+    return tracks
+
+
+def artists(tracks):
+    """Distinct artists in tracklist order"""
+    return list(dict.fromkeys(t['artist'] for t in tracks if t['artist']))
+
+
+def _add_offsets(tracks, stream):
+    offsets = mp3frames.byte_offsets(stream, [t['start'] for t in tracks])
+    for track, offset in zip(tracks, offsets):
+        track['offset'] = offset
+
+
+def _write_id3(path, tracks):
+    try:
+        tags = ID3(path)
+    except ID3NoHeaderError:
+        tags = ID3()
+    tags.delall('CHAP')
+    tags.delall('CTOC')
+
+    ids = [f"chp{i}" for i in range(len(tracks))]
+    tags.add(CTOC(
+        element_id='toc',
+        flags=CTOCFlags.TOP_LEVEL | CTOCFlags.ORDERED,
+        child_element_ids=ids,
+        sub_frames=[TIT2(encoding=3, text=['Tracklist'])],
+    ))
+    for element_id, track, following in zip(ids, tracks, tracks[1:] + [None]):
+        end_offset = following.get('offset') if following else None
+        tags.add(CHAP(
+            element_id=element_id,
+            start_time=int(track['start'] * 1000),
+            end_time=int((track['end'] or track['start']) * 1000),
+            start_offset=track.get('offset') if track.get('offset') is not None else NO_OFFSET,
+            end_offset=end_offset if end_offset is not None else NO_OFFSET,
+            sub_frames=[TIT2(encoding=3, text=[track['title']]), TPE1(encoding=3, text=[track['artist']])],
+        ))
+    tags.save(path)
+
+
+def embed_chapters(path, tracks):
+    """Write `tracks` into an mp3 as ID3 CTOC/CHAP frames, with byte offsets
+
+    Offsets are from the start of the file, so they're measured after the
+    tag is written; the second save only changes fixed-size offset fields,
+    so the audio normally stays where it was measured.
+    """
+    _write_id3(path, tracks)
+    for _ in range(2):
+        with open(path, 'rb') as f:
+            start = mp3frames.audio_start(f)
+        with open(path, 'rb') as f:
+            _add_offsets(tracks, f)
+        _write_id3(path, tracks)
+        with open(path, 'rb') as f:
+            if mp3frames.audio_start(f) == start:
+                break
+
+
+def build_sidecar(tracks, source):
+    return {
+        'version': SIDECAR_VERSION,
+        'source': source,
+        'chapters': [
+            {
+                'start': t['start'],
+                'end': t['end'],
+                'artist': t['artist'],
+                'title': t['title'],
+                'offset': t.get('offset'),
+            }
+            for t in tracks
+        ],
+    }
+
+
+def prepare_file(path, episode_id=None, tracklist_path=None, dest=None):
+    """Resolve a tracklist for a local episode file and embed it; returns the sidecar or None
+
+    Must run before the file is uploaded: for mp3s it rewrites the ID3 tag.
+    With `dest`, the tag is written to a copy of the mp3 at `dest` (only
+    created if there is something to embed) and `path` is left untouched.
+    """
+    path = Path(path)
+    tracks, source = resolve_tracklist(episode_id, tracklist_path)
+    if not tracks:
+        return None
+
+    tracks = finalize(tracks, probe_duration(path))
+    if audio_ext(path.name) == '.mp3':
+        if ID3 is not None:
+            target = path
+            if dest is not None:
+                target = Path(dest)
+                shutil.copyfile(path, target)
+            embed_chapters(target, tracks)
+            if target != path:
+                # Keep the source's mtime so an interrupted upload of the copy can resume
+                stat = path.stat()
+                os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        else:
+            with open(path, 'rb') as f:
+                _add_offsets(tracks, f)
+    return build_sidecar(tracks, source)
+
+
+def publish_sidecar(key, sidecar):
+    """Upload the sidecar next to audio `key`; returns the manifest meta fields"""
+    sidecar_key = chapters_key(key)
+    get_client().put_object(
+        Bucket=BUCKET_NAME,
+        Key=sidecar_key,
+        Body=json.dumps(sidecar, ensure_ascii=False).encode('utf-8'),
+        ContentType='application/json',
+        CacheControl=DERIVED_CACHE_CONTROL,
+    )
+    return {'chapters': sidecar_key, 'artists': artists(sidecar['chapters'])}
+
+
+def publish_missing(limit=None):
+    """Sidecars for indexed episodes without one, from BBC segment data
+
+    The objects aren't re-tagged; mp3s are streamed once from R2 for the
+    byte offsets.
+    """
+    s3 = get_client()
+    manifest = get_manifest()
+    objs = [obj for obj in manifest.objects()
+            if is_audio_key(obj['key']) and 'chapters' not in obj['meta']
+            and (obj['episode_id'] or key_episode_id(obj['key']))]
+    if limit:
+        objs = objs[:limit]
+    print(f"{len(objs)} episodes without a tracklist")
+
+    done = 0
+    for obj in objs:
+        key = obj['key']
+        episode_id = obj['episode_id'] or key_episode_id(key)
+        try:
+            tracks = fetch_bbc_tracklist(episode_id)
+            if not tracks:
+                print(f"  - {key}: no BBC segment data")
+                continue
+            info = resolve_episode(episode_id) or {}
+            tracks = finalize(tracks, info.get('duration'))
+            if audio_ext(key) == '.mp3':
+                body = s3.get_object(Bucket=BUCKET_NAME, Key=key)['Body']
+                try:
+                    _add_offsets(tracks, body)
+                finally:
+                    body.close()
+            manifest.update_meta(key, **publish_sidecar(key, build_sidecar(tracks, 'bbc')))
+        except Exception as e:
+            print(f"  ✗ {key}: {e}")
+            continue
+        print(f"  ✓ {key}: {len(tracks)} tracks")
+        done += 1
+    return done
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description="Embed episode tracklists as chapters")
+    parser.add_argument('file', nargs='?', type=Path, help="local episode file to tag")
+    parser.add_argument('--episode-id', help="BBC episode ID to take segment data from (default: from the file name)")
+    parser.add_argument('--tracklist', type=Path, help="text tracklist, one '[H:]MM:SS Artist - Title' per line")
+    parser.add_argument('--missing', action='store_true', help="publish sidecars for indexed episodes that have none")
+    parser.add_argument('--limit', type=int, default=None, help="with --missing, at most this many episodes")
+    args = parser.parse_args()
+
+    if args.missing:
+        get_manifest().refresh()
+        if publish_missing(args.limit):
+            publish_catalog()
+            print("Episode catalog updated")
+    elif args.file:
+        sidecar = prepare_file(args.file, args.episode_id or key_episode_id(args.file.name), args.tracklist)
+        if not sidecar:
+            print(f"✗ No tracklist found for {args.file.name}")
+            sys.exit(1)
+        out = args.file.with_name(chapters_key(args.file.name))
+        out.write_text(json.dumps(sidecar, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"✓ {out.name}: {len(sidecar['chapters'])} tracks")
+    else:
+        parser.print_help()
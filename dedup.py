@@ -0,0 +1,317 @@
+"""
+Find (and optionally remove) duplicate episodes in R2 and local folders
+
+The same show ends up stored several times: under old and new names
+("Zakia Sewell sits in", "... [m002m9ss]", "... (1)"), as copies left
+behind by renames, or re-downloaded and encoded differently. This scanner
+finds both kinds:
+
+  - identical bytes: files are grouped by size, candidates get a quick
+    hash of their first and last MB (two ranged reads for bucket objects),
+    and only those that still collide are hashed in full with a streaming
+    SHA-256 (sequential ranged reads, never a whole object in memory);
+  - the same audio in a different encode: matching audio fingerprints
+    (see fingerprint.py, needs numpy), compared only between files of
+    about the same duration or sharing a date, episode ID or title.
+
+Local files and bucket objects are scanned together on one thread pool.
+Results are cached in the manifest (bucket objects in their `meta`, local
+files in its local_files table), so re-runs only look at what changed.
+
+By default duplicates are only reported. --collapse deletes the redundant
+bucket copies (with their peaks/chapters/seek sidecars and HLS renditions)
+and keeps the best-named one; --encodes extends that to different encodes
+of the same show, keeping the preferred format. Local files are never
+deleted, only reported.
+
+Usage:
+    python dedup.py [--local DIR ...] [--workers 4] [--no-fingerprint]
+    python dedup.py --collapse [--encodes]
+"""
+
+import argparse
+import hashlib
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import fingerprint
+from catalog import PREFERRED_EXTENSIONS, publish_catalog
+from manifest import get_manifest
+from naming import DATE_PREFIX_RE, audio_ext, audio_stem, is_audio_key
+from r2_storage import get_client, delete_keys, iter_keys, BUCKET_NAME
+from transcode import probe_duration
+
+HASH_WORKERS = 4
+# Bytes hashed from each end of a file for the quick hash
+QUICK_BYTES = 1024 * 1024
+# Size of each ranged read when hashing a whole object
+RANGE_SIZE = 8 * 1024 * 1024
+PRESIGNED_URL_EXPIRY = 3600
+
+# Encodes of one show differ in length by a few frames at most
+DURATION_TOLERANCE = 5.0
+
+
+class Item:
+    """A local file or bucket object being scanned"""
+
+    def __init__(self, name, size, local=None, obj=None):
+        self.name = name
+        self.size = size
+        self.local = local
+        self.obj = obj
+        if local:
+            stat = local.stat()
+            self.meta = get_manifest().local_meta(local, stat.st_size, stat.st_mtime)
+            self._mtime = stat.st_mtime
+        else:
+            # Cached results only count for the bytes they were computed from
+            meta = obj['meta'].get('dedup', {})
+            self.meta = meta if meta.get('etag') == obj['etag'] else {}
+
+    @property
+    def label(self):
+        return str(self.local) if self.local else f"r2:{self.name}"
+
+    def save(self, **fields):
+        self.meta.update(fields)
+        if self.local:
+            get_manifest().update_local_meta(self.local, self.size, self._mtime, **fields)
+        else:
+            get_manifest().update_meta(self.name, dedup={**self.meta, 'etag': self.obj['etag']})
+
+    def read_range(self, start, length):
+        if self.local:
+            with open(self.local, 'rb') as f:
+                f.seek(start)
+                return f.read(length)
+        response = get_client().get_object(
+            Bucket=BUCKET_NAME, Key=self.name, Range=f"bytes={start}-{start + length - 1}",
+        )
+        return response['Body'].read()
+
+    def source(self):
+        """Something ffmpeg can read: the path, or a presigned URL"""
+        if self.local:
+            return self.local
+        return get_client().generate_presigned_url(
+            'get_object',
+            Params={'Bucket': BUCKET_NAME, 'Key': self.name},
+            ExpiresIn=PRESIGNED_URL_EXPIRY,
+        )
+
+
+def quick_hash(item):
+    if 'quick' not in item.meta:
+        digest = hashlib.sha256(str(item.size).encode())
+        digest.update(item.read_range(0, min(QUICK_BYTES, item.size)))
+        if item.size > QUICK_BYTES:
+            tail = max(QUICK_BYTES, item.size - QUICK_BYTES)
+            digest.update(item.read_range(tail, item.size - tail))
+        item.save(quick=digest.hexdigest())
+    return item.meta['quick']
+
+
+def content_hash(item):
+    if 'sha256' not in item.meta:
+        digest = hashlib.sha256()
+        for start in range(0, item.size, RANGE_SIZE):
+            digest.update(item.read_range(start, min(RANGE_SIZE, item.size - start)))
+        item.save(sha256=digest.hexdigest())
+    return item.meta['sha256']
+
+
+def audio_fingerprint(item):
+    if 'fingerprint' not in item.meta:
+        source = item.source()
+        duration = probe_duration(source)
+        item.save(duration=duration, fingerprint=fingerprint.encode(fingerprint.fingerprint(source, duration)))
+    return item.meta['fingerprint']
+
+
+def _run(pool, func, items, what):
+    def safe(item):
+        try:
+            return item, func(item)
+        except Exception as e:
+            print(f"  ✗ {what} failed for {item.label}: {e}")
+            return item, None
+    return [(item, value) for item, value in pool.map(safe, items) if value is not None]
+
+
+def _groups(pairs):
+    groups = {}
+    for item, value in pairs:
+        groups.setdefault(value, []).append(item)
+    return [items for items in groups.values() if len(items) > 1]
+
+
+def find_identical(items, pool):
+    """Groups of items with identical bytes"""
+    by_size = _groups((item, item.size) for item in items)
+    candidates = [item for group in by_size for item in group]
+    print(f"  {len(candidates)} files share a size with another, quick-hashing them...")
+    by_quick = _groups(_run(pool, quick_hash, candidates, "Quick hash"))
+
+    candidates = [item for group in by_quick for item in group]
+    print(f"  {len(candidates)} still collide, hashing them in full...")
+    return _groups(_run(pool, content_hash, candidates, "Hash"))
+
+
+def _related(a, b):
+    """Worth comparing fingerprints: not renditions of one stem, and plausibly the same show"""
+    if audio_stem(a.name) == audio_stem(b.name) and a.local is None and b.local is None:
+        return False
+    durations = a.meta.get('duration'), b.meta.get('duration')
+    if all(durations) and abs(durations[0] - durations[1]) <= DURATION_TOLERANCE:
+        return True
+    if a.obj and b.obj:
+        return any(a.obj[f] and a.obj[f] == b.obj[f] for f in ('date', 'episode_id', 'title_norm'))
+    return False
+
+
+def find_encodes(items, pool, identical):
+    """Groups of items that are the same audio in different encodes"""
+    # One representative per identical-bytes group is enough: the copy
+    # collapse() would keep
+    duplicates = set()
+    for group in identical:
+        keep = keeper(group) or group[0]
+        duplicates.update(id(item) for item in group if item is not keep)
+    items = [item for item in items if id(item) not in duplicates]
+
+    print(f"  Fingerprinting {len(items)} files...")
+    fps = {id(item): fingerprint.decode(fp) for item, fp in _run(pool, audio_fingerprint, items, "Fingerprint")}
+    items = [item for item in items if id(item) in fps]
+
+    # Union-find over matching pairs
+    parent = {id(item): id(item) for item in items}
+
+    def root(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for i, a in enumerate(items):
+        for b in items[i + 1:]:
+            if root(id(a)) != root(id(b)) and _related(a, b) and fingerprint.matches(fps[id(a)], fps[id(b)]):
+                parent[root(id(a))] = root(id(b))
+
+    return _groups((item, root(id(item))) for item in items)
+
+
+def keeper(group):
+    """The copy to keep: preferred format, then best named (dated, shortest)"""
+    order = PREFERRED_EXTENSIONS + tuple(e for e in ('.mp3', '.m4a') if e not in PREFERRED_EXTENSIONS)
+    return min(
+        (item for item in group if item.obj),
+        key=lambda item: (
+            order.index(audio_ext(item.name)) if audio_ext(item.name) in order else len(order),
+            -item.size,
+            DATE_PREFIX_RE.match(item.name) is None,
+            len(item.name),
+        ),
+        default=None,
+    )
+
+
+def report(title, groups):
+    reclaimable = 0
+    print(f"\n{title}: {len(groups)} groups")
+    for group in groups:
+        keep = keeper(group)
+        print()
+        for item in group:
+            mark = '✓ keep' if item is keep else ('  local' if item.local else '  dup ')
+            print(f"  {mark} {item.label} ({item.size / (1024 * 1024):.1f} MB)")
+            if item.obj and keep and item is not keep:
+                reclaimable += item.size
+    print(f"\n  {reclaimable / (1024 * 1024):.1f} MB reclaimable in R2")
+
+
+def _sidecar_keys(obj):
+    keys = [obj['meta'][name] for name in ('peaks', 'chapters', 'seek') if obj['meta'].get(name)]
+    if obj['meta'].get('hls'):
+        keys.extend(iter_keys(prefix=obj['meta']['hls'].rsplit('/', 1)[0] + '/'))
+    return keys
+
+
+def collapse(groups):
+    """Delete every bucket copy but the keeper; returns the number deleted"""
+    manifest = get_manifest()
+    doomed = []
+    for group in groups:
+        keep = keeper(group)
+        doomed.extend(item.obj for item in group if item.obj and item is not keep)
+    if not doomed:
+        return 0
+
+    keys = [obj['key'] for obj in doomed]
+    for obj in doomed:
+        keys.extend(_sidecar_keys(obj))
+    failed = set(delete_keys(keys))
+
+    deleted = 0
+    for obj in doomed:
+        if obj['key'] not in failed:
+            manifest.remove(obj['key'])
+            print(f"  ✓ Deleted {obj['key']}")
+            deleted += 1
+    return deleted
+
+
+def local_items(folders):
+    items = []
+    for folder in folders:
+        for path in sorted(Path(folder).rglob('*')):
+            if path.is_file() and is_audio_key(path.name):
+                items.append(Item(path.name, path.stat().st_size, local=path))
+    return items
+
+
+def scan(folders=(), workers=HASH_WORKERS, use_fingerprints=True):
+    """(identical groups, encode groups) across the bucket and local `folders`"""
+    manifest = get_manifest()
+    manifest.refresh()
+    items = [Item(obj['key'], obj['size'], obj=obj) for obj in manifest.objects() if is_audio_key(obj['key'])]
+    items += local_items(folders)
+    print(f"Scanning {len(items)} files ({sum(1 for i in items if i.local)} local)...")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        identical = find_identical(items, pool)
+        encodes = []
+        if use_fingerprints:
+            if fingerprint.np is None:
+                print("  numpy is not installed, skipping fingerprints")
+            else:
+                encodes = find_encodes(items, pool, identical)
+    return identical, encodes
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description="Find duplicate episodes in R2 and local folders")
+    parser.add_argument('--local', nargs='*', default=[], type=Path, metavar='DIR',
+                        help="local folders to scan as well")
+    parser.add_argument('--workers', type=int, default=HASH_WORKERS,
+                        help=f"files hashed/fingerprinted concurrently (default {HASH_WORKERS})")
+    parser.add_argument('--no-fingerprint', action='store_true', help="only look for identical bytes")
+    parser.add_argument('--collapse', action='store_true', help="delete redundant copies from R2")
+    parser.add_argument('--encodes', action='store_true',
+                        help="with --collapse, also delete other encodes of the same show")
+    args = parser.parse_args()
+
+    identical, encodes = scan(args.local, args.workers, not args.no_fingerprint)
+    report("Identical files", identical)
+    if encodes:
+        report("Same audio, different encodes", encodes)
+
+    if args.collapse:
+        deleted = collapse(identical + (encodes if args.encodes else []))
+        print(f"\nDeleted {deleted} duplicate objects")
+        if deleted:
+            publish_catalog()
+            print("Episode catalog updated")
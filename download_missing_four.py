@@ -3,24 +3,31 @@ Download and upload 4 missing Gilles Peterson episodes to R2.
 Episodes: m002x2b1, m002xdzt, m002xmyp, m002y01b
 """
 
-import subprocess
 import re
 import sys
-import boto3
 from pathlib import Path
 
-sys.stdout.reconfigure(encoding='utf-8')
+from bbc_metadata import resolve_episode
+from catalog import publish_catalog
+from fetch import discard, download_audio
+from ingest import check_upload, ingest_file
+from job_queue import get_job_queue
+from manifest import get_manifest
+from naming import AUDIO_FORMAT
+from scheduler import prioritize
+from transcode import ytdlp_audio_args
+from verify import IntegrityError, format_report, verify_audio
 
-# R2 credentials
-ACCESS_KEY = "3fe1d0fac3028b108dfb1434fbeda5ab"
-SECRET_KEY = "7e39e93560a2555e2e20c57a6ea094746212d3360ee13395d8ddb40c69924516"
-ACCOUNT_ID = "daa5cfc7d0326ab77077899860d9ae03"
-BUCKET_NAME = "gparchive"
-ENDPOINT_URL = f"https://{ACCOUNT_ID}.r2.cloudflarestorage.com"
+sys.stdout.reconfigure(encoding='utf-8')
 
 DOWNLOAD_DIR = Path(__file__).parent / "downloads"
 DOWNLOAD_DIR.mkdir(exist_ok=True)
 
+# Re-list the bucket if the local manifest is older than this (seconds)
+MANIFEST_MAX_AGE = 3600
+# Rough download + verify + upload time per episode, for the expiry warnings (seconds)
+SECONDS_PER_EPISODE = 20 * 60
+
 # The 4 missing episodes with their broadcast dates
 EPISODES = [
     {"id": "m002x2b1", "date": "2026-06-06", "title": "Episode 1"},
@@ -29,21 +36,11 @@ EPISODES = [
     {"id": "m002y01b", "date": "2026-06-27", "title": "Episode 4"},
 ]
 
-s3 = boto3.client(
-    's3',
-    endpoint_url=ENDPOINT_URL,
-    aws_access_key_id=ACCESS_KEY,
-    aws_secret_access_key=SECRET_KEY,
-    region_name='auto'
-)
 
 
 def r2_exists(filename):
-    try:
-        s3.head_object(Bucket=BUCKET_NAME, Key=filename)
-        return True
-    except:
-        return False
+    """Local manifest lookup, no request to R2"""
+    return get_manifest().has_key(filename)
 
 
 def safe_filename(s):
@@ -51,7 +48,7 @@ def safe_filename(s):
 
 
 def download_episode(ep):
-    filename = safe_filename(f"{ep['date']} Gilles Peterson - {ep['title']}.mp3")
+    filename = safe_filename(f"{ep['date']} Gilles Peterson - {ep['title']}.{AUDIO_FORMAT}")
     out_path = DOWNLOAD_DIR / filename
     url = f"https://www.bbc.co.uk/programmes/{ep['id']}"
 
@@ -63,35 +60,18 @@ def download_episode(ep):
         print(f"  Already in R2, skipping.")
         return None
 
-    # yt-dlp outputs a .mp4 then we ask for mp3; the actual output file may have
-    # a different extension initially, so use a temp stem and rename after.
-    tmp_out = str(DOWNLOAD_DIR / f"{ep['id']}.%(ext)s")
-
-    result = subprocess.run(
-        [
-            'python', '-m', 'yt_dlp',
-            '--format', 'bestaudio',
-            '--extract-audio',
-            '--audio-format', 'mp3',
-            '--audio-quality', '0',
-            '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            '--output', tmp_out,
-            url,
-        ],
-        timeout=3600,
-    )
-
-    if result.returncode != 0:
-        print(f"  Download failed (exit {result.returncode})")
-        return None
-
-    # Find the downloaded file
-    candidates = list(DOWNLOAD_DIR.glob(f"{ep['id']}*"))
-    if not candidates:
-        print("  Download failed: output file not found")
-        return None
+    # yt-dlp outputs a .mp4 then converts it, under the episode ID so an
+    # interrupted download resumes; renamed once it has been verified.
+    src = download_audio(url, ep['id'], DOWNLOAD_DIR, ytdlp_audio_args(AUDIO_FORMAT), quiet=False)
+    info = resolve_episode(ep['id']) or {}
+    try:
+        report = verify_audio(src, info.get('duration'))
+    except IntegrityError:
+        # A damaged download can't be resumed: the retry starts from scratch
+        discard(DOWNLOAD_DIR, ep['id'])
+        raise
+    print(f"  ✓ Verified: {format_report(report)}")
 
-    src = candidates[0]
     dest = DOWNLOAD_DIR / filename
     src.rename(dest)
     size_mb = dest.stat().st_size / (1024 * 1024)
@@ -99,18 +79,19 @@ def download_episode(ep):
     return dest
 
 
-def upload_file(file_path):
+def upload_file(file_path, episode_id=None):
     filename = file_path.name
-    size_mb = file_path.stat().st_size / (1024 * 1024)
-    print(f"  Uploading {size_mb:.1f} MB to R2...")
+    size = file_path.stat().st_size
+    print(f"  Uploading {size / (1024 * 1024):.1f} MB to R2...")
 
-    s3.upload_file(
-        str(file_path),
-        BUCKET_NAME,
+    ingest_file(
+        file_path,
         filename,
-        Callback=lambda b: print('.', end='', flush=True),
+        episode_id=episode_id,
+        progress=lambda b: print('.', end='', flush=True),
     )
     print()
+    check_upload(filename)
     print(f"  Uploaded: {filename}")
     file_path.unlink()
     print(f"  Local file removed.")
@@ -120,10 +101,38 @@ def main():
     print("GP Archive - Downloading 4 missing episodes")
     print("=" * 60)
 
+    get_manifest().refresh(max_age=MANIFEST_MAX_AGE)
+
+    # One episode at a time, closest to expiry first. A failure is retried
+    # on a later run (after a back-off) instead of stopping the rest.
+    queue = get_job_queue()
     for ep in EPISODES:
-        file_path = download_episode(ep)
-        if file_path:
-            upload_file(file_path)
+        queue.discover(ep)
+    uploaded = 0
+    for job in prioritize(queue.due(ids={ep['id'] for ep in EPISODES}), seconds_per_job=SECONDS_PER_EPISODE):
+        try:
+            file_path = queue.local_file(job['id'])
+            if file_path:
+                print(f"\nResuming {file_path.name}: downloaded by an earlier run")
+            else:
+                with queue.attempt(job['id'], 'downloading'):
+                    file_path = download_episode(job)
+                if file_path is None:
+                    queue.advance(job['id'], 'verified')
+                    continue
+                queue.advance(job['id'], 'downloaded', path=str(file_path))
+
+            with queue.attempt(job['id'], 'uploading'):
+                upload_file(file_path, episode_id=job['id'])
+            queue.advance(job['id'], 'verified', key=file_path.name)
+            uploaded += 1
+        except Exception as e:
+            print(f"  ✗ {job['id']} failed, it will be retried on a later run: {e}")
+
+    if uploaded:
+        # Rebuild the episode catalog served by /api/episodes
+        publish_catalog()
+        print("\nEpisode catalog updated")
 
     print("\n" + "=" * 60)
     print("All done!")
@@ -1,25 +1,58 @@
 """
 Download the most recent missing GP episodes
 Based on BBC Sounds availability (usually 30 days)
+
+Missing episodes go through a fetch -> transcode -> upload pipeline, each
+stage with its own worker pool, so catching up on a backlog overlaps the
+network, CPU and upload work.
+
+With --audio-format m4a the transcode stage becomes a cheap remux of BBC's
+native AAC stream; --mp3-rendition additionally encodes an mp3 copy at low
+priority after each upload, for clients that can't play AAC. --hls also
+publishes segmented HLS renditions of each episode (see hls.py).
+
+Episodes are queued by how soon they leave BBC Sounds, with a warning if
+the backlog can't finish before some expire (see scheduler.py). Each one
+is a job in the shared job queue (see job_queue.py): failures are retried
+on later runs after a back-off, and an episode already downloaded by an
+interrupted run is uploaded without downloading it again. An interrupted
+download resumes from its partial file (see fetch.py), and a download only
+counts as done once the transcoded file has passed verification against
+BBC's listed duration (see verify.py).
+
+Usage:
+    python download_recent_missing.py [--fetch-workers 2] [--transcode-workers N] [--upload-workers 2]
+    python download_recent_missing.py --audio-format m4a [--mp3-rendition] [--hls]
 """
-import subprocess
-import boto3
+import argparse
+import functools
 from pathlib import Path
-import re
 import sys
 
-sys.stdout.reconfigure(encoding='utf-8')
+from bbc_metadata import BRAND_URL, list_episodes, resolve_episode
+from catalog import publish_catalog
+from fetch import discard, download_audio
+from hls import publish_hls
+from ingest import check_upload, ingest_file
+from job_queue import get_job_queue
+from manifest import get_manifest
+from naming import AUDIO_FORMAT, audio_stem, safe_filename
+from pipeline import Pipeline, Stage, log
+from scheduler import prioritize, record_run
+from transcode import convert_audio, default_workers, format_stats, transcode_to_mp3
+from verify import IntegrityError, format_report, verify_audio
 
-# R2 credentials
-ACCESS_KEY = "3fe1d0fac3028b108dfb1434fbeda5ab"
-SECRET_KEY = "7e39e93560a2555e2e20c57a6ea094746212d3360ee13395d8ddb40c69924516"
-ACCOUNT_ID = "daa5cfc7d0326ab77077899860d9ae03"
-BUCKET_NAME = "gparchive"
-ENDPOINT_URL = f"https://{ACCOUNT_ID}.r2.cloudflarestorage.com"
+sys.stdout.reconfigure(encoding='utf-8')
 
 DOWNLOAD_DIR = Path(__file__).parent / "downloads"
 DOWNLOAD_DIR.mkdir(exist_ok=True)
 
+# Default worker counts per pipeline stage
+FETCH_WORKERS = 2
+# One low-priority ffmpeg per couple of cores (see transcode.py)
+TRANSCODE_WORKERS = default_workers()
+UPLOAD_WORKERS = 2
+
 # Recent episodes that might still be available
 # We'll try to search for them by trying common BBC programme IDs
 # or by scraping the BBC Sounds GP page
@@ -30,155 +63,226 @@ def search_bbc_sounds():
     """
     print("Searching BBC Sounds for latest Gilles Peterson episodes...")
 
-    # BBC Sounds URL for Gilles Peterson
-    url = "https://www.bbc.co.uk/sounds/brand/b01fm4ss"
-
     try:
-        result = subprocess.run(
-            [
-                'python', '-m', 'yt_dlp',
-                '--flat-playlist',
-                '--print', 'id|||%(title)s|||%(upload_date)s',
-                '--playlist-items', '1-20',
-                '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                url,
-            ],
-            capture_output=True,
-            text=True,
-            timeout=120,
-            encoding='utf-8'
-        )
-
-        if result.returncode == 0:
-            episodes = []
-            for line in result.stdout.strip().split('\n'):
-                if '|||' in line:
-                    parts = line.split('|||')
-                    if len(parts) >= 2:
-                        ep_id = parts[0]
-                        title = parts[1]
-                        date = parts[2] if len(parts) > 2 else 'Unknown'
-
-                        # Format date from YYYYMMDD to YYYY-MM-DD
-                        if len(date) == 8 and date.isdigit():
-                            date = f"{date[0:4]}-{date[4:6]}-{date[6:8]}"
-
-                        episodes.append({
-                            'id': ep_id,
-                            'title': title,
-                            'date': date
-                        })
-
-            return episodes
-        else:
-            print(f"Error: {result.stderr}")
-            return []
+        episodes = list_episodes(BRAND_URL, limit=20)
+        return [
+            {'id': ep['id'], 'title': ep['title'], 'date': ep['date'] or 'Unknown'}
+            for ep in episodes
+        ]
     except Exception as e:
         print(f"Exception: {e}")
         return []
 
-s3 = boto3.client(
-    's3',
-    endpoint_url=ENDPOINT_URL,
-    aws_access_key_id=ACCESS_KEY,
-    aws_secret_access_key=SECRET_KEY,
-    region_name='auto'
-)
-
 def r2_exists(filename):
-    try:
-        s3.head_object(Bucket=BUCKET_NAME, Key=filename)
-        return True
-    except:
-        return False
-
-def list_r2_files():
-    """Get list of existing files in R2"""
-    response = s3.list_objects_v2(Bucket=BUCKET_NAME)
-    if 'Contents' in response:
-        return [obj['Key'] for obj in response['Contents']]
-    return []
-
-def safe_filename(s):
-    # Replace problematic characters
-    s = s.replace(':', ' -')
-    return re.sub(r'[<>"/\\|?*]', '', s)
-
-def download_episode(ep):
+    """Local manifest lookup, no request to R2"""
+    return get_manifest().has_key(filename)
+
+def episode_filename(ep, ext='.mp3'):
     # Clean title - remove "Gilles Peterson, " prefix if present
     title = ep['title']
     if title.startswith('Gilles Peterson, '):
         title = title[17:]  # Remove "Gilles Peterson, " prefix
 
-    filename = safe_filename(f"{ep['date']} Gilles Peterson - {title}.mp3")
-    out_path = DOWNLOAD_DIR / filename
+    return safe_filename(f"{ep['date']} Gilles Peterson - {title}{ext}")
+
+def fetch_episode(ep, ext='.mp3'):
+    """Pipeline stage 1: download the native audio stream (no transcode)
+
+    A job an earlier run already downloaded goes straight on to upload.
+    """
+    queue = get_job_queue()
+    queue.discover(ep)
+    path = queue.local_file(ep['id'])
+    if path:
+        log(f"[fetch] Resuming {path.name}: downloaded by an earlier run")
+        return {'ep': ep, 'path': path, 'filename': path.name}
+
+    filename = episode_filename(ep, ext)
     url = f"https://www.bbc.co.uk/programmes/{ep['id']}"
 
-    print(f"\n{'='*60}")
-    print(f"Downloading: {filename}")
-    print(f"URL: {url}")
+    log(f"[fetch] {filename}")
+    log(f"[fetch] URL: {url}")
 
     if r2_exists(filename):
-        print(f"  Already in R2, skipping.")
+        log(f"[fetch] Already in R2, skipping: {filename}")
+        queue.advance(ep['id'], 'verified', key=filename)
         return None
 
-    tmp_out = str(DOWNLOAD_DIR / f"{ep['id']}.%(ext)s")
-
-    result = subprocess.run(
-        [
-            'python', '-m', 'yt_dlp',
-            '--format', 'bestaudio',
-            '--extract-audio',
-            '--audio-format', 'mp3',
-            '--audio-quality', '0',
-            '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            '--output', tmp_out,
-            url,
-        ],
-        timeout=3600,
-    )
-
-    if result.returncode != 0:
-        print(f"  Download failed (exit {result.returncode})")
-        return None
-
-    # Find the downloaded file
-    candidates = list(DOWNLOAD_DIR.glob(f"{ep['id']}*"))
-    if not candidates:
-        print("  Download failed: output file not found")
-        return None
+    with queue.attempt(ep['id'], 'downloading'):
+        src = download_source(ep, url)
+    size_mb = src.stat().st_size / (1024 * 1024)
+    log(f"[fetch] Downloaded: {src.name} ({size_mb:.1f} MB)")
+    info = resolve_episode(ep['id']) or {}
+    return {'ep': ep, 'source': src, 'filename': filename, 'duration': info.get('duration')}
 
-    src = candidates[0]
-    dest = DOWNLOAD_DIR / filename
-    src.rename(dest)
-    size_mb = dest.stat().st_size / (1024 * 1024)
-    print(f"  Downloaded: {filename} ({size_mb:.1f} MB)")
-    return dest
+def download_source(ep, url):
+    """yt-dlp the episode's best audio stream into DOWNLOAD_DIR; returns its path
 
-def upload_file(file_path):
+    Picks up where an earlier, interrupted download of the episode stopped.
+    """
+    return download_audio(url, ep['id'], DOWNLOAD_DIR)
+
+def transcode_episode(job):
+    """Pipeline stage 2: re-encode to mp3, or remux to m4a, and verify the result"""
+    if 'source' not in job:
+        # Resumed: transcoded by an earlier run
+        return job
+    src = job['source']
+    dest = DOWNLOAD_DIR / job['filename']
+
+    log(f"[transcode] {src.name} -> {dest.name}")
+    queue = get_job_queue()
+    with queue.attempt(job['ep']['id'], 'downloading'):
+        stats = convert_audio(src, dest)
+        log(f"[transcode] {dest.name}: {format_stats(stats)}")
+        try:
+            report = verify_audio(dest, job['duration'])
+        except IntegrityError:
+            # A damaged download can't be resumed: the retry starts from scratch
+            dest.unlink()
+            discard(DOWNLOAD_DIR, job['ep']['id'])
+            raise
+    log(f"[verify] ✓ {dest.name}: {format_report(report)}")
+    src.unlink()
+
+    queue.advance(job['ep']['id'], 'downloaded', path=str(dest))
+    job['path'] = dest
+    return job
+
+def upload_file(file_path, episode_id=None, keep=False, analyze_loudness=True):
     filename = file_path.name
-    size_mb = file_path.stat().st_size / (1024 * 1024)
-    print(f"  Uploading {size_mb:.1f} MB to R2...")
-
-    s3.upload_file(
-        str(file_path),
-        BUCKET_NAME,
-        filename,
-        Callback=lambda b: print('.', end='', flush=True),
-    )
-    print()
-    print(f"  Uploaded: {filename}")
-    file_path.unlink()
-    print(f"  Local file removed.")
+    size = file_path.stat().st_size
+    log(f"[upload] Uploading {filename} ({size / (1024 * 1024):.1f} MB) to R2...")
+
+    # Loudness is analysed while the upload runs and recorded with it
+    _, loudness = ingest_file(file_path, filename, episode_id=episode_id, analyze_loudness=analyze_loudness)
+    check_upload(filename)
+    log(f"[upload] Uploaded: {filename}")
+    if loudness:
+        log(f"[upload] {filename}: {loudness['integrated']:.1f} LUFS, ReplayGain {loudness['replaygain']:+.2f} dB")
+    if not keep:
+        file_path.unlink()
+        log(f"[upload] Local file removed: {filename}")
+
+def upload_episode(job, keep=False):
+    """Pipeline stage 3: upload the episode and remove the local copy
+
+    With `keep`, the file is left for the HLS / mp3 rendition stages.
+    """
+    job['size'] = job['path'].stat().st_size
+    queue = get_job_queue()
+    with queue.attempt(job['ep']['id'], 'uploading'):
+        upload_file(job['path'], episode_id=job['ep']['id'], keep=keep)
+    queue.advance(job['ep']['id'], 'verified', key=job['path'].name)
+    return job
+
+def hls_episode(job, keep=False):
+    """Optional stage: segment the uploaded episode into HLS renditions"""
+    src = job['path']
+    log(f"[hls] Segmenting {src.name}...")
+    master = publish_hls(src, src.name)
+    log(f"[hls] Published {master}")
+    job['hls_size'] = src.stat().st_size
+    if not keep:
+        src.unlink()
+        log(f"[hls] Local file removed: {src.name}")
+    return job
+
+def mp3_rendition(job):
+    """Optional stage 4: low-priority mp3 copy of an uploaded m4a"""
+    src = job['path']
+    dest = DOWNLOAD_DIR / (audio_stem(src.name) + '.mp3')
+
+    log(f"[mp3] {src.name} -> {dest.name}")
+    stats = transcode_to_mp3(src, dest)
+    log(f"[mp3] {dest.name}: {format_stats(stats)}")
+    src.unlink()
+    job['rendition_size'] = dest.stat().st_size
+    upload_file(dest, episode_id=job['ep']['id'], analyze_loudness=False)
+    return job
+
+def find_missing(episodes, manifest):
+    missing = []
+    for ep in episodes:
+        # Check if we already have this episode (by date or by ID)
+        if not manifest.has_episode(ep):
+            print(f"  Missing: {ep['date']} - {ep['title']}")
+            missing.append(ep)
+        else:
+            print(f"  Already have: {ep['date']} - {ep['title']}")
+    return missing
+
+def build_pipeline(fetch_workers=FETCH_WORKERS, transcode_workers=TRANSCODE_WORKERS,
+                   upload_workers=UPLOAD_WORKERS, audio_format=AUDIO_FORMAT, mp3_copy=False, hls=False):
+    mp3_copy = mp3_copy and audio_format == 'm4a'
+    stages = [
+        Stage('fetch', functools.partial(fetch_episode, ext=f'.{audio_format}'), workers=fetch_workers,
+              size_of=lambda job: job['source'].stat().st_size),
+        Stage('transcode', transcode_episode, workers=transcode_workers,
+              size_of=lambda job: job['path'].stat().st_size),
+        Stage('upload', functools.partial(upload_episode, keep=mp3_copy or hls), workers=upload_workers,
+              size_of=lambda job: job['size']),
+    ]
+    if hls:
+        stages.append(Stage('hls', functools.partial(hls_episode, keep=mp3_copy), workers=1,
+                            size_of=lambda job: job['hls_size']))
+    if mp3_copy:
+        stages.append(Stage('mp3', mp3_rendition, workers=1, size_of=lambda job: job['rendition_size']))
+    return Pipeline(stages)
+
+def run_downloads(episodes, **pipeline_args):
+    """Run `episodes` through the pipeline, closest to expiry first; returns the number uploaded
+
+    Jobs from earlier runs whose retry is due come along; jobs still
+    backing off wait for a later run.
+    """
+    queue = get_job_queue()
+    for ep in episodes:
+        if queue.discover(ep)['state'] == 'verified':
+            # Archived once, but no longer in the bucket
+            queue.advance(ep['id'], 'discovered')
+    jobs = queue.due()
+    due_ids = {job['id'] for job in jobs}
+    waiting = sum(1 for ep in episodes if ep['id'] not in due_ids)
+    if waiting:
+        log(f"[queue] {waiting} episodes are backing off after failures (see `python job_queue.py`)")
+    if not jobs:
+        return 0
+
+    pipe = build_pipeline(**pipeline_args)
+    pipe.run(prioritize(jobs, pipe.stages))
+    record_run(pipe.stages)
+    pipe.print_summary()
+    # Count episodes that reached R2, even if an optional HLS / mp3 copy failed
+    return next(stage for stage in pipe.stages if stage.name == 'upload').completed
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Download recent missing GP episodes")
+    parser.add_argument('--fetch-workers', type=int, default=FETCH_WORKERS,
+                        help=f"concurrent yt-dlp downloads (default {FETCH_WORKERS})")
+    parser.add_argument('--transcode-workers', type=int, default=TRANSCODE_WORKERS,
+                        help=f"concurrent ffmpeg transcodes (default {TRANSCODE_WORKERS}, from the core count)")
+    parser.add_argument('--upload-workers', type=int, default=UPLOAD_WORKERS,
+                        help=f"concurrent R2 uploads (default {UPLOAD_WORKERS})")
+    parser.add_argument('--audio-format', choices=('mp3', 'm4a'), default=AUDIO_FORMAT,
+                        help=f"archive format: mp3 re-encode or m4a remux of the AAC stream (default {AUDIO_FORMAT})")
+    parser.add_argument('--mp3-rendition', action='store_true',
+                        help="with --audio-format m4a, also upload a low-priority mp3 copy")
+    parser.add_argument('--hls', action='store_true',
+                        help="also publish segmented HLS renditions of each episode")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+
     print("GP Archive - Finding and downloading recent missing episodes")
     print("=" * 60)
 
-    # Get existing files
+    # Sync the local index of existing files
     print("\nChecking existing files in R2...")
-    existing = list_r2_files()
-    print(f"Found {len([f for f in existing if f.endswith('.mp3')])} existing MP3 files")
+    manifest = get_manifest()
+    manifest.refresh()
+    print(f"Found {manifest.count()} existing episode files")
 
     # Search for episodes
     episodes = search_bbc_sounds()
@@ -190,23 +294,22 @@ def main():
     print(f"\nFound {len(episodes)} episodes on BBC Sounds")
     print("\nChecking which ones are missing...")
 
-    downloaded_count = 0
-    for ep in episodes:
-        # Check if we already have this episode (by date or by ID)
-        date_match = any(ep['date'] in f for f in existing)
-        id_match = any(ep['id'] in f for f in existing)
-
-        if not date_match and not id_match:
-            print(f"\n  Missing: {ep['date']} - {ep['title']}")
-            file_path = download_episode(ep)
-            if file_path:
-                upload_file(file_path)
-                downloaded_count += 1
-        else:
-            print(f"  Already have: {ep['date']} - {ep['title']}")
+    missing = find_missing(episodes, manifest)
+    if not missing and not get_job_queue().due():
+        print("\nNothing to download.")
+        return
+
+    uploaded = run_downloads(missing, fetch_workers=args.fetch_workers, transcode_workers=args.transcode_workers,
+                             upload_workers=args.upload_workers, audio_format=args.audio_format,
+                             mp3_copy=args.mp3_rendition, hls=args.hls)
+
+    if uploaded:
+        # Rebuild the episode catalog served by /api/episodes
+        publish_catalog()
+        print("\nEpisode catalog updated")
 
     print("\n" + "=" * 60)
-    print(f"Downloaded and uploaded {downloaded_count} new episodes!")
+    print(f"Downloaded and uploaded {uploaded} new episodes!")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,154 @@
+"""
+Resumable yt-dlp downloads for the download scripts
+
+yt-dlp writes an episode to `<name>.<ext>.part`, with a `.ytdl` file
+recording which HLS/DASH fragments are done, and only renames it once it's
+complete. Every download of an episode uses the same name (its BBC episode
+ID), so one that was interrupted - killed, VPN dropped, machine asleep -
+carries on from the last fragment on the next run instead of starting
+over. Partial files stay until the episode has downloaded and passed
+verification (see verify.py).
+
+There is no overall time limit: a three hour episode over a slow VPN can
+outlast any fixed one. Instead a download whose files haven't changed for
+STALL_TIMEOUT is killed and restarted, resuming where it stopped, up to
+MAX_RESTARTS times.
+
+The finished file is the path yt-dlp reports after post-processing, never
+a glob match, so a leftover `.part`, `.ytdl` or `.temp` file can't be
+mistaken for the episode.
+
+Usage:
+    from fetch import discard, download_audio
+    path = download_audio(url, ep['id'], DOWNLOAD_DIR, ytdlp_audio_args('mp3'))
+    ...
+    discard(DOWNLOAD_DIR, ep['id'])   # damaged: the next attempt starts afresh
+
+Requirements:
+    - yt-dlp installed: pip install yt-dlp
+"""
+
+import glob
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from bbc_metadata import USER_AGENT
+from pipeline import log
+
+# Restart a download whose files haven't changed for this long (seconds)
+STALL_TIMEOUT = 10 * 60
+MAX_RESTARTS = 3
+POLL_INTERVAL = 15
+
+RESUME_ARGS = [
+    '--continue', '--part',
+    # yt-dlp's own HLS downloader resumes by fragment; ffmpeg's can't resume at all
+    '--downloader', 'm3u8:native',
+    '--retries', '10',
+    '--fragment-retries', '20',
+    '--retry-sleep', 'fragment:exp=1:60',
+    '--socket-timeout', '60',
+]
+# Name fragments of yt-dlp's in-progress files
+PARTIAL_MARKERS = ('.part', '.ytdl', '.temp', '.tmp')
+PATH_SUFFIX = '.filepath'
+
+
+def episode_files(directory, name):
+    """Every file a download of `name` has left in `directory`"""
+    return [p for p in Path(directory).glob(f"{glob.escape(name)}.*") if p.is_file()]
+
+
+def partial_files(directory, name):
+    """In-progress files of a download of `name` (never a finished episode)"""
+    return [
+        p for p in episode_files(directory, name)
+        if any(marker in p.name[len(name):] for marker in PARTIAL_MARKERS) or p.name.endswith(PATH_SUFFIX)
+    ]
+
+
+def discard(directory, name):
+    """Remove everything a download of `name` left, so the next one starts from scratch"""
+    for path in episode_files(directory, name):
+        path.unlink()
+
+
+def _footprint(directory, name):
+    return sorted((p.name, p.stat().st_size) for p in episode_files(directory, name))
+
+
+def _wait(proc, directory, name, stall_timeout):
+    """Wait for yt-dlp; False (after killing it) if its files stopped changing"""
+    footprint, changed_at = None, time.monotonic()
+    while True:
+        try:
+            proc.wait(timeout=POLL_INTERVAL)
+            return True
+        except subprocess.TimeoutExpired:
+            pass
+        current = _footprint(directory, name)
+        if current != footprint:
+            footprint, changed_at = current, time.monotonic()
+        elif time.monotonic() - changed_at > stall_timeout:
+            proc.kill()
+            proc.wait()
+            return False
+
+
+def download_audio(url, name, directory, extra_args=(), quiet=True, stall_timeout=STALL_TIMEOUT):
+    """yt-dlp the best audio of `url` to `directory`/`name`.<ext>; returns the finished file's path
+
+    `extra_args` go to yt-dlp as well (e.g. ytdlp_audio_args()). With
+    `quiet`, yt-dlp's output is kept out of the console and its errors go
+    into the exception. Raises RuntimeError on failure, leaving any partial
+    files for the next attempt to resume.
+    """
+    directory = Path(directory)
+    path_file = directory / f"{name}{PATH_SUFFIX}"
+    command = [
+        'python', '-m', 'yt_dlp',
+        '--format', 'bestaudio',
+        *RESUME_ARGS,
+        *extra_args,
+        '--user-agent', USER_AGENT,
+        '--output', str(directory / f"{name}.%(ext)s"),
+        '--print-to-file', 'after_move:filepath', str(path_file),
+        url,
+    ]
+    if quiet:
+        command.insert(3, '--no-progress')
+
+    for restart in range(MAX_RESTARTS + 1):
+        if restart:
+            log(f"[fetch] {name}: no progress for {stall_timeout // 60} min, resuming "
+                f"(restart {restart}/{MAX_RESTARTS})")
+        if path_file.exists():
+            path_file.unlink()
+        with tempfile.TemporaryFile() as errors:
+            proc = subprocess.Popen(
+                command,
+                stdout=subprocess.DEVNULL if quiet else None,
+                stderr=errors if quiet else None,
+            )
+            if not _wait(proc, directory, name, stall_timeout):
+                continue
+            errors.seek(0)
+            stderr = errors.read().decode('utf-8', 'replace').strip()
+
+        if proc.returncode != 0:
+            detail = f": {stderr[-2000:]}" if stderr else ""
+            raise RuntimeError(f"download of {name} failed (exit {proc.returncode}){detail}")
+        try:
+            path = Path(path_file.read_text(encoding='utf-8').splitlines()[-1].strip())
+        except (OSError, IndexError):
+            raise RuntimeError(f"download of {name} failed: yt-dlp reported no output file")
+        if not path.is_file():
+            raise RuntimeError(f"download of {name} failed: {path.name} not found")
+        for partial in partial_files(directory, name):
+            partial.unlink()
+        return path
+
+    raise RuntimeError(f"download of {name} stalled {MAX_RESTARTS + 1} times; "
+                       f"partial files kept for the next attempt")
@@ -1,45 +1,185 @@
 """
-Find missing GP episodes by checking date gaps
+Find gaps in the archive against the BBC broadcast calendar
+
+The expected calendar comes from the programme's BBC episode guide, not
+from a hand-maintained list of Saturdays. Every episode seen in the guide
+is kept in the manifest's state table (manifest.db), which is never
+evicted, so the calendar keeps growing after episodes drop off the guide. Archive objects with a known episode
+ID and date are added to it as well.
+
+Gaps are found with set and interval operations against the manifest:
+  - a scheduled episode is covered if its ID is in the bucket (from the
+    manifest or the `[m002m9ss]` in a key). Only archived episodes with
+    no ID fall back to dates: one dated within DATE_TOLERANCE days of a
+    broadcast covers it (BBC dates and file names can be a day apart).
+    Matching by ID first keeps a broadcast a day away from an archived
+    episode, such as a special, from hiding behind it;
+  - a broadcast week (Monday to Sunday) with neither a scheduled nor an
+    archived episode is an unlisted gap, whichever weekday the show aired.
+
+Scheduled gaps broadcast in the last AVAILABILITY_DAYS can still be
+downloaded; older ones have expired, as have unlisted weeks (there is no
+episode to fetch). --download feeds the downloadable gaps straight into
+the fetch -> transcode -> upload pipeline of download_recent_missing.py,
+those closest to expiry first (see scheduler.py).
+
+Usage:
+    python find_missing_episodes.py                     # report gaps since the first archived episode
+    python find_missing_episodes.py --since 2025-10-01
+    python find_missing_episodes.py --download [--audio-format m4a]
 """
-from datetime import datetime, timedelta
+
+import argparse
+import bisect
+import json
 import sys
+from datetime import date, timedelta
+
+from bbc_metadata import AVAILABILITY_DAYS, GUIDE_URL, get_cache, list_episodes, resolve_episodes
+from catalog import publish_catalog
+from download_recent_missing import run_downloads
+from manifest import get_manifest
+from naming import AUDIO_FORMAT, episode_id, is_audio_key
+
+# Episodes read from the guide per run; older ones are already in the stored schedule
+SCHEDULE_LIMIT = 100
+SCHEDULE_STATE = 'schedule'
+# Where earlier versions kept the schedule (in the size-bounded BBC cache)
+LEGACY_SCHEDULE_KEY = f"schedule:{GUIDE_URL}"
+DATE_TOLERANCE = 1
+
+
+def fetch_schedule(limit=SCHEDULE_LIMIT):
+    """Known broadcasts ({'id', 'title', 'date'}), oldest first
+
+    The guide is merged into the stored schedule; guide entries without a
+    date are resolved (and cached) through their episode pages.
+    """
+    manifest = get_manifest()
+    stored = manifest.get_state(SCHEDULE_STATE)
+    schedule = json.loads(stored) if stored else get_cache().get(LEGACY_SCHEDULE_KEY) or {}
+
+    try:
+        listed = list_episodes(GUIDE_URL, limit=limit)
+    except Exception as e:
+        print(f"  ✗ Could not read the BBC episode guide, using the stored schedule: {e}")
+        listed = []
+
+    undated = [ep['id'] for ep in listed if not ep['date'] and not schedule.get(ep['id'], {}).get('date')]
+    resolved = resolve_episodes(undated) if undated else {}
+    for ep in listed:
+        info = resolved.get(ep['id']) or schedule.get(ep['id']) or ep
+        schedule[ep['id']] = {'id': ep['id'], 'title': info['title'] or ep['title'], 'date': ep['date'] or info['date']}
+
+    if listed or not stored:
+        manifest.set_state(SCHEDULE_STATE, json.dumps(schedule))
+    return sorted((ep for ep in schedule.values() if ep['date']), key=lambda ep: ep['date'])
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _near(day, days, tolerance=DATE_TOLERANCE):
+    """True if sorted `days` has one within `tolerance` days of `day`"""
+    i = bisect.bisect_left(days, day - timedelta(days=tolerance))
+    return i < len(days) and days[i] <= day + timedelta(days=tolerance)
+
+
+def find_gaps(schedule, objs, since=None, today=None):
+    """Gaps between `since` and `today`, oldest first
+
+    Each gap is {'date', 'id', 'title', 'status'}, with status
+    'downloadable', 'expired' or 'unlisted' (a week nothing is known about).
+    """
+    today = today or date.today()
+    archived = [
+        {**obj, 'episode_id': obj['episode_id'] or episode_id(obj['key'])}
+        for obj in objs if is_audio_key(obj['key'])
+    ]
+    archived_ids = {obj['episode_id'] for obj in archived if obj['episode_id']}
+    archived_days = sorted({date.fromisoformat(obj['date']) for obj in archived if obj['date']})
+    # Only episodes without an ID are matched to broadcasts by date
+    unidentified_days = sorted({
+        date.fromisoformat(obj['date']) for obj in archived if obj['date'] and not obj['episode_id']
+    })
+    if since is None:
+        if not archived_days:
+            return []
+        since = archived_days[0]
+
+    # Archive episodes the guide no longer lists still mark their broadcast
+    known = {ep['id']: ep for ep in schedule}
+    for obj in archived:
+        if obj['episode_id'] and obj['date'] and obj['episode_id'] not in known:
+            known[obj['episode_id']] = {'id': obj['episode_id'], 'title': obj['key'], 'date': obj['date']}
+    scheduled = [ep for ep in known.values() if since <= date.fromisoformat(ep['date']) <= today]
+
+    available_from = today - timedelta(days=AVAILABILITY_DAYS)
+    gaps = []
+    for ep in scheduled:
+        day = date.fromisoformat(ep['date'])
+        if ep['id'] in archived_ids or _near(day, unidentified_days):
+            continue
+        status = 'downloadable' if day >= available_from else 'expired'
+        gaps.append({**ep, 'status': status})
+
+    # Complete weeks in range with no broadcast known and nothing archived
+    first, last = week_start(since), week_start(today) - timedelta(weeks=1)
+    expected = {first + timedelta(weeks=n) for n in range((last - first).days // 7 + 1)}
+    covered = {week_start(day) for day in archived_days}
+    covered |= {week_start(date.fromisoformat(ep['date'])) for ep in scheduled}
+    for week in sorted(expected - covered):
+        gaps.append({'date': week.isoformat(), 'id': None, 'title': f"week of {week.isoformat()}", 'status': 'unlisted'})
+
+    return sorted(gaps, key=lambda gap: gap['date'])
+
+
+def report(gaps):
+    print("\nMissing GP episodes:")
+    print("=" * 60)
+    marks = {'downloadable': '↓', 'expired': '✗', 'unlisted': '?'}
+    for gap in gaps:
+        episode_id = f" [{gap['id']}]" if gap['id'] else ''
+        print(f"  {marks[gap['status']]} {gap['date']} {gap['title']}{episode_id} ({gap['status']})")
+
+    counts = {status: sum(1 for gap in gaps if gap['status'] == status) for status in marks}
+    print(f"\nTotal missing: {len(gaps)} "
+          f"({counts['downloadable']} downloadable, {counts['expired']} expired, {counts['unlisted']} unlisted weeks)")
+
+
+def download(gaps, audio_format=AUDIO_FORMAT):
+    """Run the downloadable gaps through the download pipeline; returns the number uploaded"""
+    episodes = [{'id': gap['id'], 'title': gap['title'], 'date': gap['date']}
+                for gap in gaps if gap['status'] == 'downloadable']
+    if not episodes:
+        return 0
+    return run_downloads(episodes, audio_format=audio_format)
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description="Find gaps in the archive against the BBC broadcast calendar")
+    parser.add_argument('--since', type=date.fromisoformat, default=None,
+                        help="first date to check, YYYY-MM-DD (default: the first archived episode)")
+    parser.add_argument('--download', action='store_true', help="download the gaps that are still available")
+    parser.add_argument('--audio-format', choices=('mp3', 'm4a'), default=AUDIO_FORMAT,
+                        help=f"with --download, archive format (default {AUDIO_FORMAT})")
+    args = parser.parse_args()
+
+    manifest = get_manifest()
+    manifest.refresh()
+    print("Reading the BBC broadcast calendar...")
+    schedule = fetch_schedule()
+    print(f"{len(schedule)} known broadcasts, {manifest.count()} objects in R2")
+
+    gaps = find_gaps(schedule, manifest.objects(), args.since)
+    report(gaps)
 
-sys.stdout.reconfigure(encoding='utf-8')
-
-# Existing episodes from R2
-existing_dates = [
-    "2025-10-18", "2025-10-25", "2025-11-01", "2025-11-08", "2025-11-15",
-    "2025-11-29", "2025-12-06", "2025-12-13", "2025-12-20", "2025-12-27",
-    "2026-01-03", "2026-01-10", "2026-01-18", "2026-01-25",
-    "2026-02-01", "2026-02-08", "2026-02-14", "2026-02-21", "2026-02-28",
-    "2026-03-07", "2026-03-14", "2026-03-21",
-    "2026-04-05",
-    "2026-05-09", "2026-05-16", "2026-05-23", "2026-05-30",
-    "2026-06-13", "2026-06-20", "2026-06-27"
-]
-
-# Convert to datetime objects
-existing = [datetime.strptime(d, "%Y-%m-%d") for d in existing_dates]
-existing.sort()
-
-# GP airs on Saturdays
-start_date = existing[0]
-end_date = datetime(2026, 7, 13)  # Today
-
-missing = []
-current = start_date
-
-while current <= end_date:
-    # Only check Saturdays (weekday 5)
-    if current.weekday() == 5:
-        if current not in existing:
-            missing.append(current.strftime("%Y-%m-%d"))
-    current += timedelta(days=1)
-
-print("Missing GP Episodes (Saturdays):")
-print("=" * 60)
-for date in missing:
-    print(f"  {date}")
-
-print(f"\nTotal missing: {len(missing)} episodes")
-print("\nNote: Some may not be available on BBC anymore")
+    if args.download:
+        uploaded = download(gaps, args.audio_format)
+        if uploaded:
+            publish_catalog()
+            print("\nEpisode catalog updated")
+        print(f"\nDownloaded and uploaded {uploaded} episodes")
@@ -0,0 +1,156 @@
+"""
+Audio fingerprints that survive re-encoding
+
+Two copies of the same show encoded differently (mp3 vs m4a, another
+bitrate, a re-download) share no bytes, but they sound the same. A
+fingerprint here is the classic sub-band energy scheme: the audio is
+decoded to low-rate mono, split into overlapping frames, and each frame
+becomes a 16-bit code, one bit per pair of adjacent frequency bands, set
+when the energy difference between the bands grew since the previous
+frame. Those signs barely change under lossy compression, so two encodes
+of one show agree on most bits, and unrelated audio on about half.
+
+Only a window of each episode is fingerprinted, starting well past the
+intro and idents that repeat every week. ffmpeg seeks before decoding, so
+for a (presigned) URL only the window's byte range is fetched.
+
+Usage:
+    python fingerprint.py FILE_A FILE_B     # compare two files
+
+    from fingerprint import fingerprint, compare
+    ber, shift = compare(fingerprint(a), fingerprint(b))
+
+Requirements:
+    - ffmpeg (and ffprobe) on PATH
+    - numpy
+"""
+
+import base64
+import subprocess
+import sys
+
+from transcode import probe_duration
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FP_SAMPLE_RATE = 5512
+FP_FRAME = 2048
+FP_HOP = 512
+# 17 log-spaced bands between these frequencies give 16 bits per frame
+FP_MIN_HZ = 300
+FP_MAX_HZ = 2000
+FP_BANDS = 17
+
+# Window: FP_SECONDS of audio starting FP_OFFSET seconds in
+FP_OFFSET = 600
+FP_SECONDS = 90
+
+# Copies may be trimmed differently at the start, so codes are compared at
+# every alignment up to this far apart
+MAX_SHIFT_SECONDS = 15
+# Bit error rate below which two fingerprints are the same audio
+MATCH_THRESHOLD = 0.30
+# Minimum overlap (in frames) for a comparison to count
+MIN_OVERLAP = 200
+
+
+def decode_pcm(source, offset, seconds):
+    """Mono int16 samples at FP_SAMPLE_RATE for `seconds` of `source` from `offset`"""
+    result = subprocess.run(
+        [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-ss', str(offset), '-t', str(seconds),
+            '-i', str(source),
+            '-vn', '-ac', '1', '-ar', str(FP_SAMPLE_RATE),
+            '-f', 's16le', '-acodec', 'pcm_s16le',
+            'pipe:1',
+        ],
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed on {source}: {result.stderr.decode('utf-8', 'replace').strip()[-500:]}")
+    return np.frombuffer(result.stdout, dtype='<i2')
+
+
+def codes(samples):
+    """One uint16 code per frame of `samples` (see the module docstring)"""
+    count = (len(samples) - FP_FRAME) // FP_HOP + 1
+    if count < 2:
+        return np.zeros(0, dtype='<u2')
+
+    starts = FP_HOP * np.arange(count)[:, None]
+    frames = samples[starts + np.arange(FP_FRAME)[None, :]].astype(np.float32) * np.hanning(FP_FRAME)
+    power = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+
+    freqs = np.fft.rfftfreq(FP_FRAME, 1 / FP_SAMPLE_RATE)
+    edges = np.geomspace(FP_MIN_HZ, FP_MAX_HZ, FP_BANDS + 1)
+    band = np.digitize(freqs, edges) - 1
+    energy = np.stack([power[:, band == b].sum(axis=1) for b in range(FP_BANDS)], axis=1)
+
+    across = energy[:, :-1] - energy[:, 1:]
+    bits = (across[1:] - across[:-1]) > 0
+    return np.packbits(bits, axis=1, bitorder='little').view('<u2').ravel()
+
+
+def fingerprint(source, duration=None, margin=0):
+    """Fingerprint codes for a window of `source` (path or URL)
+
+    `margin` widens the window by that many seconds on each side, for
+    reference fingerprints that other windows are looked up in.
+    """
+    if np is None:
+        raise RuntimeError("numpy is not installed")
+    duration = duration or probe_duration(source) or 0
+    seconds = FP_SECONDS + 2 * margin
+    # Short files: fingerprint the middle instead
+    if duration >= FP_OFFSET + FP_SECONDS + margin:
+        offset = FP_OFFSET - margin
+    else:
+        offset = max(0, (duration - seconds) / 2)
+    return codes(decode_pcm(source, offset, seconds))
+
+
+def encode(fp):
+    """Codes -> compact string for the manifest"""
+    return base64.b64encode(fp.astype('<u2').tobytes()).decode('ascii')
+
+
+def decode(text):
+    return np.frombuffer(base64.b64decode(text), dtype='<u2')
+
+
+def compare(a, b, max_shift=None):
+    """(lowest bit error rate, shift in frames) over the alignments of `a` and `b`"""
+    if max_shift is None:
+        max_shift = int(MAX_SHIFT_SECONDS * FP_SAMPLE_RATE / FP_HOP)
+    best = (1.0, 0)
+    for shift in range(-max_shift, max_shift + 1):
+        x = a[max(0, shift):]
+        y = b[max(0, -shift):]
+        n = min(len(x), len(y))
+        if n < MIN_OVERLAP:
+            continue
+        errors = np.unpackbits(np.bitwise_xor(x[:n], y[:n]).view(np.uint8)).sum()
+        ber = errors / (n * 16)
+        if ber < best[0]:
+            best = (float(ber), shift)
+    return best
+
+
+def matches(a, b):
+    return compare(a, b)[0] < MATCH_THRESHOLD
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+    fp_a, fp_b = fingerprint(sys.argv[1]), fingerprint(sys.argv[2])
+    ber, shift = compare(fp_a, fp_b)
+    verdict = "same audio" if ber < MATCH_THRESHOLD else "different audio"
+    print(f"Bit error rate {ber:.3f} at {shift * FP_HOP / FP_SAMPLE_RATE:+.1f}s: {verdict}")
@@ -0,0 +1,336 @@
+"""
+Identify untitled or misdated episodes by audio fingerprint
+
+Reference fingerprints (see fingerprint.py) come from two places:
+  - preview clips of BBC episodes: yt-dlp resolves the episode's stream
+    URL and ffmpeg decodes only a few minutes from it, so nothing is
+    downloaded in full (the BBC keeps episodes for about 30 days);
+  - archive episodes whose episode ID and date are already known.
+
+References are kept in fingerprints.db, and every 16-bit frame code of
+them goes into an in-memory inverted index (code -> reference, frame). A
+query looks up each of its codes and votes for (reference, frame offset)
+pairs: the same show piles its votes onto one offset however the files
+were trimmed or encoded, while chance hits scatter. The lookups and the
+vote count are a few numpy array operations, so a query takes
+milliseconds even with thousands of episodes indexed.
+
+Usage:
+    python fpindex.py --add-bbc [--limit 20]   # index recent BBC episodes
+    python fpindex.py --add-archive            # index archive episodes with a known ID and date
+    python fpindex.py --identify [FILE...]     # default: archive episodes missing an ID or date
+    python fpindex.py --identify --apply       # record matches in the manifest
+
+After --apply, `python rename_with_dates.py --rule dated` gives the
+identified files their dated names.
+
+Requirements:
+    - ffmpeg, yt-dlp and numpy
+"""
+
+import argparse
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import fingerprint
+from bbc_metadata import BRAND_URL, EPISODE_URL, list_episodes, resolve_episode
+from dedup import Item, audio_fingerprint
+from manifest import get_manifest
+from naming import is_audio_key
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INDEX_PATH = Path(__file__).parent / "fingerprints.db"
+
+INDEX_WORKERS = 2
+# Reference windows reach this many seconds past a query window on each
+# side, so differently trimmed copies still overlap it fully
+REFERENCE_MARGIN = 30
+
+# Silence and clipping give all-zero / all-one codes; they match everything
+STOP_CODES = {0x0000, 0xFFFF}
+# A match needs this many aligned code hits, and this share of the query's frames
+MIN_VOTES = 12
+MIN_SCORE = 0.03
+CODE_SPACE = 1 << 16
+# Larger than twice the frames in any window, so (ref, offset) packs into one int
+OFFSET_SPAN = 1 << 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS refs (
+    id INTEGER PRIMARY KEY,
+    source TEXT UNIQUE,
+    episode_id TEXT,
+    date TEXT,
+    title TEXT,
+    codes BLOB,
+    added_at REAL
+);
+"""
+
+
+class FingerprintIndex:
+    """Inverted index from fingerprint codes to reference episodes
+
+    References are stored in SQLite; the posting lists are rebuilt in
+    memory (one argsort, well under a second for thousands of episodes)
+    on the first query after a change.
+    """
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = Path(path)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.executescript(SCHEMA)
+        self._postings = None
+
+    def has(self, source):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM refs WHERE source = ?", (source,)).fetchone() is not None
+
+    def add(self, source, codes, episode_id=None, date=None, title=None):
+        """Index a reference fingerprint, replacing any earlier one for `source`"""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO refs (source, episode_id, date, title, codes, added_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (source, episode_id, date, title, np.asarray(codes, dtype='<u2').tobytes(), time.time()),
+            )
+            self._postings = None
+
+    def _load(self):
+        """(ref ids, posting refs, posting frames, start of each code's postings)"""
+        with self._lock:
+            if self._postings is None:
+                rows = self._db.execute("SELECT id, codes FROM refs ORDER BY id").fetchall()
+                ids = np.array([row['id'] for row in rows], dtype=np.int64)
+                fps = [np.frombuffer(row['codes'], dtype='<u2') for row in rows]
+                codes = np.concatenate(fps) if fps else np.zeros(0, dtype='<u2')
+                refs = np.repeat(np.arange(len(fps), dtype=np.int32), [len(fp) for fp in fps])
+                frames = np.concatenate([np.arange(len(fp), dtype=np.int32) for fp in fps]) if fps else refs
+
+                order = np.argsort(codes, kind='stable')
+                starts = np.searchsorted(codes[order], np.arange(CODE_SPACE + 1))
+                self._postings = ids, refs[order], frames[order], starts
+            return self._postings
+
+    def query(self, codes, limit=3):
+        """Best matching references, most votes first
+
+        Each result is the reference row plus `votes`, `score` (votes per
+        query frame) and `offset` (seconds into the reference window where
+        the query window starts).
+        """
+        ids, post_refs, post_frames, starts = self._load()
+        codes = np.asarray(codes, dtype=np.int64)
+        frames = np.flatnonzero(~np.isin(codes, list(STOP_CODES)))
+        lo, hi = starts[codes[frames]], starts[codes[frames] + 1]
+        counts = hi - lo
+        if not counts.sum():
+            return []
+
+        # Every posting of every query code votes for (ref, ref frame - query
+        # frame), packed into one int so numpy can count them
+        ends = np.cumsum(counts)
+        hits = np.arange(ends[-1]) - np.repeat(ends - counts - lo, counts)
+        keys = (post_refs[hits].astype(np.int64) * OFFSET_SPAN + OFFSET_SPAN // 2
+                + post_frames[hits] - np.repeat(frames, counts))
+        keys, votes = np.unique(keys, return_counts=True)
+
+        # Encoder delays can split an alignment across neighbouring offsets
+        adjacent = np.diff(keys) == 1
+        totals = votes.copy()
+        totals[1:] += np.where(adjacent, votes[:-1], 0)
+        totals[:-1] += np.where(adjacent, votes[1:], 0)
+
+        # Best offset per reference, then the best references
+        ranked = np.argsort(-totals, kind='stable')
+        _, first = np.unique(keys[ranked] // OFFSET_SPAN, return_index=True)
+        picks = ranked[np.sort(first)][:limit]
+
+        results = []
+        for pick in picks:
+            ref, offset = divmod(int(keys[pick]), OFFSET_SPAN)
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT id, source, episode_id, date, title, added_at FROM refs WHERE id = ?", (int(ids[ref]),),
+                ).fetchone()
+            results.append({
+                **dict(row),
+                'votes': int(totals[pick]),
+                'score': int(totals[pick]) / max(1, len(codes)),
+                'offset': (offset - OFFSET_SPAN // 2) * fingerprint.FP_HOP / fingerprint.FP_SAMPLE_RATE,
+            })
+        return results
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Return the process-wide fingerprint index, opening it on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = FingerprintIndex()
+    return _index
+
+
+def best_match(results):
+    """The top result if it's a confident match (clearly ahead of the runner-up), else None"""
+    if not results:
+        return None
+    top = results[0]
+    if top['votes'] < MIN_VOTES or top['score'] < MIN_SCORE:
+        return None
+    if len(results) > 1 and results[1]['votes'] * 2 > top['votes']:
+        return None
+    return top
+
+
+def stream_url(episode_id):
+    """Direct audio stream URL of a BBC episode (ffmpeg can seek in it)"""
+    result = subprocess.run(
+        ['python', '-m', 'yt_dlp', '--get-url', '--format', 'bestaudio', EPISODE_URL.format(episode_id)],
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    if result.returncode != 0 or not result.stdout.strip():
+        raise RuntimeError(f"yt-dlp could not resolve a stream: {result.stderr.strip()[-300:]}")
+    return result.stdout.strip().splitlines()[0]
+
+
+def _map(func, items, workers=INDEX_WORKERS):
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return sum(pool.map(func, items))
+
+
+def add_bbc(limit=20, workers=INDEX_WORKERS):
+    """Index preview clips of the latest BBC episodes; returns the number added"""
+    index = get_index()
+    episodes = [ep for ep in list_episodes(BRAND_URL, limit=limit) if not index.has(f"bbc:{ep['id']}")]
+    print(f"{len(episodes)} BBC episodes to fingerprint")
+
+    def add(ep):
+        try:
+            info = resolve_episode(ep['id']) or ep
+            codes = fingerprint.fingerprint(stream_url(ep['id']), info.get('duration'), margin=REFERENCE_MARGIN)
+            index.add(f"bbc:{ep['id']}", codes, ep['id'], info.get('date') or None, info.get('title'))
+        except Exception as e:
+            print(f"  ✗ {ep['id']} {ep['title']}: {e}")
+            return False
+        print(f"  ✓ {ep['id']} {ep['date']} {ep['title']}")
+        return True
+
+    return _map(add, episodes, workers)
+
+
+def add_archive(workers=INDEX_WORKERS):
+    """Index archive episodes whose episode ID and date are known; returns the number added"""
+    index = get_index()
+    objs = [obj for obj in get_manifest().objects()
+            if is_audio_key(obj['key']) and obj['episode_id'] and obj['date']
+            and not index.has(f"r2:{obj['key']}")]
+    print(f"{len(objs)} archive episodes to index")
+
+    def add(obj):
+        try:
+            # Shares (and fills) dedup.py's fingerprint cache in the manifest
+            codes = fingerprint.decode(audio_fingerprint(Item(obj['key'], obj['size'], obj=obj)))
+            index.add(f"r2:{obj['key']}", codes, obj['episode_id'], obj['date'], obj['key'])
+        except Exception as e:
+            print(f"  ✗ {obj['key']}: {e}")
+            return False
+        print(f"  ✓ {obj['key']}")
+        return True
+
+    return _map(add, objs, workers)
+
+
+def identify(files=(), apply=False, workers=INDEX_WORKERS):
+    """Match files (default: archive episodes missing an ID or date) against the index"""
+    index = get_index()
+    manifest = get_manifest()
+    if files:
+        items = [Item(path.name, path.stat().st_size, local=path) for path in files]
+    else:
+        items = [Item(obj['key'], obj['size'], obj=obj) for obj in manifest.objects()
+                 if is_audio_key(obj['key']) and not (obj['episode_id'] and obj['date'])]
+    print(f"Identifying {len(items)} files against {index.count()} references...")
+
+    def fingerprint_item(item):
+        try:
+            return item, fingerprint.decode(audio_fingerprint(item))
+        except Exception as e:
+            print(f"  ✗ {item.label}: {e}")
+            return item, None
+
+    identified = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for item, codes in pool.map(fingerprint_item, items):
+            if codes is None:
+                continue
+            started = time.perf_counter()
+            match = best_match(index.query(codes))
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if not match:
+                print(f"  - {item.label}: no match ({elapsed_ms:.0f} ms)")
+                continue
+            identified += 1
+            print(f"  ✓ {item.label}\n"
+                  f"    = {match['episode_id']} {match['date']} {match['title']} "
+                  f"({match['votes']} votes, {match['score']:.0%}, {elapsed_ms:.0f} ms)")
+            if apply and item.obj:
+                manifest.set_episode(item.name, match['episode_id'], match['date'])
+    return identified
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description="Identify episodes by audio fingerprint")
+    parser.add_argument('files', nargs='*', type=Path, help="with --identify, local files to identify")
+    parser.add_argument('--add-bbc', action='store_true', help="index preview clips of recent BBC episodes")
+    parser.add_argument('--limit', type=int, default=20, help="with --add-bbc, how many episodes (default 20)")
+    parser.add_argument('--add-archive', action='store_true', help="index archive episodes with a known ID and date")
+    parser.add_argument('--identify', action='store_true', help="match files against the index")
+    parser.add_argument('--apply', action='store_true', help="with --identify, record matches in the manifest")
+    parser.add_argument('--workers', type=int, default=INDEX_WORKERS,
+                        help=f"concurrent fingerprint jobs (default {INDEX_WORKERS})")
+    args = parser.parse_args()
+
+    if fingerprint.np is None:
+        print("✗ numpy is not installed")
+        sys.exit(1)
+    if not (args.add_bbc or args.add_archive or args.identify):
+        parser.print_help()
+        sys.exit(0)
+
+    if args.add_archive or (args.identify and not args.files):
+        get_manifest().refresh()
+    if args.add_bbc:
+        add_bbc(args.limit, args.workers)
+    if args.add_archive:
+        add_archive(args.workers)
+    if args.identify:
+        found = identify(args.files, args.apply, args.workers)
+        print(f"\nIdentified {found} files")
+        if args.apply and found and not args.files:
+            print("Run `python rename_with_dates.py --rule dated` to give them dated names")
@@ -1,37 +1,174 @@
 // Cloudflare Pages Function: /api/episodes
+
+// Pre-built catalog uploaded by the Python scripts (see catalog.py)
+const CATALOG_KEYS = {
+  br: 'catalog/episodes.json.br',
+  gzip: 'catalog/episodes.json.gz',
+};
+
+// Episode audio formats, most preferred first (same order as catalog.py)
+const CONTENT_TYPES = {
+  m4a: 'audio/mp4',
+  mp3: 'audio/mpeg',
+};
+const PREFERRED_EXTENSIONS = Object.keys(CONTENT_TYPES);
+const AUDIO_KEY_RE = /^(.*)\.(mp3|m4a)$/i;
+
+function extensionOf(key) {
+  return key.split('.').pop().toLowerCase();
+}
+
+const CORS_HEADERS = {
+  'Access-Control-Allow-Origin': '*',
+};
+
+// Suffix of the ETag of a catalog decompressed for a client without gzip
+const IDENTITY_SUFFIX = '-identity';
+
+function identityEtag(etag) {
+  return etag.replace(/"$/, `${IDENTITY_SUFFIX}"`);
+}
+
+// Conditional headers for R2 when serving the decompressed catalog: only
+// identity ETags can match it, compared as the compressed object's ETag
+function identityConditions(headers) {
+  const conditions = new Headers(headers);
+  const ifNoneMatch = headers.get('If-None-Match');
+  if (ifNoneMatch) {
+    const tags = ifNoneMatch.split(',')
+      .map(tag => tag.trim())
+      .filter(tag => tag === '*' || tag.endsWith(`${IDENTITY_SUFFIX}"`))
+      .map(tag => tag.replace(`${IDENTITY_SUFFIX}"`, '"'));
+    if (tags.length) {
+      conditions.set('If-None-Match', tags.join(', '));
+    } else {
+      conditions.delete('If-None-Match');
+    }
+  }
+  return conditions;
+}
+
 export async function onRequest(context) {
-  const { env } = context;
+  const { env, request } = context;
 
   try {
-    // List all objects in the R2 bucket
-    const listed = await env.GPARCHIVE_BUCKET.list();
-
-    // Filter for MP3 files and format the response
-    const episodes = listed.objects
-      .filter(obj => obj.key.endsWith('.mp3'))
-      .map(obj => ({
-        name: obj.key,
-        size: obj.size,
-        modified: obj.uploaded.toISOString(),
-        url: `/audio/${encodeURIComponent(obj.key)}`,
-        source: 'r2'
-      }))
-      // Sort by filename (which starts with YYYY-MM-DD), descending
-      .sort((a, b) => b.name.localeCompare(a.name));
+    const catalog = await serveCatalog(env, request);
+    if (catalog) {
+      return catalog;
+    }
 
-    return new Response(JSON.stringify(episodes), {
-      headers: {
-        'Content-Type': 'application/json',
-        'Access-Control-Allow-Origin': '*',
-      },
-    });
+    // Catalog missing - fall back to listing the bucket
+    return await serveLiveListing(env);
   } catch (error) {
     return new Response(JSON.stringify({ error: error.message }), {
       status: 500,
       headers: {
         'Content-Type': 'application/json',
-        'Access-Control-Allow-Origin': '*',
+        ...CORS_HEADERS,
       },
     });
   }
 }
+
+// Serve the pre-compressed catalog object, honouring If-None-Match
+async function serveCatalog(env, request) {
+  const acceptEncoding = request.headers.get('Accept-Encoding') || '';
+  const encodings = acceptEncoding.includes('br') ? ['br', 'gzip'] : ['gzip'];
+
+  for (const encoding of encodings) {
+    // A client without gzip gets the body decompressed, a different
+    // representation that needs its own ETag
+    const identity = !acceptEncoding.includes(encoding);
+
+    // R2 evaluates If-None-Match itself and returns no body when it matches
+    const object = await env.GPARCHIVE_BUCKET.get(CATALOG_KEYS[encoding], {
+      onlyIf: identity ? identityConditions(request.headers) : request.headers,
+    });
+    if (!object) {
+      continue;
+    }
+
+    const headers = {
+      'Content-Type': 'application/json',
+      'Cache-Control': 'no-cache',
+      'ETag': identity ? identityEtag(object.httpEtag) : object.httpEtag,
+      'Vary': 'Accept-Encoding',
+      ...CORS_HEADERS,
+    };
+
+    if (!('body' in object)) {
+      return new Response(null, { status: 304, headers });
+    }
+
+    if (!identity) {
+      // Already compressed - pass the bytes through untouched
+      return new Response(object.body, {
+        headers: { ...headers, 'Content-Encoding': encoding },
+        encodeBody: 'manual',
+      });
+    }
+
+    // Client doesn't accept gzip - decompress on the fly
+    return new Response(object.body.pipeThrough(new DecompressionStream('gzip')), { headers });
+  }
+
+  return null;
+}
+
+// Original behaviour: list every object in the bucket and sort
+async function serveLiveListing(env) {
+  const objects = [];
+  let cursor;
+  do {
+    // Episodes are top-level keys; the delimiter skips hls/ segments etc.
+    const listed = await env.GPARCHIVE_BUCKET.list({ cursor, delimiter: '/' });
+    objects.push(...listed.objects);
+    cursor = listed.truncated ? listed.cursor : undefined;
+  } while (cursor);
+
+  // Filter for audio files and format the response
+  const renditions = new Map();
+  for (const obj of objects) {
+    const match = obj.key.match(AUDIO_KEY_RE);
+    if (!match) {
+      continue;
+    }
+    const stem = match[1];
+    if (!renditions.has(stem)) {
+      renditions.set(stem, []);
+    }
+    renditions.get(stem).push(obj);
+  }
+
+  // One entry per episode: the preferred format first, others as alternates
+  const episodes = [...renditions.values()]
+    .map(objs => {
+      objs.sort((a, b) => PREFERRED_EXTENSIONS.indexOf(extensionOf(a.key)) - PREFERRED_EXTENSIONS.indexOf(extensionOf(b.key)));
+      const [primary, ...others] = objs;
+      const episode = {
+        name: primary.key,
+        size: primary.size,
+        modified: primary.uploaded.toISOString(),
+        url: `/audio/${encodeURIComponent(primary.key)}`,
+        type: CONTENT_TYPES[extensionOf(primary.key)],
+        source: 'r2'
+      };
+      if (others.length) {
+        episode.alternates = others.map(obj => ({
+          url: `/audio/${encodeURIComponent(obj.key)}`,
+          type: CONTENT_TYPES[extensionOf(obj.key)],
+          size: obj.size,
+        }));
+      }
+      return episode;
+    })
+    // Sort by filename (which starts with YYYY-MM-DD), descending
+    .sort((a, b) => b.name.localeCompare(a.name));
+
+  return new Response(JSON.stringify(episodes), {
+    headers: {
+      'Content-Type': 'application/json',
+      ...CORS_HEADERS,
+    },
+  });
+}
@@ -1,18 +1,131 @@
 // Cloudflare Pages Function: /audio/:filename
+
+const CONTENT_TYPES = {
+  mp3: 'audio/mpeg',
+  m4a: 'audio/mp4',
+  m3u8: 'application/vnd.apple.mpegurl',
+  ts: 'video/mp2t',
+};
+
+// Cache entries keyed by the source's ETag never go stale
+const IMMUTABLE = 'public, max-age=31536000, immutable';
+// HLS segments/playlists, peaks, seek indexes and tracklists keep their keys
+// when an episode is re-published, so they're revalidated (see r2_storage.py)
+const DERIVED = 'public, max-age=3600, must-revalidate';
+
+function cacheControlFor(filename) {
+  return filename.startsWith('hls/') || filename.endsWith('.peaks') || filename.endsWith('.seek')
+    || filename.endsWith('.chapters.json')
+    ? DERIVED
+    : 'public, max-age=31536000';
+}
+
+function contentTypeFor(filename, object) {
+  const ext = filename.split('.').pop().toLowerCase();
+  return CONTENT_TYPES[ext] || object.httpMetadata?.contentType || 'application/octet-stream';
+}
+
+// Seek index sidecar (see mp3frames.py): 20-byte header, then uint32 byte
+// offsets of the frame playing at every `interval` ms
+async function loadSeekIndex(env, request, filename, object) {
+  const seekKey = filename.replace(/\.mp3$/i, '.seek');
+  // Keyed by the mp3's ETag, so a re-uploaded episode never gets a stale index
+  const cacheKey = new Request(new URL(`/audio/${encodeURIComponent(seekKey)}?v=${object.etag}`, request.url));
+  const cache = caches.default;
+
+  let response = await cache.match(cacheKey);
+  if (!response) {
+    const index = await env.GPARCHIVE_BUCKET.get(seekKey);
+    if (!index) return null;
+    response = new Response(index.body, { headers: { 'Cache-Control': IMMUTABLE } });
+    await cache.put(cacheKey, response.clone());
+  }
+
+  const view = new DataView(await response.arrayBuffer());
+  const magic = String.fromCharCode(view.getUint8(0), view.getUint8(1), view.getUint8(2), view.getUint8(3));
+  // An index for a different version of the file is useless
+  if (magic !== 'GPSK' || view.getUint8(4) !== 1 || view.getUint32(12, true) !== object.size) {
+    return null;
+  }
+  return { view, interval: view.getUint32(8, true), count: view.getUint32(16, true) };
+}
+
+// ?t=<seconds> on a VBR mp3: one exact range read from the frame playing at t
+async function serveSeek(env, request, filename, seconds) {
+  const object = await env.GPARCHIVE_BUCKET.head(filename);
+  if (!object) return null;
+  const index = await loadSeekIndex(env, request, filename, object);
+  if (!index || index.count === 0) return null;
+
+  const entry = Math.min(index.count - 1, Math.max(0, Math.floor((seconds * 1000) / index.interval)));
+  const start = index.view.getUint32(20 + entry * 4, true);
+  const end = object.size - 1;
+
+  const rangeObject = await env.GPARCHIVE_BUCKET.get(filename, {
+    range: { offset: start, length: end - start + 1 },
+  });
+
+  return new Response(rangeObject.body, {
+    status: 206,
+    headers: {
+      'Content-Type': contentTypeFor(filename, object),
+      'Content-Length': (end - start + 1).toString(),
+      'Content-Range': `bytes ${start}-${end}/${object.size}`,
+      'Accept-Ranges': 'bytes',
+      'Cache-Control': cacheControlFor(filename),
+      'X-Seek-Time': ((entry * index.interval) / 1000).toString(),
+      'Access-Control-Allow-Origin': '*',
+      'Access-Control-Expose-Headers': 'Content-Range, X-Seek-Time',
+    },
+  });
+}
+
 export async function onRequest(context) {
   const { env, params, request } = context;
 
   try {
     const filename = decodeURIComponent(params.filename.join('/'));
-    const object = await env.GPARCHIVE_BUCKET.get(filename);
+    const range = request.headers.get('range');
+
+    const seekTime = parseFloat(new URL(request.url).searchParams.get('t'));
+    if (!Number.isNaN(seekTime) && filename.toLowerCase().endsWith('.mp3')) {
+      const seekResponse = await serveSeek(env, request, filename, seekTime);
+      if (seekResponse) {
+        return seekResponse;
+      }
+      // No usable index: fall through to a normal response
+    }
+
+    // Whole small HLS objects come from the edge cache once one visitor fetched them
+    const edgeCacheable = !range && filename.startsWith('hls/');
+    const cache = caches.default;
+    if (edgeCacheable) {
+      const cached = await cache.match(request);
+      if (cached) {
+        return cached;
+      }
+    }
+
+    // Whole-file requests are conditional, so revalidation is a cheap 304
+    const object = await env.GPARCHIVE_BUCKET.get(filename, range ? {} : { onlyIf: request.headers });
 
     if (!object) {
       return new Response('File not found', { status: 404 });
     }
 
-    // Handle range requests for seeking
-    const range = request.headers.get('range');
+    if (!object.body) {
+      // If-None-Match / If-Modified-Since matched: no body fetched
+      return new Response(null, {
+        status: 304,
+        headers: {
+          'ETag': object.httpEtag,
+          'Cache-Control': cacheControlFor(filename),
+          'Access-Control-Allow-Origin': '*',
+        },
+      });
+    }
 
+    // Handle range requests for seeking
     if (range) {
       const parts = range.replace(/bytes=/, "").split("-");
       const start = parseInt(parts[0], 10);
@@ -20,11 +133,12 @@ export async function onRequest(context) {
       const chunkSize = (end - start) + 1;
 
       const headers = {
-        'Content-Type': 'audio/mpeg',
+        'Content-Type': contentTypeFor(filename, object),
         'Content-Length': chunkSize.toString(),
         'Content-Range': `bytes ${start}-${end}/${object.size}`,
         'Accept-Ranges': 'bytes',
-        'Cache-Control': 'public, max-age=31536000',
+        'Cache-Control': cacheControlFor(filename),
+        'ETag': object.httpEtag,
         'Access-Control-Allow-Origin': '*',
       };
 
@@ -41,14 +155,19 @@ export async function onRequest(context) {
 
     // No range request - send full file
     const headers = {
-      'Content-Type': 'audio/mpeg',
+      'Content-Type': contentTypeFor(filename, object),
       'Content-Length': object.size.toString(),
       'Accept-Ranges': 'bytes',
-      'Cache-Control': 'public, max-age=31536000',
+      'Cache-Control': cacheControlFor(filename),
+      'ETag': object.httpEtag,
       'Access-Control-Allow-Origin': '*',
     };
 
-    return new Response(object.body, { headers });
+    const response = new Response(object.body, { headers });
+    if (edgeCacheable) {
+      context.waitUntil(cache.put(request, response.clone()));
+    }
+    return response;
   } catch (error) {
     return new Response(JSON.stringify({ error: error.message }), {
       status: 500,
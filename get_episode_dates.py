@@ -1,7 +1,8 @@
-import re
-import subprocess
-import json
-from pathlib import Path
+import sys
+
+from bbc_metadata import format_date, resolve_episodes
+
+sys.stdout.reconfigure(encoding='utf-8')
 
 # Mapping of current filenames to BBC episode IDs (from download history)
 EPISODE_MAPPING = {
@@ -21,46 +22,21 @@ EPISODE_MAPPING = {
     "Gilles Peterson, D'Angelo Tribute (1).mp3": None,
 }
 
-# Try to get episode info using yt-dlp
-def get_episode_info(episode_id):
-    if not episode_id:
-        return None
-
-    try:
-        url = f"https://www.bbc.co.uk/programmes/{episode_id}"
-        result = subprocess.run(
-            ['python', '-m', 'yt_dlp', '--dump-json', '--skip-download', url],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
-
-        if result.returncode == 0:
-            data = json.loads(result.stdout)
-            return {
-                'title': data.get('title', ''),
-                'upload_date': data.get('upload_date', ''),  # YYYYMMDD format
-                'release_date': data.get('release_date', ''),
-            }
-    except Exception as e:
-        print(f"Error getting info for {episode_id}: {e}")
-
-    return None
-
 print("Looking up episode airing dates from BBC...")
 print("=" * 60)
 
+# Resolve every known ID in one batch, concurrently
+resolved = resolve_episodes(episode_id for episode_id in EPISODE_MAPPING.values() if episode_id)
+
 for filename, episode_id in EPISODE_MAPPING.items():
     if episode_id:
         print(f"\n{filename}")
         print(f"  Episode ID: {episode_id}")
 
-        info = get_episode_info(episode_id)
+        info = resolved.get(episode_id)
         if info:
-            upload_date = info.get('upload_date', '')
-            if upload_date and len(upload_date) == 8:
-                # Format: YYYYMMDD -> YYYY-MM-DD
-                formatted_date = f"{upload_date[0:4]}-{upload_date[4:6]}-{upload_date[6:8]}"
+            formatted_date = format_date(info.get('upload_date', ''))
+            if formatted_date:
                 print(f"  Airing date: {formatted_date}")
                 print(f"  Title: {info.get('title', '')}")
             else:
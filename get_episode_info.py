@@ -1,69 +1,40 @@
 """
 Get episode information from BBC using yt-dlp without downloading
 """
-import subprocess
-import json
 import sys
 
+from bbc_metadata import resolve_episode, resolve_episodes, EPISODE_URL
+
 sys.stdout.reconfigure(encoding='utf-8')
 
 # The 4 episodes we need info for
 EPISODE_IDS = ["m002x2b1", "m002xdzt", "m002xmyp", "m002y01b"]
 
-def get_episode_info(episode_id):
-    url = f"https://www.bbc.co.uk/programmes/{episode_id}"
-    print(f"\nGetting info for {episode_id}...")
-    print(f"URL: {url}")
-
-    try:
-        result = subprocess.run(
-            [
-                'python', '-m', 'yt_dlp',
-                '--print', '%(title)s|||%(upload_date)s|||%(description)s',
-                '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                '--no-playlist',
-                url,
-            ],
-            capture_output=True,
-            text=True,
-            timeout=120,
-            encoding='utf-8'
-        )
-
-        if result.returncode == 0:
-            output = result.stdout.strip()
-            if '|||' in output:
-                parts = output.split('|||')
-                title = parts[0] if len(parts) > 0 else 'Unknown'
-                date = parts[1] if len(parts) > 1 else 'Unknown'
-                desc = parts[2] if len(parts) > 2 else ''
+def print_episode_info(episode_id, info):
+    print(f"\nInfo for {episode_id}...")
+    print(f"URL: {EPISODE_URL.format(episode_id)}")
 
-                # Format date from YYYYMMDD to YYYY-MM-DD
-                if len(date) == 8 and date.isdigit():
-                    date = f"{date[0:4]}-{date[4:6]}-{date[6:8]}"
+    if not info:
+        print("  Error: could not fetch episode info")
+        return
 
-                print(f"  Title: {title}")
-                print(f"  Date: {date}")
-                print(f"  Description: {desc[:100]}...")
+    print(f"  Title: {info['title']}")
+    print(f"  Date: {info['date'] or 'Unknown'}")
+    print(f"  Description: {info['description'][:100]}...")
 
-                return {
-                    "id": episode_id,
-                    "title": title,
-                    "date": date,
-                    "description": desc
-                }
-        else:
-            print(f"  Error: {result.stderr}")
-            return None
-
-    except Exception as e:
-        print(f"  Exception: {e}")
-        return None
+def get_episode_info(episode_id):
+    info = resolve_episode(episode_id)
+    print_episode_info(episode_id, info)
+    return info
 
 if __name__ == "__main__":
+    # Resolve all IDs in one batch, concurrently
+    resolved = resolve_episodes(EPISODE_IDS)
+
     episodes_info = []
     for ep_id in EPISODE_IDS:
-        info = get_episode_info(ep_id)
+        info = resolved.get(ep_id)
+        print_episode_info(ep_id, info)
         if info:
             episodes_info.append(info)
 
@@ -0,0 +1,181 @@
+"""
+HLS renditions of episodes for fast start and cheap seeking
+
+One ffmpeg run cuts an episode into fixed-length MPEG-TS segments in two
+renditions, and writes a master playlist for them:
+  - hi: the original AAC stream copied as-is (mp3 sources are encoded to AAC)
+  - lo: a 48 kbps mono AAC rendition for mobile data
+
+Everything is uploaded under `hls/<episode name>/`. The segments are
+uploaded concurrently, then the variant playlists, and the master playlist
+last, so a player never sees a playlist that points at missing segments.
+Segments are small and cached at the edge (revalidated hourly, since a
+re-published episode rewrites the same keys), so playback starts after the
+first segment and seeks hit the edge cache instead of issuing R2 range
+requests into a 280 MB file.
+
+Usage:
+    python hls.py FILE [--key KEY]          # segment a local file
+    python hls.py --missing [--limit N]     # backfill episodes already in R2
+
+    from hls import publish_hls
+    master_key = publish_hls(path, key)
+"""
+
+import argparse
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from catalog import publish_catalog
+from manifest import get_manifest
+from naming import audio_stem, is_audio_key
+from r2_storage import get_client, BUCKET_NAME, DERIVED_CACHE_CONTROL
+from transcode import priority_kwargs, priority_prefix, probe_codec
+
+HLS_PREFIX = "hls/"
+SEGMENT_SECONDS = 10
+UPLOAD_WORKERS = 8
+PRESIGNED_URL_EXPIRY = 6 * 3600
+
+LOW_BITRATE = '48k'
+
+CONTENT_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+}
+
+
+def hls_prefix(key):
+    """`hls/<episode name>/` for an audio key"""
+    return f"{HLS_PREFIX}{audio_stem(key)}/"
+
+
+def segment(source, out_dir, segment_seconds=SEGMENT_SECONDS):
+    """Write both renditions and master.m3u8 for `source` into `out_dir`"""
+    out_dir = Path(out_dir)
+    for name in ('hi', 'lo'):
+        (out_dir / name).mkdir(parents=True, exist_ok=True)
+
+    # The BBC stream is already AAC, so the full-quality rendition is a copy
+    hi_codec = ['copy'] if probe_codec(source) == 'aac' else ['aac', '-b:a:0', '128k']
+
+    result = subprocess.run(
+        [
+            *priority_prefix(True),
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+            '-i', str(source),
+            '-map', '0:a:0', '-map', '0:a:0',
+            '-c:a:0', *hi_codec,
+            '-c:a:1', 'aac', '-b:a:1', LOW_BITRATE, '-ac:a:1', '1',
+            '-f', 'hls',
+            '-hls_time', str(segment_seconds),
+            '-hls_playlist_type', 'vod',
+            '-hls_flags', 'independent_segments',
+            '-hls_segment_filename', str(out_dir / '%v' / 'seg_%05d.ts'),
+            '-master_pl_name', 'master.m3u8',
+            '-var_stream_map', 'a:0,name:hi a:1,name:lo',
+            str(out_dir / '%v' / 'index.m3u8'),
+        ],
+        capture_output=True,
+        text=True,
+        encoding='utf-8',
+        **priority_kwargs(True),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg HLS segmenting failed on {source}: {result.stderr.strip()[-500:]}")
+    return out_dir / 'master.m3u8'
+
+
+def _upload(path, key):
+    with open(path, 'rb') as f:
+        get_client().put_object(
+            Bucket=BUCKET_NAME,
+            Key=key,
+            Body=f,
+            ContentType=CONTENT_TYPES.get(path.suffix, 'application/octet-stream'),
+            CacheControl=DERIVED_CACHE_CONTROL,
+        )
+
+
+def upload_renditions(out_dir, prefix, workers=UPLOAD_WORKERS):
+    """Upload segments, then variant playlists, then the master; returns the master key"""
+    out_dir = Path(out_dir)
+    files = [p for p in out_dir.rglob('*') if p.is_file()]
+    segments = [p for p in files if p.suffix == '.ts']
+    playlists = [p for p in files if p.suffix == '.m3u8' and p.name != 'master.m3u8']
+
+    def key_for(path):
+        return prefix + path.relative_to(out_dir).as_posix()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for batch in (segments, playlists):
+            # list() re-raises the first failed upload
+            list(pool.map(lambda p: _upload(p, key_for(p)), batch))
+
+    master_key = prefix + 'master.m3u8'
+    _upload(out_dir / 'master.m3u8', master_key)
+    return master_key
+
+
+def publish_hls(source, key, segment_seconds=SEGMENT_SECONDS, workers=UPLOAD_WORKERS):
+    """Segment `source` (path or URL) for audio `key` and upload it; returns the master key"""
+    with tempfile.TemporaryDirectory(prefix='gp-hls-') as tmp:
+        segment(source, tmp, segment_seconds)
+        master_key = upload_renditions(tmp, hls_prefix(key), workers)
+    get_manifest().update_meta(key, hls=master_key)
+    return master_key
+
+
+def publish_missing(limit=None):
+    """Backfill HLS for indexed episodes that have none, streaming them from R2"""
+    s3 = get_client()
+    keys = [obj['key'] for obj in get_manifest().objects()
+            if is_audio_key(obj['key']) and 'hls' not in obj['meta']]
+    if limit:
+        keys = keys[:limit]
+    print(f"{len(keys)} episodes to segment")
+
+    done = 0
+    for key in keys:
+        url = s3.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': BUCKET_NAME, 'Key': key},
+            ExpiresIn=PRESIGNED_URL_EXPIRY,
+        )
+        try:
+            publish_hls(url, key)
+        except Exception as e:
+            print(f"  ✗ {key}: {e}")
+            continue
+        print(f"  ✓ {key}")
+        done += 1
+    return done
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description="Publish HLS renditions of episodes to R2")
+    parser.add_argument('file', nargs='?', type=Path, help="local episode file to segment")
+    parser.add_argument('--key', help="audio key the file belongs to (default: its file name)")
+    parser.add_argument('--missing', action='store_true', help="segment indexed episodes that have no HLS yet")
+    parser.add_argument('--limit', type=int, default=None, help="with --missing, at most this many episodes")
+    args = parser.parse_args()
+
+    if args.missing:
+        get_manifest().refresh()
+        published = publish_missing(args.limit)
+    elif args.file:
+        master = publish_hls(args.file, args.key or args.file.name)
+        print(f"✓ {master}")
+        published = 1
+    else:
+        parser.print_help()
+        sys.exit(0)
+
+    if published:
+        publish_catalog()
+        print("Episode catalog updated")
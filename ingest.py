@@ -0,0 +1,316 @@
+"""
+Ingest step shared by the download/upload scripts
+
+ingest_file() uploads an episode and, at the same time, decodes the local
+file once as a stream for a waveform peaks sidecar and an EBU R128 loudness
+analysis (see peaks.py / loudness.py). Once both finish, the peaks are
+uploaded next to the audio as `<name>.peaks`, and the integrated loudness,
+true peak and ReplayGain value are written to the object's metadata and to
+the manifest, which puts them in the episode catalog, so the player can
+draw a waveform and level episodes without analysing audio itself.
+
+Before any of that, the episode's tracklist (BBC segment data, or a
+supplied file) is embedded as chapters and uploaded as a
+`<name>.chapters.json` sidecar (see chapters.py). The chapters go into a
+temporary tagged copy, which is what gets uploaded; the caller's file is
+never modified. The untagged file's ETag and size are recorded in the
+manifest so backfills still recognise it. mp3s also get a `.seek` index of
+exact byte offsets, for time-based seeks (see mp3frames.py).
+
+R2 can't change metadata in place, so the metadata is applied with a
+server-side copy of the object onto itself. The ETag before the copy is kept
+as `source-etag`, so backfills can still recognise the original file.
+
+Usage:
+    python ingest.py --analyze-missing [--workers 2]   # backfill objects already in R2
+    python ingest.py --index-missing [--workers 2]     # seek indexes for mp3s already in R2
+
+    from ingest import ingest_file
+    etag, loudness = ingest_file(path, key, episode_id='m002x2b1', tracklist='tracks.txt')
+
+Without numpy only the loudness is measured (peaks.py needs it).
+"""
+
+import argparse
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import chapters
+import mp3frames
+import multipart_upload
+import peaks
+from catalog import publish_catalog
+from loudness import analyze
+from manifest import get_manifest
+from naming import audio_ext, content_type, is_audio_key
+from r2_storage import get_client, object_size, BUCKET_NAME, DERIVED_CACHE_CONTROL
+
+# Concurrent analyses when backfilling from R2 (each streams one episode)
+ANALYZE_WORKERS = 2
+PRESIGNED_URL_EXPIRY = 3600
+
+
+def loudness_metadata(values):
+    """R2 user metadata (string values) for a loudness analysis"""
+    metadata = {
+        'loudness-lufs': values['integrated'],
+        'true-peak-dbtp': values['true_peak'],
+        'loudness-range-lu': values['lra'],
+        'replaygain-db': values['replaygain'],
+    }
+    return {name: f"{value:.2f}" for name, value in metadata.items() if value is not None}
+
+
+def apply_metadata(key, metadata):
+    """Merge `metadata` into an object's user metadata; returns (new etag, source etag)"""
+    s3 = get_client()
+    head = s3.head_object(Bucket=BUCKET_NAME, Key=key)
+    merged = {**head.get('Metadata', {}), **metadata}
+    merged.setdefault('source-etag', head['ETag'].strip('"'))
+
+    # REPLACE drops headers that aren't re-sent, so carry them over
+    headers = {'ContentType': head.get('ContentType') or content_type(key)}
+    if head.get('CacheControl'):
+        headers['CacheControl'] = head['CacheControl']
+
+    response = s3.copy_object(
+        Bucket=BUCKET_NAME,
+        Key=key,
+        CopySource={'Bucket': BUCKET_NAME, 'Key': key},
+        Metadata=merged,
+        MetadataDirective='REPLACE',
+        **headers,
+    )
+    return response['CopyObjectResult']['ETag'].strip('"'), merged['source-etag']
+
+
+def analyze_source(source):
+    """Decode `source` once; returns (peaks sidecar bytes or None, loudness)"""
+    if peaks.np is None:
+        return None, analyze(source)
+    return peaks.analyze_audio(source)
+
+
+def upload_peaks(key, data):
+    """Store the peaks sidecar for audio `key`; returns the sidecar key"""
+    sidecar = peaks.peaks_key(key)
+    get_client().put_object(
+        Bucket=BUCKET_NAME,
+        Key=sidecar,
+        Body=data,
+        ContentType='application/octet-stream',
+        CacheControl=DERIVED_CACHE_CONTROL,
+    )
+    return sidecar
+
+
+def build_seek_index(path):
+    """Seek index sidecar bytes for a local mp3"""
+    path = Path(path)
+    with open(path, 'rb') as f:
+        return mp3frames.build_seek_index(f, path.stat().st_size)
+
+
+def upload_seek_index(key, data):
+    """Store the seek index for audio `key`; returns the sidecar key"""
+    sidecar = mp3frames.seek_key(key)
+    # Re-tagging the mp3 moves its frames, and the index with them
+    get_client().put_object(
+        Bucket=BUCKET_NAME,
+        Key=sidecar,
+        Body=data,
+        ContentType='application/octet-stream',
+        CacheControl=DERIVED_CACHE_CONTROL,
+    )
+    return sidecar
+
+
+def _publish_analysis(key, etag, peaks_data, values):
+    """Upload peaks / tag loudness; returns (etag, meta fields for the manifest)"""
+    meta = {}
+    if peaks_data:
+        meta['peaks'] = upload_peaks(key, peaks_data)
+    if values:
+        etag, meta['source_etag'] = apply_metadata(key, loudness_metadata(values))
+        meta['loudness'] = values
+    return etag, meta
+
+
+def _record(key, size, etag, episode_id, meta):
+    manifest = get_manifest()
+    manifest.add(key, size=size, etag=etag, episode_id=episode_id)
+    if meta:
+        manifest.update_meta(key, **meta)
+
+
+def prepare_chapters(path, episode_id=None, tracklist=None, dest=None):
+    """Embed the episode's tracklist in `path` (or a copy at `dest`); returns the sidecar, or None"""
+    try:
+        sidecar = chapters.prepare_file(path, episode_id, tracklist, dest)
+    except Exception as e:
+        print(f"  ✗ Tracklist failed for {Path(path).name}: {e}")
+        return None
+    if sidecar:
+        print(f"  ✓ Tracklist: {len(sidecar['chapters'])} tracks ({sidecar['source']})")
+    return sidecar
+
+
+def ingest_file(path, key=None, episode_id=None, extra_args=None, progress=None, analyze_loudness=True,
+                tracklist=None):
+    """Upload `path` to `key` while analysing it; returns (etag, loudness)
+
+    A failed analysis is reported but doesn't fail the upload (`loudness`
+    is then None and `python ingest.py --analyze-missing` can fill it in);
+    neither does a missing or failed tracklist.
+    """
+    path = Path(path)
+    key = key or path.name
+    # Only set when a tagged copy is uploaded (None clears an earlier one)
+    untagged = {'untagged_etag': None, 'untagged_size': None}
+    if not (episode_id or tracklist):
+        return _ingest(path, key, episode_id, None, extra_args, progress, analyze_loudness, untagged)
+
+    with tempfile.TemporaryDirectory(prefix='gp_ingest_') as workdir:
+        # Tagging has to happen before the file is read for anything else
+        tagged = Path(workdir) / path.name
+        sidecar = prepare_chapters(path, episode_id, tracklist, dest=tagged)
+        if sidecar and tagged.exists():
+            untagged = {'untagged_etag': multipart_upload.local_etag(path), 'untagged_size': path.stat().st_size}
+            path = tagged
+        return _ingest(path, key, episode_id, sidecar, extra_args, progress, analyze_loudness, untagged)
+
+
+def _ingest(path, key, episode_id, sidecar, extra_args, progress, analyze_loudness, untagged):
+    size = path.stat().st_size
+    extra_args = {'ContentType': content_type(key), **(extra_args or {})}
+
+    peaks_data, values, seek_data = None, None, None
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        analysis = pool.submit(analyze_source, path) if analyze_loudness else None
+        seek_index = pool.submit(build_seek_index, path) if audio_ext(key) == '.mp3' else None
+        etag = multipart_upload.upload_file(path, key, extra_args=extra_args, progress=progress)
+        if analysis is not None:
+            try:
+                peaks_data, values = analysis.result()
+            except Exception as e:
+                print(f"  ✗ Analysis failed for {key}: {e}")
+        if seek_index is not None:
+            try:
+                seek_data = seek_index.result()
+            except Exception as e:
+                print(f"  ✗ Seek index failed for {key}: {e}")
+
+    etag, meta = _publish_analysis(key, etag, peaks_data, values)
+    if seek_data:
+        meta['seek'] = upload_seek_index(key, seek_data)
+    if sidecar:
+        meta.update(chapters.publish_sidecar(key, sidecar))
+    meta.update(untagged)
+    _record(key, size, etag, episode_id, meta)
+    return etag, values
+
+
+def check_upload(key):
+    """Raise unless `key` in R2 is the size ingest_file() uploaded
+
+    Checked against the manifest rather than the caller's file, whose size
+    can differ from the uploaded bytes once chapters are embedded.
+    """
+    expected = (get_manifest().get(key) or {}).get('size')
+    remote = object_size(key)
+    if remote is None or remote != expected:
+        raise RuntimeError(f"{key} is {remote} bytes in R2, expected {expected}")
+
+
+def analyze_object(key):
+    """Analyse an object already in R2 (streamed via a presigned URL) and tag it"""
+    url = get_client().generate_presigned_url(
+        'get_object',
+        Params={'Bucket': BUCKET_NAME, 'Key': key},
+        ExpiresIn=PRESIGNED_URL_EXPIRY,
+    )
+    peaks_data, values = analyze_source(url)
+    if not values:
+        raise RuntimeError("no loudness summary from ffmpeg")
+
+    row = get_manifest().get(key) or {}
+    etag, meta = _publish_analysis(key, row.get('etag'), peaks_data, values)
+    _record(key, row.get('size'), etag, row.get('episode_id'), meta)
+    return values
+
+
+def analyze_missing(workers=ANALYZE_WORKERS):
+    """Analyse every indexed episode missing loudness (or peaks); returns the count"""
+    wanted = ('loudness',) if peaks.np is None else ('loudness', 'peaks')
+    manifest = get_manifest()
+    keys = [obj['key'] for obj in manifest.objects()
+            if is_audio_key(obj['key']) and any(name not in obj['meta'] for name in wanted)]
+    print(f"{len(keys)} episodes without {' / '.join(wanted)} data")
+
+    def run(key):
+        try:
+            values = analyze_object(key)
+        except Exception as e:
+            print(f"  ✗ {key}: {e}")
+            return False
+        print(f"  ✓ {key}: {values['integrated']:.1f} LUFS, ReplayGain {values['replaygain']:+.2f} dB")
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return sum(pool.map(run, keys))
+
+
+def index_missing(workers=ANALYZE_WORKERS):
+    """Build seek indexes for indexed mp3s that have none; returns the count
+
+    Each mp3 is streamed from R2 once; only frame headers are parsed.
+    """
+    s3 = get_client()
+    manifest = get_manifest()
+    keys = [obj['key'] for obj in manifest.objects()
+            if audio_ext(obj['key']) == '.mp3' and 'seek' not in obj['meta']]
+    print(f"{len(keys)} mp3s without a seek index")
+
+    def run(key):
+        try:
+            response = s3.get_object(Bucket=BUCKET_NAME, Key=key)
+            body = response['Body']
+            try:
+                data = mp3frames.build_seek_index(body, response['ContentLength'])
+            finally:
+                body.close()
+            manifest.update_meta(key, seek=upload_seek_index(key, data))
+        except Exception as e:
+            print(f"  ✗ {key}: {e}")
+            return False
+        print(f"  ✓ {key}")
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return sum(pool.map(run, keys))
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description="Loudness-tag episodes in R2, add waveform peaks and seek indexes")
+    parser.add_argument('--analyze-missing', action='store_true',
+                        help="analyse indexed episodes that have no loudness/peaks data yet")
+    parser.add_argument('--index-missing', action='store_true',
+                        help="build seek indexes for indexed mp3s that have none")
+    parser.add_argument('--workers', type=int, default=ANALYZE_WORKERS,
+                        help=f"concurrent analyses (default {ANALYZE_WORKERS})")
+    args = parser.parse_args()
+
+    if not (args.analyze_missing or args.index_missing):
+        parser.print_help()
+        sys.exit(0)
+
+    get_manifest().refresh()
+    if args.index_missing:
+        index_missing(args.workers)
+    if args.analyze_missing and analyze_missing(args.workers):
+        publish_catalog()
+        print("Episode catalog updated")
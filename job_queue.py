@@ -0,0 +1,236 @@
+"""
+Durable download job queue shared by the download scripts
+
+Every episode a script sets out to archive becomes a job in jobs.db,
+keyed by its BBC episode ID, and moves through
+
+    discovered -> downloading -> downloaded -> uploading -> verified
+
+A failed stage drops the job back to the last completed state and
+schedules a retry with exponential back-off and jitter. After
+MAX_ATTEMPTS failures of the same stage it is parked as `failed` until
+--retry-failed (completing a stage starts its count afresh). A
+`downloaded` job remembers its local file, so after a crash or a failed
+upload the next run uploads that file instead of downloading the
+episode again. Jobs left in progress by a process that died are picked
+up again once they're STALE_AFTER old.
+
+Usage:
+    python job_queue.py                  # job counts and anything not verified
+    python job_queue.py --retry-failed   # give failed jobs a fresh set of attempts
+
+    from job_queue import get_job_queue
+    queue = get_job_queue()
+    queue.discover(ep)
+    for job in queue.due():
+        with queue.attempt(job['id'], 'downloading'):
+            ...
+        queue.advance(job['id'], 'downloaded', path=str(path))
+"""
+
+import argparse
+import random
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+QUEUE_PATH = Path(__file__).parent / "jobs.db"
+
+STATES = ('discovered', 'downloading', 'downloaded', 'uploading', 'verified')
+FAILED = 'failed'
+# In-progress state -> the completed state a failed or interrupted job falls back to
+RESUME_FROM = {'downloading': 'discovered', 'uploading': 'downloaded'}
+
+MAX_ATTEMPTS = 8
+# Retry delays double from BACKOFF_BASE up to BACKOFF_MAX (seconds), +-50% jitter
+BACKOFF_BASE = 60
+BACKOFF_MAX = 6 * 3600
+# Longer than any single download or upload takes
+STALE_AFTER = 4 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    title TEXT,
+    date TEXT,
+    state TEXT NOT NULL,
+    path TEXT,
+    key TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state, next_attempt);
+"""
+
+
+def backoff(attempts):
+    """Seconds to wait before retry number `attempts`"""
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
+
+
+class JobQueue:
+    """Thread-safe job store"""
+
+    def __init__(self, path=QUEUE_PATH):
+        self.path = Path(path)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.executescript(SCHEMA)
+
+    def discover(self, ep):
+        """Add an episode dict (id/title/date) as a job unless it's already queued; returns the job"""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO jobs (id, title, date, state, updated_at) VALUES (?, ?, ?, 'discovered', ?)",
+                (ep['id'], ep.get('title'), ep.get('date'), time.time()),
+            )
+        return self.get(ep['id'])
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def jobs(self, states=None):
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM jobs ORDER BY date, id").fetchall()
+        return [dict(row) for row in rows if states is None or row['state'] in states]
+
+    def local_file(self, job_id):
+        """The file a `downloaded` job left behind, or None (not downloaded yet, or since removed)"""
+        job = self.get(job_id)
+        if job and job['state'] == 'downloaded' and job['path'] and Path(job['path']).exists():
+            return Path(job['path'])
+        return None
+
+    def due(self, ids=None, now=None):
+        """Jobs ready for their next stage (oldest broadcast first), optionally only `ids`"""
+        now = now or time.time()
+        self.recover(now)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM jobs WHERE state IN ('discovered', 'downloaded') AND next_attempt <= ? "
+                "ORDER BY date, id",
+                (now,),
+            ).fetchall()
+        return [dict(row) for row in rows if ids is None or row['id'] in ids]
+
+    def recover(self, now=None):
+        """Return jobs stuck in progress (their process died) to their last completed state"""
+        cutoff = (now or time.time()) - STALE_AFTER
+        with self._lock, self._db:
+            for in_progress, completed in RESUME_FROM.items():
+                self._db.execute(
+                    "UPDATE jobs SET state = ?, updated_at = ? WHERE state = ? AND updated_at < ?",
+                    (completed, time.time(), in_progress, cutoff),
+                )
+
+    def _set(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        with self._lock, self._db:
+            self._db.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def start(self, job_id, state):
+        """Mark a stage (`downloading` / `uploading`) as in progress"""
+        if state not in RESUME_FROM:
+            raise ValueError(f"not an in-progress state: {state}")
+        self._set(job_id, state=state)
+
+    def advance(self, job_id, state, **fields):
+        """Record a completed stage (`downloaded` / `verified`), plus e.g. `path` or `key`
+
+        Resets the attempt count: the next stage gets its own MAX_ATTEMPTS.
+        """
+        if state not in STATES or state in RESUME_FROM:
+            raise ValueError(f"not a completed state: {state}")
+        self._set(job_id, state=state, attempts=0, next_attempt=0, last_error=None, **fields)
+
+    def fail(self, job_id, error):
+        """Record a failed stage: back to the last completed state, retried after a back-off"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        attempts = job['attempts'] + 1
+        state = RESUME_FROM.get(job['state'], job['state'])
+        if attempts >= MAX_ATTEMPTS:
+            state = FAILED
+        self._set(
+            job_id,
+            state=state,
+            attempts=attempts,
+            next_attempt=time.time() + backoff(attempts),
+            last_error=str(error)[-500:],
+        )
+        return self.get(job_id)
+
+    @contextmanager
+    def attempt(self, job_id, state):
+        """Run a stage: mark `state` in progress, and record the failure if it raises"""
+        self.start(job_id, state)
+        try:
+            yield
+        except Exception as e:
+            self.fail(job_id, str(e) or type(e).__name__)
+            raise
+        except BaseException:
+            # Interrupted (Ctrl+C): resumable right away, not a failed attempt
+            self._set(job_id, state=RESUME_FROM[state])
+            raise
+
+    def retry_failed(self):
+        """Give failed jobs a fresh set of attempts; returns how many"""
+        count = 0
+        for job in self.jobs([FAILED]):
+            resumable = job['path'] and Path(job['path']).exists()
+            self._set(job['id'], state='downloaded' if resumable else 'discovered', attempts=0, next_attempt=0)
+            count += 1
+        return count
+
+    def counts(self):
+        with self._lock:
+            rows = self._db.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state").fetchall()
+        return {row['state']: row['n'] for row in rows}
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Return the process-wide job queue, opening it on first use"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description="Show the download job queue")
+    parser.add_argument('--retry-failed', action='store_true', help="give failed jobs a fresh set of attempts")
+    args = parser.parse_args()
+
+    queue = get_job_queue()
+    if args.retry_failed:
+        print(f"✓ {queue.retry_failed()} failed jobs queued again")
+
+    counts = queue.counts()
+    print(", ".join(f"{state}: {counts.get(state, 0)}" for state in STATES + (FAILED,)))
+    for job in queue.jobs([s for s in STATES if s != 'verified'] + [FAILED]):
+        retry = ''
+        if job['next_attempt'] > time.time():
+            retry = f", retry in {int((job['next_attempt'] - time.time()) // 60)} min"
+        error = f"\n    {job['last_error']}" if job['last_error'] else ''
+        print(f"  {job['state']:<12} {job['date']} {job['title']} [{job['id']}] "
+              f"({job['attempts']} failed attempts{retry}){error}")
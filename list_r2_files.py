@@ -1,50 +1,34 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import sys
-import os
 # Force UTF-8 output
 if sys.platform == 'win32':
     import io
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
-import boto3
 import json
-from datetime import datetime
 
-# R2 Configuration
-R2_ACCOUNT_ID = "daa5cfc7d0326ab77077899860d9ae03"
-BUCKET_NAME = "gparchive"
-ACCESS_KEY = "3fe1d0fac3028b108dfb1434fbeda5ab"
-SECRET_KEY = "7e39e93560a2555e2e20c57a6ea094746212d3360ee13395d8ddb40c69924516"
+from naming import audio_stem, is_audio_key
+from r2_storage import iter_objects, BUCKET_NAME
 
-# Create S3 client for R2
-s3 = boto3.client(
-    's3',
-    endpoint_url=f'https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com',
-    aws_access_key_id=ACCESS_KEY,
-    aws_secret_access_key=SECRET_KEY,
-    region_name='auto'
-)
+# Optional prefixes to list concurrently, e.g. python list_r2_files.py 2025- 2026-
+PREFIXES = sys.argv[1:]
 
 print(f"\nListing files in bucket: {BUCKET_NAME}\n")
 
-# List objects
-response = s3.list_objects_v2(Bucket=BUCKET_NAME)
-
-if 'Contents' not in response:
-    print("No files found in bucket!")
-    exit()
-
 # Prepare episode metadata
 episodes = []
+total_objects = 0
 
-for obj in response['Contents']:
+# List objects (streamed page by page, no 1,000-key limit)
+for obj in iter_objects(prefixes=PREFIXES):
+    total_objects += 1
     filename = obj['Key']
     size = obj['Size']
     modified = obj['LastModified']
 
-    # Only process MP3 files
-    if not filename.lower().endswith('.mp3'):
+    # Only process episode audio (mp3/m4a)
+    if not is_audio_key(filename):
         continue
 
     # Extract episode ID from filename (if it has [id] format)
@@ -57,7 +41,7 @@ for obj in response['Contents']:
     # Create episode entry
     episode = {
         "filename": filename,
-        "name": filename.replace('.mp3', '').replace(f'[{episode_id}]', '').strip(),
+        "name": audio_stem(filename).replace(f'[{episode_id}]', '').strip(),
         "date": modified.isoformat(),
         "size": size,
         "episodeId": episode_id
@@ -70,6 +54,10 @@ for obj in response['Contents']:
     print(f"  Modified: {modified}")
     print()
 
+if not total_objects:
+    print("No files found in bucket!")
+    exit()
+
 # Sort by date (newest first)
 episodes.sort(key=lambda x: x['date'], reverse=True)
 
@@ -0,0 +1,91 @@
+"""
+EBU R128 loudness analysis with ffmpeg's ebur128 filter
+
+ffmpeg decodes the file as a stream and the filter keeps only running
+measurements, so memory stays constant whatever the episode length. The
+input can be a local path or a (presigned) URL, so episodes already in R2
+can be analysed without downloading them first.
+
+Usage:
+    python loudness.py FILE...
+
+    from loudness import analyze
+    analyze(path)   # {'integrated': -17.3, 'true_peak': -0.4, 'lra': 6.9, 'replaygain': -0.7}
+
+Requirements:
+    - ffmpeg on PATH
+"""
+
+import re
+import subprocess
+import sys
+
+# ReplayGain 2.0 reference level
+REPLAYGAIN_REFERENCE_LUFS = -18.0
+
+# Summary only (no per-frame log); the filter passes audio through unchanged
+EBUR128_FILTER = 'ebur128=peak=true:framelog=quiet'
+
+_SUMMARY_FIELDS = {
+    'integrated': re.compile(r'^\s*I:\s*(-?[\d.]+|-inf)\s*LUFS', re.MULTILINE),
+    'lra': re.compile(r'^\s*LRA:\s*(-?[\d.]+)\s*LU\b', re.MULTILINE),
+    'true_peak': re.compile(r'^\s*Peak:\s*(-?[\d.]+|-inf)\s*dBFS', re.MULTILINE),
+}
+
+
+def parse_summary(stderr):
+    """Loudness values from the summary ebur128 prints to ffmpeg's stderr"""
+    # Only the final summary, not the per-frame log lines
+    start = stderr.rfind('Summary:')
+    if start < 0:
+        return None
+    summary = stderr[start:]
+
+    values = {}
+    for name, pattern in _SUMMARY_FIELDS.items():
+        m = pattern.search(summary)
+        values[name] = float(m.group(1)) if m and m.group(1) != '-inf' else None
+    return values
+
+
+def analyze(source, timeout=1800):
+    """Integrated loudness (LUFS), true peak (dBTP), LRA (LU) and ReplayGain (dB)
+
+    Raises RuntimeError if ffmpeg fails or prints no summary.
+    """
+    result = subprocess.run(
+        [
+            'ffmpeg', '-hide_banner', '-nostats',
+            '-i', str(source),
+            '-vn',
+            '-af', EBUR128_FILTER,
+            '-f', 'null', '-',
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding='utf-8',
+        errors='replace',
+        timeout=timeout,
+    )
+
+    values = parse_summary(result.stderr) if result.returncode == 0 else None
+    if not values or values['integrated'] is None:
+        raise RuntimeError(f"loudness analysis failed: {result.stderr.strip()[-500:]}")
+
+    values['replaygain'] = round(REPLAYGAIN_REFERENCE_LUFS - values['integrated'], 2)
+    return values
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    for path in sys.argv[1:]:
+        try:
+            v = analyze(path)
+        except RuntimeError as e:
+            print(f"✗ {path}: {e}")
+            continue
+        print(f"✓ {path}")
+        print(f"  Integrated: {v['integrated']:.1f} LUFS, true peak: {v['true_peak']} dBTP, "
+              f"LRA: {v['lra']} LU, ReplayGain: {v['replaygain']:+.2f} dB")
@@ -0,0 +1,288 @@
+"""
+Local SQLite index of the R2 bucket
+
+Lets the download scripts answer "do we already have this episode?" with a
+local lookup by key, broadcast date, BBC episode ID or normalized title,
+instead of scanning the full key list or sending a head_object per file.
+
+The index is refreshed from a streamed bucket listing (only rows whose
+size/ETag changed are rewritten, vanished keys are dropped) and is updated
+directly by the upload code, so a refresh is only needed to pick up
+changes made outside these scripts. Per-episode analysis results (e.g.
+loudness) live in a JSON `meta` column that a refresh leaves alone.
+
+Analysis of local files (e.g. content hashes from dedup.py) is cached in a
+separate `local_files` table, keyed by path and valid while the file's
+size and mtime are unchanged.
+
+Usage:
+    python manifest.py            # refresh and print a summary
+
+    from manifest import get_manifest
+    manifest = get_manifest()
+    manifest.refresh(max_age=3600)
+    if manifest.has_date('2026-06-27'): ...
+"""
+
+import json
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from naming import is_audio_key, normalize_title, parse_key
+from r2_storage import iter_objects
+
+MANIFEST_PATH = Path(__file__).parent / "manifest.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    key TEXT PRIMARY KEY,
+    size INTEGER,
+    etag TEXT,
+    last_modified TEXT,
+    date TEXT,
+    episode_id TEXT,
+    title_norm TEXT,
+    seen_at REAL,
+    meta TEXT
+);
+CREATE INDEX IF NOT EXISTS objects_date ON objects(date);
+CREATE INDEX IF NOT EXISTS objects_episode_id ON objects(episode_id);
+CREATE INDEX IF NOT EXISTS objects_title_norm ON objects(title_norm);
+CREATE TABLE IF NOT EXISTS local_files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    meta TEXT
+);
+CREATE TABLE IF NOT EXISTS state (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Columns added after the first release, applied to existing databases
+MIGRATIONS = [
+    ("objects", "meta", "TEXT"),
+]
+
+
+def _row(row):
+    if row is None:
+        return None
+    obj = dict(row)
+    obj['meta'] = json.loads(obj['meta']) if obj.get('meta') else {}
+    return obj
+
+
+class Manifest:
+    """Thread-safe wrapper around the manifest database"""
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = Path(path)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.executescript(SCHEMA)
+            for table, column, kind in MIGRATIONS:
+                columns = {row['name'] for row in self._db.execute(f"PRAGMA table_info({table})")}
+                if column not in columns:
+                    self._db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+
+    # -- refresh -----------------------------------------------------------
+
+    @property
+    def last_refresh(self):
+        return float(self.get_state('last_refresh', 0))
+
+    def refresh(self, max_age=None):
+        """Sync the index with the bucket listing
+
+        Skipped if the last refresh is younger than `max_age` seconds.
+        Returns (added_or_changed, removed) counts.
+        """
+        if max_age is not None and time.time() - self.last_refresh < max_age:
+            return 0, 0
+
+        started = time.time()
+        changed = 0
+
+        with self._lock:
+            known = {
+                row['key']: (row['size'], row['etag'])
+                for row in self._db.execute("SELECT key, size, etag FROM objects")
+            }
+
+            with self._db:
+                # Episodes live at the top level; skip catalog/, hls/ etc.
+                for obj in iter_objects(delimiter='/'):
+                    key = obj['Key']
+                    if not is_audio_key(key):
+                        continue
+                    etag = obj.get('ETag', '').strip('"')
+                    if known.get(key) == (obj['Size'], etag):
+                        self._db.execute("UPDATE objects SET seen_at = ? WHERE key = ?", (started, key))
+                        continue
+                    self._upsert(key, obj['Size'], etag, obj['LastModified'].isoformat(), seen_at=started)
+                    changed += 1
+
+                removed = self._db.execute("DELETE FROM objects WHERE seen_at < ?", (started,)).rowcount
+                self._db.execute(
+                    "INSERT OR REPLACE INTO state (name, value) VALUES ('last_refresh', ?)",
+                    (str(started),),
+                )
+
+        return changed, removed
+
+    # -- updates from the upload code ----------------------------------------
+
+    def _upsert(self, key, size=None, etag=None, last_modified=None, episode_id=None, seen_at=None):
+        fields = parse_key(key)
+        self._db.execute(
+            """
+            INSERT INTO objects (key, size, etag, last_modified, date, episode_id, title_norm, seen_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                size = excluded.size,
+                etag = excluded.etag,
+                last_modified = excluded.last_modified,
+                date = COALESCE(excluded.date, objects.date),
+                episode_id = COALESCE(excluded.episode_id, objects.episode_id),
+                title_norm = excluded.title_norm,
+                seen_at = excluded.seen_at
+            """,
+            (
+                key, size, etag, last_modified,
+                fields['date'], episode_id or fields['episode_id'], fields['title_norm'],
+                seen_at if seen_at is not None else time.time(),
+            ),
+        )
+
+    def add(self, key, size=None, etag=None, episode_id=None):
+        """Record an object that was just uploaded"""
+        with self._lock, self._db:
+            self._upsert(key, size, etag, datetime.now(timezone.utc).isoformat(), episode_id=episode_id)
+
+    def update_meta(self, key, **fields):
+        """Merge analysis results into an object's `meta` (None values delete)"""
+        with self._lock, self._db:
+            row = self._db.execute("SELECT meta FROM objects WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return False
+            meta = json.loads(row['meta']) if row['meta'] else {}
+            meta.update(fields)
+            meta = {k: v for k, v in meta.items() if v is not None}
+            self._db.execute("UPDATE objects SET meta = ? WHERE key = ?", (json.dumps(meta), key))
+        return True
+
+    def set_episode(self, key, episode_id=None, date=None):
+        """Record an episode ID / broadcast date identified after upload"""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE objects SET episode_id = COALESCE(?, episode_id), date = COALESCE(?, date) WHERE key = ?",
+                (episode_id, date, key),
+            )
+
+    def remove(self, key):
+        """Forget an object that was deleted or renamed away"""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM objects WHERE key = ?", (key,))
+
+    # -- lookups ---------------------------------------------------------------
+
+    def _exists(self, column, value):
+        if not value:
+            return False
+        with self._lock:
+            row = self._db.execute(f"SELECT 1 FROM objects WHERE {column} = ? LIMIT 1", (value,)).fetchone()
+        return row is not None
+
+    def has_key(self, key):
+        return self._exists('key', key)
+
+    def has_date(self, date):
+        return self._exists('date', date)
+
+    def has_episode_id(self, episode_id):
+        return self._exists('episode_id', episode_id)
+
+    def has_title(self, title):
+        return self._exists('title_norm', normalize_title(title))
+
+    def has_episode(self, ep):
+        """True if an episode dict (id/date/title) is already in the bucket"""
+        return self.has_episode_id(ep.get('id')) or self.has_date(ep.get('date'))
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM objects WHERE key = ?", (key,)).fetchone()
+        return _row(row)
+
+    def objects(self):
+        """All indexed objects, newest broadcast date first"""
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM objects ORDER BY key DESC").fetchall()
+        return [_row(row) for row in rows]
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM objects").fetchone()[0]
+
+    # -- local files -------------------------------------------------------------
+
+    def local_meta(self, path, size, mtime):
+        """Cached analysis of a local file, or {} if none or the file changed since"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT meta FROM local_files WHERE path = ? AND size = ? AND mtime = ?",
+                (str(path), size, mtime),
+            ).fetchone()
+        return json.loads(row['meta']) if row and row['meta'] else {}
+
+    def update_local_meta(self, path, size, mtime, **fields):
+        """Merge analysis results for a local file (stale results are dropped first)"""
+        with self._lock, self._db:
+            meta = self.local_meta(path, size, mtime)
+            meta.update(fields)
+            self._db.execute(
+                "INSERT OR REPLACE INTO local_files (path, size, mtime, meta) VALUES (?, ?, ?, ?)",
+                (str(path), size, mtime, json.dumps(meta)),
+            )
+
+    # -- misc state --------------------------------------------------------------
+
+    def get_state(self, name, default=None):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM state WHERE name = ?", (name,)).fetchone()
+        return row['value'] if row else default
+
+    def set_state(self, name, value):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO state (name, value) VALUES (?, ?)", (name, value))
+
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def get_manifest():
+    """Return the process-wide manifest, opening it on first use"""
+    global _manifest
+    if _manifest is None:
+        with _manifest_lock:
+            if _manifest is None:
+                _manifest = Manifest()
+    return _manifest
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    manifest = get_manifest()
+    print(f"Refreshing manifest from bucket: {manifest.path}")
+    changed, removed = manifest.refresh()
+    print(f"  {changed} added/changed, {removed} removed, {manifest.count()} indexed")
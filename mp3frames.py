@@ -0,0 +1,221 @@
+"""
+Minimal MPEG audio (Layer III) frame parser
+
+Walks the frame headers of an mp3 stream without decoding anything, so the
+byte offset of any point in time can be found exactly, even in VBR files
+where bitrate-based estimates drift by minutes over a three hour episode.
+Reads sequentially in chunks, so it works the same on a local file or a
+streaming R2 response body.
+
+A leading ID3v2 tag and the LAME/Xing info frame are skipped; offsets are
+always from the start of the file.
+
+The same single pass builds a seek index sidecar, `<name>.seek`: the byte
+offset of the frame playing at every SEEK_INTERVAL_MS. The Xing TOC LAME
+writes has only 100 entries (one per 108 s of a three hour episode), so
+browsers interpolate VBR seeks between them; the sidecar lets the audio
+function answer `?t=` requests with one exact range read instead.
+
+Seek index format (little-endian):
+    4s  magic b'GPSK'
+    B   version (1)
+    3x  padding
+    I   interval between entries, in ms
+    I   size of the mp3 file the offsets belong to
+    I   entry count
+    then `entry count` uint32 byte offsets
+
+Usage:
+    python mp3frames.py FILE [SECONDS...]    # frame stats, and byte offsets of the given times
+
+    from mp3frames import byte_offsets
+    with open(path, 'rb') as f:
+        offsets = byte_offsets(f, [0, 600, 3600])
+"""
+
+import struct
+import sys
+
+from naming import audio_stem
+
+READ_SIZE = 256 * 1024
+# Longest Layer III frame (320 kbps at 32 kHz, padded) is 1441 bytes
+MAX_FRAME_SIZE = 1441
+
+# Layer III bitrates (kbps) by bitrate index
+BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Sample rates by MPEG version bits (0 = 2.5, 2 = 2, 3 = 1)
+SAMPLE_RATES = {
+    3: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    0: (11025, 12000, 8000),
+}
+
+SEEK_EXTENSION = '.seek'
+SEEK_MAGIC = b'GPSK'
+SEEK_VERSION = 1
+SEEK_HEADER = struct.Struct('<4sB3xIII')
+# One entry a second: about 43 KB for a three hour episode
+SEEK_INTERVAL_MS = 1000
+
+
+def parse_header(data, pos=0):
+    """(frame length, samples, sample rate, side info size) of the header at `pos`, or None"""
+    if len(data) - pos < 4 or data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+
+    version = (b1 >> 3) & 0x3
+    layer = (b1 >> 1) & 0x3
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 0x3
+    # Layer III only, no free-format or reserved values
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = BITRATES[1 if mpeg1 else 2][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 0x1
+    mono = (b3 >> 6) == 3
+
+    if mpeg1:
+        return 144 * bitrate // sample_rate + padding, 1152, sample_rate, 17 if mono else 32
+    return 72 * bitrate // sample_rate + padding, 576, sample_rate, 9 if mono else 17
+
+
+def _id3v2_size(data):
+    if len(data) < 10 or data[:3] != b'ID3':
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _is_info_frame(data, pos, side_info):
+    tag = data[pos + 4 + side_info:pos + 8 + side_info]
+    return tag in (b'Xing', b'Info', b'VBRI')
+
+
+def iter_frames(stream, read_size=READ_SIZE):
+    """Yield (offset, length, samples, sample rate) for each audio frame of `stream`"""
+    buf = stream.read(read_size)
+    base = 0    # file offset of buf[0]
+    pos = _id3v2_size(buf)
+    eof = False
+    first = True
+    synced = False
+
+    while True:
+        if len(buf) - pos < 2 * MAX_FRAME_SIZE and not eof:
+            # Drop what's been parsed (or skip past a tag longer than the buffer)
+            skip = min(pos, len(buf))
+            buf, base, pos = buf[skip:], base + skip, pos - skip
+            while pos > 0 and not eof:
+                skipped = len(stream.read(min(pos, read_size)))
+                eof = skipped == 0
+                base += skipped
+                pos -= skipped
+            more = stream.read(read_size) if not eof else b''
+            if more:
+                buf += more
+                continue
+            eof = True
+
+        header = parse_header(buf, pos)
+        if header is not None:
+            length, samples, sample_rate, side_info = header
+            # After a resync, guard against a stray sync word: the next frame must follow on
+            if not synced and pos + length + 4 <= len(buf) and parse_header(buf, pos + length) is None:
+                header = None
+        synced = header is not None
+        if header is None:
+            # Resync on the next possible frame start
+            nxt = buf.find(b'\xff', pos + 1)
+            if nxt < 0:
+                if eof:
+                    return
+                pos = len(buf)
+            else:
+                pos = nxt
+            continue
+
+        if pos + length > len(buf):
+            # Truncated final frame
+            return
+        if not (first and _is_info_frame(buf, pos, side_info)):
+            yield base + pos, length, samples, sample_rate
+        first = False
+        pos += length
+
+
+def audio_start(stream):
+    """Byte offset of the first audio frame, or None"""
+    for offset, *_ in iter_frames(stream):
+        return offset
+    return None
+
+
+def byte_offsets(stream, times):
+    """Byte offset of the frame playing at each of `times` (seconds, ascending)
+
+    Times past the end of the stream get None.
+    """
+    offsets = []
+    elapsed = 0.0
+    for offset, _, samples, sample_rate in iter_frames(stream):
+        frame_end = elapsed + samples / sample_rate
+        while len(offsets) < len(times) and times[len(offsets)] < frame_end:
+            offsets.append(offset)
+        if len(offsets) == len(times):
+            break
+        elapsed = frame_end
+    return offsets + [None] * (len(times) - len(offsets))
+
+
+def seek_key(key):
+    """Seek index key for an audio key: `<name>.seek`"""
+    return audio_stem(key) + SEEK_EXTENSION
+
+
+def build_seek_index(stream, size, interval_ms=SEEK_INTERVAL_MS):
+    """Seek index sidecar for an mp3 stream of `size` bytes, in one pass"""
+    offsets = []
+    elapsed_ms = 0.0
+    for offset, _, samples, sample_rate in iter_frames(stream):
+        elapsed_ms += samples * 1000 / sample_rate
+        while len(offsets) * interval_ms < elapsed_ms:
+            offsets.append(offset)
+    header = SEEK_HEADER.pack(SEEK_MAGIC, SEEK_VERSION, interval_ms, size, len(offsets))
+    return header + struct.pack(f'<{len(offsets)}I', *offsets)
+
+
+def decode_seek_index(data):
+    """(interval_ms, file size, [offset, ...]) from a seek index sidecar"""
+    magic, version, interval_ms, size, count = SEEK_HEADER.unpack_from(data)
+    if magic != SEEK_MAGIC or version != SEEK_VERSION:
+        raise ValueError("not a seek index")
+    return interval_ms, size, list(struct.unpack_from(f'<{count}I', data, SEEK_HEADER.size))
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    path, times = sys.argv[1], [float(t) for t in sys.argv[2:]]
+    with open(path, 'rb') as f:
+        frames = 0
+        duration = 0.0
+        size = 0
+        for _, length, samples, sample_rate in iter_frames(f):
+            frames += 1
+            duration += samples / sample_rate
+            size += length
+    print(f"{path}: {frames} frames, {duration:.1f}s, {size * 8 / duration / 1000 if duration else 0:.0f} kbps average")
+
+    if times:
+        with open(path, 'rb') as f:
+            for t, offset in zip(sorted(times), byte_offsets(f, sorted(times))):
+                print(f"  {t:.1f}s -> byte {offset}")
@@ -0,0 +1,378 @@
+"""
+Resumable multipart uploads to R2
+
+Files are split into fixed-size parts that are uploaded by a small thread
+pool. The upload ID and every confirmed part are written to a local state
+file as they complete, so an interrupted upload of a 280 MB episode picks
+up from the last confirmed part on the next run instead of starting again.
+An optional bandwidth cap (shared by all uploads in the process) keeps the
+uplink usable for the VPN.
+
+upload_stream() does the same for data that is still being produced (e.g.
+piped out of yt-dlp/ffmpeg): parts are read into a small bounded buffer and
+uploaded as they fill, so nothing is staged on disk.
+
+Usage:
+    from multipart_upload import upload_file, upload_stream
+    etag = upload_file(path, key, progress=lambda n: ...)
+    etag, size = upload_stream(proc.stdout, key)
+
+Defaults can be overridden with environment variables:
+    R2_PART_SIZE_MB         part size in MB (default 16, minimum 5)
+    R2_PART_THREADS         concurrent part uploads per file (default 4)
+    R2_UPLOAD_LIMIT_MBPS    bandwidth cap in megabits/s (default: unlimited)
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from botocore.exceptions import ClientError
+
+from r2_storage import get_client, BUCKET_NAME
+
+MB = 1024 * 1024
+
+PART_SIZE = max(5, int(os.environ.get('R2_PART_SIZE_MB', 16))) * MB
+PART_THREADS = int(os.environ.get('R2_PART_THREADS', 4))
+BANDWIDTH_LIMIT_MBPS = float(os.environ.get('R2_UPLOAD_LIMIT_MBPS', 0)) or None
+
+STATE_DIR = Path(__file__).parent / ".upload_state"
+
+
+class RateLimiter:
+    """Token bucket shared by every uploading thread"""
+
+    def __init__(self, bytes_per_second):
+        self.rate = bytes_per_second
+        self._allowance = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        """Block until `nbytes` may be sent without exceeding the rate"""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            # Allow at most one second of burst after an idle period
+            self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+            self._last = now
+            self._allowance -= nbytes
+            wait = -self._allowance / self.rate if self._allowance < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+_limiter = RateLimiter(BANDWIDTH_LIMIT_MBPS * 1_000_000 / 8 if BANDWIDTH_LIMIT_MBPS else None)
+
+
+def set_bandwidth_limit(mbps):
+    """Change the process-wide upload cap (megabits/s, None for unlimited)"""
+    _limiter.rate = mbps * 1_000_000 / 8 if mbps else None
+
+
+def _state_path(key):
+    return STATE_DIR / (hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+
+def _load_state(key, path, part_size):
+    state_file = _state_path(key)
+    if not state_file.exists():
+        return None
+    try:
+        state = json.loads(state_file.read_text(encoding='utf-8'))
+    except ValueError:
+        return None
+
+    stat = path.stat()
+    if (state.get('key') != key or state.get('size') != stat.st_size
+            or state.get('mtime') != stat.st_mtime or state.get('part_size') != part_size):
+        # Local file changed since the interrupted upload - start over
+        _abort(state)
+        return None
+    return state
+
+
+def _save_state(state):
+    STATE_DIR.mkdir(exist_ok=True)
+    state_file = _state_path(state['key'])
+    tmp = state_file.with_suffix('.tmp')
+    tmp.write_text(json.dumps(state), encoding='utf-8')
+    os.replace(tmp, state_file)
+
+
+def _clear_state(key):
+    try:
+        _state_path(key).unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _abort(state):
+    try:
+        get_client().abort_multipart_upload(Bucket=BUCKET_NAME, Key=state['key'], UploadId=state['upload_id'])
+    except ClientError:
+        pass
+    _clear_state(state['key'])
+
+
+def _confirmed_parts(key, upload_id):
+    """Parts R2 has actually stored for an upload, or None if it is gone"""
+    parts = {}
+    try:
+        paginator = get_client().get_paginator('list_parts')
+        for page in paginator.paginate(Bucket=BUCKET_NAME, Key=key, UploadId=upload_id):
+            for part in page.get('Parts', []):
+                parts[part['PartNumber']] = part['ETag']
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchUpload', '404'):
+            return None
+        raise
+    return parts
+
+
+def file_md5(path, chunk_size=MB):
+    """Streaming MD5 of a whole file (the ETag of a single-part upload)"""
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def local_etag(path, part_size=PART_SIZE):
+    """The ETag R2 would report for `path` uploaded with `part_size` parts
+
+    Single-part uploads get the plain MD5; multipart uploads get the MD5 of
+    the concatenated part MD5s plus "-<part count>".
+    """
+    part_digests = []
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(part_size)
+            if not data:
+                break
+            part_digests.append(hashlib.md5(data).digest())
+
+    if len(part_digests) <= 1:
+        return (part_digests[0] if part_digests else hashlib.md5().digest()).hex()
+    combined = hashlib.md5(b''.join(part_digests)).hexdigest()
+    return f"{combined}-{len(part_digests)}"
+
+
+def matches_remote(path, remote_etag, remote_size):
+    """True if the local file is byte-identical to an object of that ETag/size
+
+    Objects uploaded by other tools may have used a different part size, so
+    for multipart ETags every plausible part size that yields the same part
+    count is tried.
+    """
+    path = Path(path)
+    if path.stat().st_size != remote_size:
+        return False
+
+    remote_etag = remote_etag.strip('"')
+    if '-' not in remote_etag:
+        return file_md5(path) == remote_etag
+
+    parts = int(remote_etag.rsplit('-', 1)[1])
+    candidates = [PART_SIZE, 8 * MB, 16 * MB, 5 * MB]
+    # Part size implied by the part count, rounded up to a whole MB
+    candidates.append(-(-remote_size // parts // MB) * MB)
+    for part_size in dict.fromkeys(candidates):
+        if part_size and -(-remote_size // part_size) == parts:
+            if local_etag(path, part_size=part_size) == remote_etag:
+                return True
+    return False
+
+
+def upload_file(path, key=None, part_size=PART_SIZE, threads=PART_THREADS, extra_args=None, progress=None):
+    """Upload `path` to `key` (default: the file name) and return its ETag
+
+    Files up to one part are sent with a single put_object. Larger files use
+    a resumable multipart upload. `progress(nbytes)` is called as data is
+    confirmed, including parts recovered from an earlier interrupted run.
+    """
+    path = Path(path)
+    key = key or path.name
+    extra_args = extra_args or {}
+    s3 = get_client()
+    size = path.stat().st_size
+
+    if size <= part_size:
+        _limiter.consume(size)
+        with open(path, 'rb') as f:
+            response = s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=f, **extra_args)
+        if progress:
+            progress(size)
+        return response['ETag'].strip('"')
+
+    total_parts = (size + part_size - 1) // part_size
+    state = _load_state(key, path, part_size)
+    if state is not None:
+        confirmed = _confirmed_parts(key, state['upload_id'])
+        if confirmed is None:
+            _clear_state(key)
+            state = None
+        else:
+            state['parts'] = {str(n): etag for n, etag in confirmed.items()}
+
+    if state is None:
+        response = s3.create_multipart_upload(Bucket=BUCKET_NAME, Key=key, **extra_args)
+        stat = path.stat()
+        state = {
+            'key': key,
+            'upload_id': response['UploadId'],
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'part_size': part_size,
+            'parts': {},
+        }
+    _save_state(state)
+
+    if state['parts'] and progress:
+        progress(sum(min(part_size, size - (int(n) - 1) * part_size) for n in state['parts']))
+
+    state_lock = threading.Lock()
+    todo = [n for n in range(1, total_parts + 1) if str(n) not in state['parts']]
+
+    def send_part(number):
+        offset = (number - 1) * part_size
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(part_size)
+        _limiter.consume(len(data))
+        response = s3.upload_part(
+            Bucket=BUCKET_NAME,
+            Key=key,
+            UploadId=state['upload_id'],
+            PartNumber=number,
+            Body=data,
+        )
+        with state_lock:
+            state['parts'][str(number)] = response['ETag']
+            _save_state(state)
+        if progress:
+            progress(len(data))
+
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        futures = [pool.submit(send_part, n) for n in todo]
+        for future in as_completed(futures):
+            # Surface the first failure; confirmed parts stay in the state
+            # file so the next run resumes from there.
+            future.result()
+
+    parts = [
+        {'PartNumber': int(n), 'ETag': etag}
+        for n, etag in sorted(state['parts'].items(), key=lambda item: int(item[0]))
+    ]
+    response = s3.complete_multipart_upload(
+        Bucket=BUCKET_NAME,
+        Key=key,
+        UploadId=state['upload_id'],
+        MultipartUpload={'Parts': parts},
+    )
+    _clear_state(key)
+    return response['ETag'].strip('"')
+
+
+def _read_part(stream, size):
+    """Read `size` bytes from a pipe, or fewer only at end of stream"""
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = stream.read(size - len(buf))
+        if not chunk:
+            break
+        buf += chunk
+    return bytes(buf)
+
+
+def upload_stream(stream, key, part_size=PART_SIZE, threads=PART_THREADS, extra_args=None,
+                  progress=None, before_complete=None):
+    """Upload everything read from `stream` to `key`; returns (etag, size)
+
+    Parts go out while the stream is still being read. At most `threads`
+    parts are in flight plus the one being filled, so memory stays around
+    (threads + 1) * part_size. A stream can't be re-read, so unlike
+    upload_file() a failure aborts the upload rather than resuming it.
+    `before_complete()` runs once the stream is exhausted and may raise
+    (e.g. the producer exited with an error) to abort instead of
+    publishing a truncated object.
+    """
+    extra_args = extra_args or {}
+    s3 = get_client()
+
+    first = _read_part(stream, part_size)
+    second = _read_part(stream, part_size) if len(first) == part_size else b''
+    if not second:
+        if before_complete:
+            before_complete()
+        _limiter.consume(len(first))
+        response = s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=first, **extra_args)
+        if progress:
+            progress(len(first))
+        return response['ETag'].strip('"'), len(first)
+
+    upload_id = s3.create_multipart_upload(Bucket=BUCKET_NAME, Key=key, **extra_args)['UploadId']
+    slots = threading.BoundedSemaphore(max(1, threads))
+    parts = {}
+    errors = []
+
+    def send_part(number, data):
+        try:
+            _limiter.consume(len(data))
+            response = s3.upload_part(
+                Bucket=BUCKET_NAME,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=number,
+                Body=data,
+            )
+            parts[number] = response['ETag']
+            if progress:
+                progress(len(data))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            slots.release()
+
+    size = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+            number = 0
+            data = first
+            while data and not errors:
+                # Blocks while every upload slot is busy, which in turn
+                # stops us reading (and buffering) more of the stream
+                slots.acquire()
+                number += 1
+                size += len(data)
+                pool.submit(send_part, number, data)
+                data, second = second, b''
+                if not data:
+                    data = _read_part(stream, part_size)
+
+        if errors:
+            raise errors[0]
+        if before_complete:
+            before_complete()
+
+        response = s3.complete_multipart_upload(
+            Bucket=BUCKET_NAME,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': n, 'ETag': parts[n]} for n in sorted(parts)]},
+        )
+    except BaseException:
+        try:
+            s3.abort_multipart_upload(Bucket=BUCKET_NAME, Key=key, UploadId=upload_id)
+        except ClientError:
+            pass
+        raise
+
+    return response['ETag'].strip('"'), size
@@ -0,0 +1,121 @@
+"""
+Episode filename conventions shared by the download and index scripts
+
+Archive objects are named `YYYY-MM-DD Gilles Peterson - Title.mp3` (or
+`.m4a` for episodes stored as BBC's native AAC without re-encoding). Older
+uploads may still carry the raw BBC title (`Gilles Peterson, 10⧸01⧸2026.mp3`)
+or a bracketed BBC episode ID (`... [m002m9ss].mp3`); parse_key() pulls
+whatever it can out of either form.
+"""
+
+import os
+import re
+
+AUDIO_EXTENSIONS = ('.mp3', '.m4a')
+CONTENT_TYPES = {
+    '.mp3': 'audio/mpeg',
+    '.m4a': 'audio/mp4',
+}
+# Format new downloads are stored in: 'mp3' (re-encoded) or 'm4a' (remuxed)
+AUDIO_FORMAT = os.environ.get('GP_AUDIO_FORMAT', 'mp3')
+
+DATE_PREFIX_RE = re.compile(r'^(\d{4}-\d{2}-\d{2})')
+# BBC's title dates use the "⧸" (U+29F8) lookalike slash
+BBC_TITLE_DATE_RE = re.compile(r'(\d{2})[⧸/](\d{2})[⧸/](\d{4})')
+# BBC programme IDs: one letter followed by 7 lowercase letters/digits
+EPISODE_ID_RE = re.compile(r'\[([bmpw][0-9a-z]{7})\]')
+
+
+def is_audio_key(key):
+    """True for episode audio objects (not catalogs, sidecars, etc.)"""
+    return key.lower().endswith(AUDIO_EXTENSIONS)
+
+
+def audio_ext(key):
+    """'.mp3' / '.m4a' for episode audio keys, else None"""
+    for ext in AUDIO_EXTENSIONS:
+        if key.lower().endswith(ext):
+            return ext
+    return None
+
+
+def content_type(key):
+    return CONTENT_TYPES.get(audio_ext(key), 'application/octet-stream')
+
+
+def audio_stem(key):
+    """Key without its audio extension (shared by an episode's renditions)"""
+    ext = audio_ext(key)
+    return key[:-len(ext)] if ext else key
+
+
+def safe_filename(s):
+    """Strip characters that are invalid in Windows filenames"""
+    s = s.replace(':', ' -')
+    return re.sub(r'[<>"/\\|?*]', '', s)
+
+
+def episode_date(key):
+    """Broadcast date (YYYY-MM-DD) from a key, or None"""
+    m = DATE_PREFIX_RE.match(key)
+    if m:
+        return m.group(1)
+    m = BBC_TITLE_DATE_RE.search(key)
+    if m:
+        day, month, year = m.groups()
+        return f"{year}-{month}-{day}"
+    return None
+
+
+def episode_id(key):
+    """BBC episode ID embedded in a key as `[m002m9ss]`, or None"""
+    m = EPISODE_ID_RE.search(key)
+    return m.group(1) if m else None
+
+
+def normalize_title(title):
+    """Reduce a title or filename to a comparable form
+
+    "2025-11-22 Gilles Peterson - Zakia Sewell sits in.mp3" and
+    "Gilles Peterson, Zakia Sewell sits in [m002m9ss] (1).mp3" both
+    normalize to "zakia sewell sits in".
+    """
+    s = audio_stem(title)
+    s = DATE_PREFIX_RE.sub('', s)
+    s = BBC_TITLE_DATE_RE.sub('', s)
+    s = EPISODE_ID_RE.sub('', s)
+    s = re.sub(r'\(\d+\)\s*$', '', s.strip())
+    s = re.sub(r'^\W*gilles peterson\W*', '', s, flags=re.IGNORECASE)
+    s = re.sub(r'[^0-9a-z]+', ' ', s.lower())
+    return s.strip()
+
+
+def clean_title(title):
+    """Strip the show name, BBC date and ID decorations from a raw title"""
+    s = audio_stem(title)
+    s = DATE_PREFIX_RE.sub('', s)
+    s = BBC_TITLE_DATE_RE.sub('', s)
+    s = EPISODE_ID_RE.sub('', s)
+    s = re.sub(r'\(\d+\)\s*$', '', s.strip())
+    s = re.sub(r'^\W*Gilles Peterson\s*[,:\-]?\s*', '', s.strip(), flags=re.IGNORECASE)
+    s = s.replace('：', ':').replace(',', '')
+    return re.sub(r'\s+', ' ', s).strip(' -')
+
+
+def episode_filename(date, title, ext='.mp3'):
+    """Archive name: `YYYY-MM-DD Gilles Peterson - Title.mp3`"""
+    clean = clean_title(title)
+    if clean and clean.lower() != 'gilles peterson':
+        name = f"{date} Gilles Peterson - {clean}{ext}"
+    else:
+        name = f"{date} Gilles Peterson{ext}"
+    return safe_filename(name)
+
+
+def parse_key(key):
+    """Split an archive key into the fields the manifest indexes"""
+    return {
+        'date': episode_date(key),
+        'episode_id': episode_id(key),
+        'title_norm': normalize_title(key),
+    }
@@ -0,0 +1,177 @@
+"""
+Waveform peaks sidecars for the web player
+
+Each episode is decoded once, as a stream, to low-rate mono PCM. NumPy
+block reductions turn it into a fixed number of min/max buckets, and the
+result is stored next to the audio as `<name>.peaks`: a few KB the player
+can draw a scrub preview from without touching the 280 MB audio file.
+
+The same ffmpeg pass can run the EBU R128 loudness filter, so ingest gets
+both peaks and loudness from one decode (see analyze_audio()).
+
+Sidecar format (little-endian):
+    4s  magic b'GPPK'
+    B   version (1)
+    3x  padding
+    I   sample rate of the analysed PCM
+    I   samples per bucket
+    I   bucket count
+    then `bucket count` pairs of int16 (min, max)
+
+Usage:
+    python peaks.py FILE...      # writes FILE.peaks next to each input
+
+Requirements:
+    - ffmpeg (and ffprobe) on PATH
+    - numpy (optional; without it no peaks are produced)
+"""
+
+import struct
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+from loudness import EBUR128_FILTER, REPLAYGAIN_REFERENCE_LUFS, parse_summary
+from naming import audio_stem
+from transcode import probe_duration
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PEAKS_EXTENSION = '.peaks'
+PEAKS_MAGIC = b'GPPK'
+PEAKS_VERSION = 1
+HEADER = struct.Struct('<4sB3xIII')
+
+# Plenty for a waveform overview, and small (8 KB for any episode length)
+PEAKS_BUCKETS = 2000
+PEAKS_SAMPLE_RATE = 8000
+
+READ_SIZE = 256 * 1024
+
+
+class PeakReducer:
+    """Streaming min/max per fixed-size bucket of int16 PCM"""
+
+    def __init__(self, samples_per_bucket):
+        self.samples_per_bucket = max(1, int(samples_per_bucket))
+        self._carry = np.empty(0, dtype='<i2')
+        self._odd_byte = b''
+        self._mins = []
+        self._maxs = []
+
+    def feed(self, data):
+        data = self._odd_byte + data
+        usable = len(data) - len(data) % 2
+        self._odd_byte = data[usable:]
+
+        samples = np.frombuffer(data[:usable], dtype='<i2')
+        if self._carry.size:
+            samples = np.concatenate([self._carry, samples])
+
+        whole = samples.size - samples.size % self.samples_per_bucket
+        if whole:
+            blocks = samples[:whole].reshape(-1, self.samples_per_bucket)
+            self._mins.append(blocks.min(axis=1))
+            self._maxs.append(blocks.max(axis=1))
+        self._carry = samples[whole:].copy()
+
+    def finish(self):
+        """(buckets, 2) int16 array of min/max pairs"""
+        if self._carry.size:
+            self._mins.append(self._carry.min(keepdims=True))
+            self._maxs.append(self._carry.max(keepdims=True))
+            self._carry = np.empty(0, dtype='<i2')
+        if not self._mins:
+            return np.zeros((0, 2), dtype='<i2')
+        return np.stack([np.concatenate(self._mins), np.concatenate(self._maxs)], axis=1).astype('<i2')
+
+
+def encode_peaks(pairs, samples_per_bucket, sample_rate=PEAKS_SAMPLE_RATE):
+    header = HEADER.pack(PEAKS_MAGIC, PEAKS_VERSION, sample_rate, samples_per_bucket, len(pairs))
+    return header + pairs.astype('<i2').tobytes()
+
+
+def decode_peaks(data):
+    """(sample_rate, samples_per_bucket, [(min, max), ...]) from a sidecar"""
+    magic, version, sample_rate, samples_per_bucket, count = HEADER.unpack_from(data)
+    if magic != PEAKS_MAGIC or version != PEAKS_VERSION:
+        raise ValueError("not a peaks sidecar")
+    values = struct.unpack_from(f'<{count * 2}h', data, HEADER.size)
+    return sample_rate, samples_per_bucket, list(zip(values[0::2], values[1::2]))
+
+
+def peaks_key(key):
+    """Sidecar key for an audio key: `<name>.peaks`"""
+    return audio_stem(key) + PEAKS_EXTENSION
+
+
+def analyze_audio(source, loudness=True, buckets=PEAKS_BUCKETS):
+    """Decode `source` once; returns (peaks sidecar bytes, loudness dict or None)
+
+    The loudness dict has the same shape as loudness.analyze().
+    """
+    if np is None:
+        raise RuntimeError("numpy is not installed")
+
+    duration = probe_duration(source)
+    total_samples = int(duration * PEAKS_SAMPLE_RATE) if duration else None
+    samples_per_bucket = -(-total_samples // buckets) if total_samples else PEAKS_SAMPLE_RATE
+
+    filters = f"{EBUR128_FILTER}," if loudness else ''
+    proc = subprocess.Popen(
+        [
+            'ffmpeg', '-hide_banner', '-nostats',
+            '-i', str(source),
+            '-vn',
+            '-af', f"{filters}aresample={PEAKS_SAMPLE_RATE}",
+            '-ac', '1',
+            '-f', 's16le', '-acodec', 'pcm_s16le',
+            'pipe:1',
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    # Drain stderr alongside stdout so neither pipe can fill up and stall ffmpeg
+    stderr_chunks = []
+    drain = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+    drain.start()
+
+    reducer = PeakReducer(samples_per_bucket)
+    for chunk in iter(lambda: proc.stdout.read(READ_SIZE), b''):
+        reducer.feed(chunk)
+    proc.wait()
+    drain.join()
+    stderr = b''.join(stderr_chunks).decode('utf-8', 'replace')
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed on {source}: {stderr.strip()[-500:]}")
+
+    peaks = encode_peaks(reducer.finish(), samples_per_bucket)
+
+    values = None
+    if loudness:
+        values = parse_summary(stderr)
+        if values and values['integrated'] is not None:
+            values['replaygain'] = round(REPLAYGAIN_REFERENCE_LUFS - values['integrated'], 2)
+        else:
+            values = None
+    return peaks, values
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    for path in map(Path, sys.argv[1:]):
+        try:
+            data, _ = analyze_audio(path, loudness=False)
+        except RuntimeError as e:
+            print(f"✗ {path.name}: {e}")
+            continue
+        out = path.with_suffix(PEAKS_EXTENSION)
+        out.write_bytes(data)
+        print(f"✓ {out.name} ({len(data) / 1024:.1f} KB)")
@@ -0,0 +1,197 @@
+"""
+Bounded multi-stage worker pipeline for the download scripts
+
+Each stage (e.g. fetch -> transcode -> upload) gets its own pool of worker
+threads and hands finished items to the next stage through a bounded queue,
+so episode N+1 can be downloading while episode N is transcoding or uploading.
+
+Usage:
+    pipe = Pipeline([
+        Stage('fetch', fetch, workers=2),
+        Stage('transcode', transcode, workers=2, size_of=lambda item: ...),
+        Stage('upload', upload, workers=2),
+    ])
+    results = pipe.run(episodes)
+    pipe.print_summary()
+"""
+
+import queue
+import threading
+import time
+from datetime import datetime
+
+# Sentinel pushed through the queues once a stage has no more work
+_DONE = object()
+
+
+def log(message):
+    """Print with timestamp and thread-safe line output"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}", flush=True)
+
+
+class Stage:
+    """One pipeline step with its own worker pool
+
+    `func(item)` returns the item to hand to the next stage, or None to drop
+    it (e.g. already in R2). Exceptions are logged and counted as failures.
+    `size_of(result)` optionally returns the number of bytes processed so the
+    summary can report MB/s.
+    """
+
+    def __init__(self, name, func, workers=1, size_of=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.size_of = size_of
+
+        self.completed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def _record(self, elapsed, result=None, error=False):
+        with self._lock:
+            self.busy_seconds += elapsed
+            if error:
+                self.failed += 1
+            elif result is None:
+                self.skipped += 1
+            else:
+                self.completed += 1
+                if self.size_of:
+                    try:
+                        self.bytes += self.size_of(result) or 0
+                    except Exception:
+                        pass
+
+    @property
+    def wall_seconds(self):
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at or time.monotonic()
+        return end - self.started_at
+
+
+class Pipeline:
+    """Runs items through a list of stages with bounded hand-off queues"""
+
+    def __init__(self, stages, queue_size=None):
+        self.stages = stages
+        # Each hand-off queue holds at most `queue_size` waiting items
+        # (defaults to the next stage's worker count) so a fast stage
+        # cannot run far ahead of a slow one and fill the disk.
+        self.queue_size = queue_size
+        self.results = []
+        self._results_lock = threading.Lock()
+        self.started_at = None
+        self.finished_at = None
+
+    def _queue_for(self, stage):
+        size = self.queue_size if self.queue_size is not None else stage.workers
+        return queue.Queue(maxsize=max(1, size))
+
+    def run(self, items):
+        """Feed `items` through every stage and return the final results"""
+        queues = [self._queue_for(stage) for stage in self.stages]
+        remaining = [stage.workers for stage in self.stages]
+        remaining_lock = threading.Lock()
+        threads = []
+
+        self.started_at = time.monotonic()
+
+        def worker(index):
+            stage = self.stages[index]
+            in_q = queues[index]
+            out_q = queues[index + 1] if index + 1 < len(queues) else None
+
+            while True:
+                item = in_q.get()
+                if item is _DONE:
+                    break
+
+                with stage._lock:
+                    if stage.started_at is None:
+                        stage.started_at = time.monotonic()
+
+                start = time.monotonic()
+                try:
+                    result = stage.func(item)
+                except Exception as e:
+                    stage._record(time.monotonic() - start, error=True)
+                    log(f"✗ {stage.name} failed: {e}")
+                    continue
+
+                stage._record(time.monotonic() - start, result)
+                if result is None:
+                    continue
+
+                if out_q is not None:
+                    out_q.put(result)
+                else:
+                    with self._results_lock:
+                        self.results.append(result)
+
+            # Last worker out closes the stage and releases the next one
+            with remaining_lock:
+                remaining[index] -= 1
+                last = remaining[index] == 0
+            if last:
+                stage.finished_at = time.monotonic()
+                if out_q is not None:
+                    for _ in range(self.stages[index + 1].workers):
+                        out_q.put(_DONE)
+
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                t = threading.Thread(
+                    target=worker,
+                    args=(index,),
+                    name=f"{stage.name}-{n + 1}",
+                    daemon=True,
+                )
+                t.start()
+                threads.append(t)
+
+        for item in items:
+            queues[0].put(item)
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_DONE)
+
+        for t in threads:
+            t.join()
+
+        self.finished_at = time.monotonic()
+        return self.results
+
+    def print_summary(self):
+        """Print per-stage throughput for the last run"""
+        total = (self.finished_at or time.monotonic()) - (self.started_at or time.monotonic())
+
+        print()
+        print("=" * 60)
+        print("Pipeline summary")
+        print("=" * 60)
+        print(f"{'Stage':<12}{'Workers':>8}{'Done':>6}{'Skip':>6}{'Fail':>6}"
+              f"{'Busy':>10}{'Wall':>10}{'MB/s':>8}")
+        for stage in self.stages:
+            wall = stage.wall_seconds
+            mb_s = (stage.bytes / (1024 * 1024) / wall) if wall and stage.bytes else 0.0
+            print(f"{stage.name:<12}{stage.workers:>8}{stage.completed:>6}"
+                  f"{stage.skipped:>6}{stage.failed:>6}"
+                  f"{_fmt_seconds(stage.busy_seconds):>10}{_fmt_seconds(wall):>10}"
+                  f"{mb_s:>8.2f}")
+        print(f"Total wall time: {_fmt_seconds(total)}")
+
+
+def _fmt_seconds(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{(seconds % 3600) // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
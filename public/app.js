@@ -16,6 +16,17 @@ const mfdoomSection = document.getElementById('mfdoomSection');
 const viewToggle = document.getElementById('viewToggle');
 const toggleIcon = document.getElementById('toggleIcon');
 const pageTitle = document.getElementById('pageTitle');
+const waveformCanvas = document.getElementById('waveform');
+const tracklistEl = document.getElementById('tracklist');
+const searchInput = document.getElementById('search');
+
+// Waveform of the current episode, decoded from its .peaks sidecar
+let waveformPeaks = null;
+let waveformDrawnAt = -1;
+
+// Tracklist of the current episode, from its .chapters.json sidecar
+let chapters = [];
+let currentChapter = -1;
 
 // Load episodes on page load
 window.addEventListener('DOMContentLoaded', loadEpisodes);
@@ -94,7 +105,10 @@ function playEpisode(episode, startTime = 0) {
 
     currentTitle.textContent = formatTitle(episode.name);
     currentDate.textContent = formatDate(episode.modified);
-    audioPlayer.src = episode.url;
+    audioPlayer.src = playableUrl(episode);
+    audioPlayer.volume = replayGainVolume(episode);
+    loadWaveform(episode);
+    loadChapters(episode);
     playerDiv.style.display = 'block';
 
     // Update active state in list
@@ -121,8 +135,179 @@ function playEpisode(episode, startTime = 0) {
 }
 
 // Helper functions
+
+// Peaks sidecar (see peaks.py): 20-byte header, then int16 min/max pairs
+async function loadWaveform(episode) {
+    waveformPeaks = null;
+    waveformCanvas.style.display = 'none';
+    if (!episode.peaks) return;
+
+    try {
+        const response = await fetch(episode.peaks);
+        if (!response.ok) return;
+        const buffer = await response.arrayBuffer();
+        const view = new DataView(buffer);
+        const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+        if (magic !== 'GPPK' || view.getUint8(4) !== 1) return;
+
+        const count = view.getUint32(16, true);
+        const pairs = new Int16Array(count * 2);
+        for (let i = 0; i < count * 2; i++) {
+            pairs[i] = view.getInt16(20 + i * 2, true);
+        }
+        if (currentEpisode !== episode) return;
+
+        waveformPeaks = pairs;
+        waveformCanvas.style.display = 'block';
+        drawWaveform();
+    } catch (e) {
+        console.warn('Could not load waveform:', e);
+    }
+}
+
+function drawWaveform() {
+    if (!waveformPeaks) return;
+
+    const ratio = window.devicePixelRatio || 1;
+    const width = Math.round(waveformCanvas.clientWidth * ratio);
+    const height = Math.round(waveformCanvas.clientHeight * ratio);
+    if (waveformCanvas.width !== width || waveformCanvas.height !== height) {
+        waveformCanvas.width = width;
+        waveformCanvas.height = height;
+    }
+
+    const ctx = waveformCanvas.getContext('2d');
+    const buckets = waveformPeaks.length / 2;
+    const progress = audioPlayer.duration ? audioPlayer.currentTime / audioPlayer.duration : 0;
+    const played = Math.round(progress * width);
+    const mid = height / 2;
+
+    ctx.clearRect(0, 0, width, height);
+    for (let x = 0; x < width; x++) {
+        // Envelope of every bucket that falls in this pixel column
+        const from = Math.floor(x * buckets / width);
+        const to = Math.max(from + 1, Math.floor((x + 1) * buckets / width));
+        let min = 0;
+        let max = 0;
+        for (let b = from; b < to && b < buckets; b++) {
+            min = Math.min(min, waveformPeaks[b * 2]);
+            max = Math.max(max, waveformPeaks[b * 2 + 1]);
+        }
+        ctx.fillStyle = x < played ? '#fff' : '#777';
+        ctx.fillRect(x, mid - (max / 32768) * mid, 1, Math.max(1, ((max - min) / 32768) * mid));
+    }
+    waveformDrawnAt = played;
+}
+
+waveformCanvas.addEventListener('click', (event) => {
+    if (!audioPlayer.duration) return;
+    const rect = waveformCanvas.getBoundingClientRect();
+    audioPlayer.currentTime = ((event.clientX - rect.left) / rect.width) * audioPlayer.duration;
+});
+
+window.addEventListener('resize', drawWaveform);
+
+// Chapters sidecar (see chapters.py): {chapters: [{start, end, artist, title, offset}]}
+async function loadChapters(episode) {
+    chapters = [];
+    currentChapter = -1;
+    tracklistEl.innerHTML = '';
+    tracklistEl.style.display = 'none';
+    if (!episode.chapters) return;
+
+    try {
+        const response = await fetch(episode.chapters);
+        if (!response.ok) return;
+        const sidecar = await response.json();
+        if (currentEpisode !== episode) return;
+
+        chapters = sidecar.chapters || [];
+        tracklistEl.innerHTML = chapters
+            .map((ch, index) => `
+                <li data-index="${index}">
+                    <span class="track-time">${formatTime(ch.start)}</span>
+                    ${escapeHtml([ch.artist, ch.title].filter(Boolean).join(' – '))}
+                </li>
+            `)
+            .join('');
+        tracklistEl.style.display = chapters.length ? 'block' : 'none';
+        highlightChapter();
+    } catch (e) {
+        console.warn('Could not load tracklist:', e);
+    }
+}
+
+function highlightChapter() {
+    const t = audioPlayer.currentTime;
+    let index = -1;
+    while (index + 1 < chapters.length && chapters[index + 1].start <= t) index++;
+    if (index === currentChapter) return;
+
+    currentChapter = index;
+    tracklistEl.querySelectorAll('li').forEach((item) => {
+        item.classList.toggle('current', parseInt(item.getAttribute('data-index')) === index);
+    });
+}
+
+tracklistEl.addEventListener('click', (event) => {
+    const item = event.target.closest('li');
+    if (!item) return;
+    audioPlayer.currentTime = chapters[parseInt(item.getAttribute('data-index'))].start;
+    audioPlayer.play().catch(err => {
+        console.error('Error playing audio:', err);
+    });
+});
+
+// Filter the episode list by title or by any artist in its tracklist
+searchInput.addEventListener('input', () => {
+    const query = searchInput.value.trim().toLowerCase();
+    document.querySelectorAll('.gp-episode').forEach((item) => {
+        const ep = gpEpisodes[parseInt(item.getAttribute('data-index'))];
+        const matches = !query ||
+            ep.name.toLowerCase().includes(query) ||
+            (ep.artists || []).some(artist => artist.toLowerCase().includes(query));
+        item.style.display = matches ? '' : 'none';
+    });
+});
+
+// Level episodes using the ReplayGain value measured at ingest. An <audio>
+// element can only attenuate, so louder-than-reference episodes are turned
+// down and quieter ones play at full volume.
+function replayGainVolume(episode) {
+    const gain = episode.loudness && episode.loudness.replayGain;
+    if (typeof gain !== 'number') return 1;
+    return Math.min(1, Math.pow(10, gain / 20));
+}
+
+// Episodes stored as m4a may carry an mp3 alternate for browsers without AAC
+function playableUrl(episode) {
+    // Native HLS (Safari/iOS) starts after the first segment and seeks from cache
+    if (episode.hls && audioPlayer.canPlayType('application/vnd.apple.mpegurl')) {
+        return episode.hls;
+    }
+    if (!episode.type || audioPlayer.canPlayType(episode.type)) {
+        return episode.url;
+    }
+    const alternate = (episode.alternates || []).find(alt => audioPlayer.canPlayType(alt.type));
+    return alternate ? alternate.url : episode.url;
+}
+
+function formatTime(seconds) {
+    const s = Math.floor(seconds);
+    const h = Math.floor(s / 3600);
+    const m = Math.floor((s % 3600) / 60);
+    const mm = h ? String(m).padStart(2, '0') : m;
+    return `${h ? h + ':' : ''}${mm}:${String(s % 60).padStart(2, '0')}`;
+}
+
+function escapeHtml(text) {
+    return text.replace(/[&<>"']/g, ch => ({
+        '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+    })[ch]);
+}
+
 function formatTitle(filename) {
-    return filename.replace(/\.mp3$/i, '');
+    return filename.replace(/\.(mp3|m4a)$/i, '');
 }
 
 function formatDate(dateString) {
@@ -186,6 +371,14 @@ function loadPlaybackPosition() {
 audioPlayer.addEventListener('timeupdate', () => {
     if (!currentEpisode) return;
     const t = audioPlayer.currentTime;
+
+    // Only redraw when the played position moves by a pixel
+    if (waveformPeaks && audioPlayer.duration) {
+        const played = Math.round((t / audioPlayer.duration) * waveformCanvas.width);
+        if (played !== waveformDrawnAt) drawWaveform();
+    }
+    if (chapters.length) highlightChapter();
+
     if (t - lastSaveTime >= 10) {
         savePlaybackPosition(currentEpisode.name, t, audioPlayer.duration);
         lastSaveTime = t;
@@ -1,4 +1,4 @@
-const CACHE_NAME = 'gp-archive-v1';
+const CACHE_NAME = 'gp-archive-v4';
 const urlsToCache = [
   '/',
   '/index.html',
@@ -0,0 +1,211 @@
+"""
+Shared Cloudflare R2 access for all GP Archive scripts
+
+One lazily created, connection-pooled boto3 client is shared by every
+caller in the process (boto3 clients are thread-safe), so credential
+resolution, endpoint setup and TLS handshakes happen once instead of on
+every request.
+
+Usage:
+    from r2_storage import get_client, BUCKET_NAME
+    get_client().head_object(Bucket=BUCKET_NAME, Key=filename)
+
+Bucket listings are streamed with iter_objects(), which follows
+continuation tokens so nothing is silently truncated at 1,000 keys.
+
+Settings can be overridden with environment variables (see .env.example).
+"""
+
+import os
+import queue
+import threading
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# Cloudflare R2 credentials
+ACCESS_KEY = os.environ.get('R2_ACCESS_KEY_ID', "3fe1d0fac3028b108dfb1434fbeda5ab")
+SECRET_KEY = os.environ.get('R2_SECRET_ACCESS_KEY', "7e39e93560a2555e2e20c57a6ea094746212d3360ee13395d8ddb40c69924516")
+ACCOUNT_ID = os.environ.get('R2_ACCOUNT_ID', "daa5cfc7d0326ab77077899860d9ae03")
+BUCKET_NAME = os.environ.get('R2_BUCKET_NAME', "gparchive")
+ENDPOINT_URL = f"https://{ACCOUNT_ID}.r2.cloudflarestorage.com"
+
+# Connection pool / retry / timeout settings
+MAX_POOL_CONNECTIONS = int(os.environ.get('R2_MAX_POOL_CONNECTIONS', 32))
+CONNECT_TIMEOUT = float(os.environ.get('R2_CONNECT_TIMEOUT', 10))
+READ_TIMEOUT = float(os.environ.get('R2_READ_TIMEOUT', 120))
+MAX_ATTEMPTS = int(os.environ.get('R2_MAX_ATTEMPTS', 5))
+RETRY_MODE = os.environ.get('R2_RETRY_MODE', 'adaptive')
+
+# HLS renditions, peaks, seek indexes and tracklist sidecars are rewritten
+# under the same keys when an episode is re-published, so caches revalidate them hourly
+DERIVED_CACHE_CONTROL = 'public, max-age=3600, must-revalidate'
+
+# Listing settings
+LIST_PAGE_SIZE = 1000
+LIST_WORKERS = 4
+
+# delete_objects accepts at most 1,000 keys per request
+DELETE_BATCH_SIZE = 1000
+
+_client = None
+_client_lock = threading.Lock()
+
+# Sentinel used by the concurrent prefix lister
+_DONE = object()
+
+
+def client_config():
+    """botocore Config used for the shared client"""
+    return Config(
+        region_name='auto',
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        retries={'max_attempts': MAX_ATTEMPTS, 'mode': RETRY_MODE},
+        tcp_keepalive=True,
+    )
+
+
+def get_client():
+    """Return the process-wide R2 client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = boto3.session.Session().client(
+                    's3',
+                    endpoint_url=ENDPOINT_URL,
+                    aws_access_key_id=ACCESS_KEY,
+                    aws_secret_access_key=SECRET_KEY,
+                    config=client_config(),
+                )
+    return _client
+
+
+def object_exists(key):
+    """Check if `key` already exists in the bucket"""
+    try:
+        get_client().head_object(Bucket=BUCKET_NAME, Key=key)
+        return True
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+
+def object_size(key):
+    """Size of `key` in the bucket, or None if it doesn't exist"""
+    try:
+        return get_client().head_object(Bucket=BUCKET_NAME, Key=key)['ContentLength']
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+
+def iter_objects(prefix='', prefixes=None, page_size=LIST_PAGE_SIZE, workers=LIST_WORKERS, delimiter=None):
+    """Yield bucket objects (dicts with Key/Size/ETag/LastModified) lazily
+
+    Pages are fetched on demand by following continuation tokens, so callers
+    can start work on the first page before the listing finishes and memory
+    stays flat however large the bucket grows.
+
+    Pass `prefixes` (e.g. ['2025-', '2026-']) to list several prefixes
+    concurrently; objects are then yielded in arrival order, not key order.
+
+    With delimiter='/' only objects directly under the prefix are listed,
+    skipping "folders" such as hls/ with thousands of segment objects.
+    """
+    if prefixes:
+        yield from _iter_prefixes(list(prefixes), page_size, workers, delimiter)
+        return
+
+    extra = {'Delimiter': delimiter} if delimiter else {}
+    paginator = get_client().get_paginator('list_objects_v2')
+    pages = paginator.paginate(
+        Bucket=BUCKET_NAME,
+        Prefix=prefix,
+        PaginationConfig={'PageSize': page_size},
+        **extra,
+    )
+    for page in pages:
+        yield from page.get('Contents', [])
+
+
+def iter_keys(prefix='', prefixes=None):
+    """Yield just the object keys, see iter_objects()"""
+    for obj in iter_objects(prefix=prefix, prefixes=prefixes):
+        yield obj['Key']
+
+
+def _iter_prefixes(prefixes, page_size, workers, delimiter=None):
+    # At most a couple of pages are buffered between the listing threads
+    # and the consumer, whatever the number of prefixes.
+    buffer = queue.Queue(maxsize=page_size * 2)
+    stop = threading.Event()
+    pending = queue.Queue()
+    for prefix in prefixes:
+        pending.put(prefix)
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def lister():
+        try:
+            while not stop.is_set():
+                try:
+                    prefix = pending.get_nowait()
+                except queue.Empty:
+                    break
+                for obj in iter_objects(prefix=prefix, page_size=page_size, delimiter=delimiter):
+                    if not put(obj):
+                        return
+        except Exception as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    threads = [
+        threading.Thread(target=lister, name=f"r2-list-{n + 1}", daemon=True)
+        for n in range(max(1, min(workers, len(prefixes))))
+    ]
+    for t in threads:
+        t.start()
+
+    running = len(threads)
+    try:
+        while running:
+            item = buffer.get()
+            if item is _DONE:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        # Unblock the listing threads if the caller stopped early
+        stop.set()
+
+
+def delete_keys(keys):
+    """delete_objects in chunks of DELETE_BATCH_SIZE; returns keys that failed"""
+    failed = []
+    s3 = get_client()
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[i:i + DELETE_BATCH_SIZE]
+        response = s3.delete_objects(
+            Bucket=BUCKET_NAME,
+            Delete={'Objects': [{'Key': k} for k in batch], 'Quiet': True},
+        )
+        for error in response.get('Errors', []):
+            print(f"  ✗ Could not delete {error['Key']}: {error.get('Message', error.get('Code'))}")
+            failed.append(error['Key'])
+    return failed
@@ -1,18 +1,26 @@
-import boto3
+"""
+Rename files in R2 to the dated `YYYY-MM-DD Gilles Peterson - Title.mp3` form
+
+Usage:
+    python rename_with_dates.py [--confirm]     # apply FILE_RENAMING
+    python rename_with_dates.py --rule dated    # derive the mapping from the manifest
+    python rename_with_dates.py --resume [journal]
+    python rename_with_dates.py --rollback [journal]
+
+Renames run through batch_rename (concurrent verified copies, batched
+deletes, and a journal in rename_journals/ for resume/rollback).
+"""
+import argparse
 import sys
-from datetime import datetime
+
+from batch_rename import RenameJournal, dated_name_rule, resume, rollback, run_renames
+from catalog import publish_catalog
+from manifest import get_manifest
+from r2_storage import iter_keys
 
 # Set UTF-8 encoding
 sys.stdout.reconfigure(encoding='utf-8')
 
-# R2 credentials
-ACCESS_KEY = "3fe1d0fac3028b108dfb1434fbeda5ab"
-SECRET_KEY = "7e39e93560a2555e2e20c57a6ea094746212d3360ee13395d8ddb40c69924516"
-ACCOUNT_ID = "daa5cfc7d0326ab77077899860d9ae03"
-BUCKET_NAME = "gparchive"
-
-ENDPOINT_URL = f"https://{ACCOUNT_ID}.r2.cloudflarestorage.com"
-
 # Mapping of current filenames to proper dated filenames
 # Format: YYYY-MM-DD Title.mp3
 # Dates confirmed from 1001tracklists.com and BBC broadcast schedule (Saturdays)
@@ -40,68 +48,80 @@ FILE_RENAMING = {
     "Gilles Peterson, D'Angelo Tribute (1).mp3": "2025-10-18 Gilles Peterson - D'Angelo Tribute.mp3",
 }
 
-def rename_files():
-    s3_client = boto3.client(
-        's3',
-        endpoint_url=ENDPOINT_URL,
-        aws_access_key_id=ACCESS_KEY,
-        aws_secret_access_key=SECRET_KEY,
-        region_name='auto'
-    )
-
-    print("Renaming files in R2 to include airing dates...")
-    print("=" * 60)
-
-    success_count = 0
-    for old_name, new_name in FILE_RENAMING.items():
-        try:
-            print(f"\n{old_name}")
-            print(f"  → {new_name}")
-
-            # Copy object with new name
-            s3_client.copy_object(
-                Bucket=BUCKET_NAME,
-                CopySource={'Bucket': BUCKET_NAME, 'Key': old_name},
-                Key=new_name
-            )
-
-            # Delete old object
-            s3_client.delete_object(
-                Bucket=BUCKET_NAME,
-                Key=old_name
-            )
-
-            print(f"  ✓ Renamed successfully")
-            success_count += 1
-
-        except Exception as e:
-            print(f"  ✗ Error: {e}")
-
-    print("\n" + "=" * 60)
-    print(f"Renamed {success_count}/{len(FILE_RENAMING)} files")
+def update_catalog():
+    # Rebuild the episode catalog served by /api/episodes
+    try:
+        publish_catalog(refresh=True)
+        print("✓ Episode catalog updated")
+    except Exception as e:
+        print(f"✗ Error updating episode catalog: {str(e)}")
 
+def print_bucket():
     # List all files after renaming
     print("\nFiles in bucket (sorted by name/date):")
     try:
-        response = s3_client.list_objects_v2(Bucket=BUCKET_NAME)
-        if 'Contents' in response:
-            files = sorted([obj['Key'] for obj in response['Contents']], reverse=True)
-            for i, filename in enumerate(files, 1):
-                print(f"  {i}. {filename}")
+        files = sorted(iter_keys(), reverse=True)
+        for i, filename in enumerate(files, 1):
+            print(f"  {i}. {filename}")
     except Exception as e:
         print(f"Error listing files: {e}")
 
+def rename_files(mapping=FILE_RENAMING):
+    print("Renaming files in R2 to include airing dates...")
+    print("=" * 60)
+
+    run_renames(mapping)
+    update_catalog()
+    print_bucket()
+
+def open_journal(path):
+    journal = RenameJournal(path) if path else RenameJournal.latest()
+    if journal is None or not journal.path.exists():
+        print("No rename journal found.")
+        sys.exit(1)
+    print(f"Using journal: {journal.path}")
+    return journal
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rename R2 files to dated names")
+    parser.add_argument('--confirm', action='store_true', help="don't ask for confirmation")
+    parser.add_argument('--rule', choices=['dated'],
+                        help="derive the mapping from the manifest instead of FILE_RENAMING")
+    parser.add_argument('--resume', nargs='?', const='', metavar='JOURNAL',
+                        help="finish an interrupted run (default: latest journal)")
+    parser.add_argument('--rollback', nargs='?', const='', metavar='JOURNAL',
+                        help="undo a run (default: latest journal)")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    import sys
-    # Auto-confirm if --confirm flag is provided
-    if len(sys.argv) > 1 and sys.argv[1] == '--confirm':
-        rename_files()
+    args = parse_args()
+
+    if args.resume is not None:
+        resume(open_journal(args.resume))
+        update_catalog()
+    elif args.rollback is not None:
+        rollback(open_journal(args.rollback))
+        update_catalog()
     else:
-        print("\nWARNING: This will rename all files in your R2 bucket!")
-        print("Current filenames will be replaced with dated versions.")
-        response = input("\nContinue? (yes/no): ")
-
-        if response.lower() == 'yes':
-            rename_files()
+        if args.rule == 'dated':
+            manifest = get_manifest()
+            manifest.refresh()
+            mapping = dated_name_rule(manifest)
+        else:
+            mapping = FILE_RENAMING
+        if not mapping:
+            print("Nothing to rename.")
+            sys.exit(0)
+
+        # Auto-confirm if --confirm flag is provided
+        if args.confirm:
+            rename_files(mapping)
         else:
-            print("Cancelled.")
+            print(f"\nWARNING: This will rename {len(mapping)} files in your R2 bucket!")
+            print("Current filenames will be replaced with dated versions.")
+            response = input("\nContinue? (yes/no): ")
+
+            if response.lower() == 'yes':
+                rename_files(mapping)
+            else:
+                print("Cancelled.")
@@ -0,0 +1,130 @@
+"""
+Order download jobs by how soon their episodes leave BBC Sounds
+
+Episodes stay on BBC Sounds for about AVAILABILITY_DAYS after broadcast.
+Processing candidates in list order (newest first) means that after a few
+weeks without the VPN, the oldest episodes expire while newer ones are
+still downloading. The scheduler puts the episode closest to expiry first.
+
+It also estimates when each job will finish. How many seconds each
+pipeline stage spent per episode is recorded after every run, smoothed,
+in the manifest's state table. A pipeline finishes its k-th job after
+about one job's latency through every stage, plus k periods of its
+slowest stage (per-job seconds / workers). Scripts without a pipeline
+give their own per-job estimate instead, which the stats never see. Any
+episode estimated to finish after it expires gets a warning before the
+run starts.
+
+Usage:
+    from scheduler import prioritize, record_run
+    episodes = prioritize(episodes, pipe.stages)
+    pipe.run(episodes)
+    record_run(pipe.stages)
+
+    episodes = prioritize(episodes, seconds_per_job=1200)   # one job at a time
+"""
+
+import json
+from datetime import datetime, timedelta
+
+from bbc_metadata import AVAILABILITY_DAYS
+from manifest import get_manifest
+from pipeline import log
+
+THROUGHPUT_STATE = 'throughput'
+# Weight of the latest run in the smoothed per-job seconds
+SMOOTHING = 0.3
+# Per-job seconds for stages that have no recorded runs yet
+DEFAULT_SECONDS = {'fetch': 900, 'transcode': 300, 'upload': 300, 'hls': 300, 'mp3': 300}
+FALLBACK_SECONDS = 300
+
+
+def expires_at(ep):
+    """When an episode is expected to leave BBC Sounds, or None if its date is unknown"""
+    try:
+        broadcast = datetime.strptime(ep.get('date') or '', '%Y-%m-%d')
+    except ValueError:
+        return None
+    # Available until the end of the last day
+    return broadcast + timedelta(days=AVAILABILITY_DAYS + 1)
+
+
+def load_stats():
+    """Smoothed seconds per job by stage name"""
+    return json.loads(get_manifest().get_state(THROUGHPUT_STATE) or '{}')
+
+
+def record_run(stages):
+    """Fold a finished pipeline run's per-job stage times into the stats"""
+    stats = load_stats()
+    for stage in stages:
+        if not stage.completed:
+            continue
+        seconds = stage.busy_seconds / stage.completed
+        previous = stats.get(stage.name)
+        stats[stage.name] = seconds if previous is None else (1 - SMOOTHING) * previous + SMOOTHING * seconds
+    get_manifest().set_state(THROUGHPUT_STATE, json.dumps(stats))
+    return stats
+
+
+def plan(episodes, stages=(), now=None, stats=None, seconds_per_job=None):
+    """[(episode, expires at, estimated finish)], most urgent first
+
+    Episodes already past their window go last (they'll most likely fail);
+    undated ones go just before them. Scripts that run one job at a time
+    outside a pipeline pass `seconds_per_job` instead of `stages`.
+    """
+    now = now or datetime.now()
+    if seconds_per_job is not None:
+        latency = period = seconds_per_job
+    else:
+        stats = load_stats() if stats is None else stats
+        seconds = [(stats.get(s.name) or DEFAULT_SECONDS.get(s.name, FALLBACK_SECONDS), s.workers) for s in stages]
+        latency = sum(per_job for per_job, _ in seconds)
+        period = max((per_job / workers for per_job, workers in seconds), default=0)
+
+    def urgency(ep):
+        expires = expires_at(ep)
+        if expires is None:
+            return 1, datetime.max
+        return (2 if expires <= now else 0), expires
+
+    ordered = sorted(episodes, key=urgency)
+    return [
+        (ep, expires_at(ep), now + timedelta(seconds=latency + k * period))
+        for k, ep in enumerate(ordered)
+    ]
+
+
+def prioritize(episodes, stages=(), now=None, seconds_per_job=None):
+    """Episodes in download order, logging the plan and any that will expire first"""
+    now = now or datetime.now()
+    schedule = plan(episodes, stages, now, seconds_per_job=seconds_per_job)
+
+    at_risk = 0
+    for ep, expires, eta in schedule:
+        if expires is None:
+            window = "expiry unknown"
+        elif expires <= now:
+            window = "probably expired"
+        else:
+            window = f"expires in {_fmt_delta(expires - now)}"
+        late = expires is not None and now < expires < eta
+        at_risk += late
+        mark = '✗' if late else ' '
+        log(f"[schedule] {mark} {ep.get('date')} {ep.get('title')}: {window}, done in ~{_fmt_delta(eta - now)}")
+
+    if at_risk:
+        finish = schedule[-1][2]
+        log(f"[schedule] ✗ Warning: the backlog needs ~{_fmt_delta(finish - now)}; "
+            f"{at_risk} episodes will likely expire before they're downloaded")
+    return [ep for ep, _, _ in schedule]
+
+
+def _fmt_delta(delta):
+    hours = int(delta.total_seconds() // 3600)
+    if hours >= 48:
+        return f"{hours // 24}d"
+    if hours >= 1:
+        return f"{hours}h"
+    return f"{max(0, int(delta.total_seconds() // 60))}m"
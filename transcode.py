@@ -0,0 +1,301 @@
+"""
+ffmpeg helpers for turning a downloaded BBC audio stream into the archive format
+
+Downloads are fetched in their native container (bestaudio, usually AAC) and
+converted here as a separate step, so the network and CPU work can overlap.
+The archive format is either mp3 (a full re-encode) or m4a, which just
+remuxes BBC's AAC stream into an MP4 container with no re-encode.
+
+Each ffmpeg job is capped at TRANSCODE_THREADS threads and runs at low CPU
+and I/O priority (nice/ionice, or BELOW_NORMAL on Windows), and enough jobs
+run side by side to fill the machine's cores without starving the VPN
+client. Every job reports its wall time, CPU seconds and realtime factor.
+
+Usage:
+    python transcode.py [--workers N] [--threads N] [--to mp3|m4a] FILE...
+
+    from transcode import transcode_to_mp3
+    stats = transcode_to_mp3(src, dest)
+    print(format_stats(stats))
+
+Requirements:
+    - ffmpeg (and ffprobe) on PATH
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+# ffmpeg threads per job; libmp3lame itself is single-threaded, so more
+# than a couple mostly helps the AAC decoder
+TRANSCODE_THREADS = int(os.environ.get('GP_TRANSCODE_THREADS', 2))
+
+
+def default_workers(threads=TRANSCODE_THREADS):
+    """Concurrent jobs that fill the machine's cores at `threads` each"""
+    return max(1, (os.cpu_count() or 2) // max(1, threads))
+
+
+def ytdlp_audio_args(audio_format='mp3'):
+    """yt-dlp post-processing options that produce `audio_format` directly
+
+    For m4a, yt-dlp copies an AAC stream into the container instead of
+    re-encoding it.
+    """
+    if audio_format == 'm4a':
+        return ['--extract-audio', '--audio-format', 'm4a']
+    return ['--extract-audio', '--audio-format', 'mp3', '--audio-quality', '0']
+
+
+def priority_kwargs(low_priority):
+    # Keep background encodes from competing with downloads/uploads (and the VPN)
+    if low_priority and os.name == 'nt':
+        return {'creationflags': subprocess.BELOW_NORMAL_PRIORITY_CLASS}
+    return {}
+
+
+def priority_prefix(low_priority):
+    # nice rather than preexec_fn, which isn't safe to fork from worker threads;
+    # idle I/O class so reading/writing episodes doesn't stall other disk users
+    if not low_priority or os.name == 'nt':
+        return []
+    prefix = []
+    if shutil.which('nice'):
+        prefix += ['nice', '-n', '10']
+    if shutil.which('ionice'):
+        prefix += ['ionice', '-c', '3']
+    return prefix
+
+
+def probe_duration(path):
+    """Audio duration of `path` in seconds, or None if ffprobe can't tell"""
+    try:
+        result = subprocess.run(
+            [
+                'ffprobe', '-v', 'error',
+                '-show_entries', 'format=duration',
+                '-of', 'default=noprint_wrappers=1:nokey=1',
+                str(path),
+            ],
+            capture_output=True,
+            text=True,
+            encoding='utf-8',
+        )
+        return float(result.stdout.strip())
+    except (OSError, ValueError):
+        return None
+
+
+def probe_codec(path):
+    """Codec name of the first audio stream of `path` (e.g. 'aac'), or None"""
+    try:
+        result = subprocess.run(
+            [
+                'ffprobe', '-v', 'error',
+                '-select_streams', 'a:0',
+                '-show_entries', 'stream=codec_name',
+                '-of', 'default=noprint_wrappers=1:nokey=1',
+                str(path),
+            ],
+            capture_output=True,
+            text=True,
+            encoding='utf-8',
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def _run_ffmpeg(src, dest, output_args, low_priority=True, threads=TRANSCODE_THREADS):
+    """Run one ffmpeg job and return its stats (see format_stats)"""
+    started = time.monotonic()
+    proc = subprocess.Popen(
+        [
+            *priority_prefix(low_priority),
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+            '-threads', str(threads),
+            '-i', str(src),
+            '-vn',
+            *output_args,
+            '-threads', str(threads),
+            str(dest),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        **priority_kwargs(low_priority),
+    )
+    stderr = proc.stderr.read().decode('utf-8', 'replace')
+    proc.stderr.close()
+
+    cpu = None
+    if hasattr(os, 'wait4'):
+        # Reap the child ourselves to get its own CPU usage
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        cpu = usage.ru_utime + usage.ru_stime
+    else:
+        proc.wait()
+    wall = time.monotonic() - started
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed on {src}: {stderr.strip()}")
+
+    duration = probe_duration(dest)
+    return {
+        'dest': dest,
+        'wall': wall,
+        'cpu': cpu,
+        'duration': duration,
+        'realtime': duration / wall if duration and wall else None,
+    }
+
+
+def format_stats(stats):
+    """One-line job report: wall time, CPU seconds, realtime factor"""
+    parts = [f"{stats['wall']:.1f}s wall"]
+    if stats['cpu'] is not None:
+        parts.append(f"{stats['cpu']:.1f}s CPU")
+    if stats['realtime']:
+        parts.append(f"{stats['realtime']:.0f}x realtime")
+    return ', '.join(parts)
+
+
+def transcode_to_mp3(src, dest, quality=0, low_priority=True, threads=TRANSCODE_THREADS):
+    """Re-encode `src` to VBR mp3 at `dest` (quality 0 = best, like yt-dlp's --audio-quality 0)"""
+    return _run_ffmpeg(src, dest, ['-codec:a', 'libmp3lame', '-q:a', str(quality)], low_priority, threads)
+
+
+def remux_to_m4a(src, dest, low_priority=True):
+    """Copy the AAC stream of `src` into an m4a at `dest` without re-encoding"""
+    # faststart puts the index up front so playback can begin before the whole file loads
+    return _run_ffmpeg(src, dest, ['-codec:a', 'copy', '-movflags', '+faststart'], low_priority, threads=1)
+
+
+def convert_audio(src, dest, threads=TRANSCODE_THREADS):
+    """Produce `dest` from `src` in the format its extension asks for"""
+    if str(dest).lower().endswith('.m4a'):
+        return remux_to_m4a(src, dest)
+    return transcode_to_mp3(src, dest, threads=threads)
+
+
+def convert_many(jobs, workers=None, threads=TRANSCODE_THREADS):
+    """Run (src, dest) conversions side by side; returns {src: stats or exception}
+
+    Each worker thread just drives one ffmpeg process, so this is a process
+    pool in practice, sized to the core count by default.
+    """
+    workers = workers or default_workers(threads)
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(convert_audio, src, dest, threads): src for src, dest in jobs}
+        for future in as_completed(futures):
+            src = futures[future]
+            try:
+                results[src] = future.result()
+            except Exception as e:
+                results[src] = e
+    return results
+
+
+def progress_seconds(line):
+    """Output position in seconds from an ffmpeg `-progress` line, or None"""
+    key, _, value = line.strip().partition('=')
+    if key == 'out_time_us' and value.isdigit():
+        return int(value) / 1_000_000
+    return None
+
+
+def _pipe_ffmpeg(stdin, output_args):
+    return subprocess.Popen(
+        [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            # key=value progress lines on stderr, between any error lines
+            '-progress', 'pipe:2',
+            '-i', 'pipe:0',
+            '-vn',
+            *output_args,
+            'pipe:1',
+        ],
+        stdin=stdin,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+
+def drain_stderr(proc):
+    """Read a streaming ffmpeg's (or yt-dlp's) stderr in the background so it can't fill the pipe
+
+    Returns (thread, status). Once the thread has finished,
+    status['duration'] is the seconds of audio ffmpeg wrote and
+    status['errors'] the error lines.
+    """
+    status = {'duration': None, 'errors': []}
+
+    def drain():
+        for raw in proc.stderr:
+            line = raw.decode('utf-8', 'replace').strip()
+            seconds = progress_seconds(line)
+            if seconds is not None:
+                status['duration'] = seconds
+            elif line and '=' not in line.split(' ', 1)[0]:
+                status['errors'].append(line)
+
+    thread = threading.Thread(target=drain, daemon=True)
+    thread.start()
+    return thread, status
+
+
+def mp3_encoder(stdin, quality=0):
+    """Start an ffmpeg that re-encodes audio piped into `stdin` to mp3 on its stdout
+
+    For streaming mode: the caller reads the process's stdout, drains its
+    stderr (see drain_stderr) and must check its return code once the
+    stream ends.
+    """
+    return _pipe_ffmpeg(stdin, ['-codec:a', 'libmp3lame', '-q:a', str(quality), '-f', 'mp3'])
+
+
+def m4a_remuxer(stdin):
+    """Streaming counterpart of remux_to_m4a()
+
+    An MP4 index can't be written up front on a pipe, so the output is a
+    fragmented MP4, which browsers play the same way.
+    """
+    return _pipe_ffmpeg(stdin, ['-codec:a', 'copy', '-movflags', 'frag_keyframe+empty_moov', '-f', 'mp4'])
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description="Convert downloaded episodes in parallel at low priority")
+    parser.add_argument('files', nargs='+', type=Path)
+    parser.add_argument('--to', choices=('mp3', 'm4a'), default='mp3', help="output format (default mp3)")
+    parser.add_argument('--threads', type=int, default=TRANSCODE_THREADS,
+                        help=f"ffmpeg threads per job (default {TRANSCODE_THREADS})")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="concurrent jobs (default: cores / threads)")
+    args = parser.parse_args()
+
+    jobs = [(src, src.with_suffix(f'.{args.to}')) for src in args.files if src.suffix.lower() != f'.{args.to}']
+    workers = args.workers or default_workers(args.threads)
+    print(f"Converting {len(jobs)} files to {args.to} ({workers} jobs x {args.threads} threads)...")
+
+    started = time.monotonic()
+    results = convert_many(jobs, workers=workers, threads=args.threads)
+    total_cpu = 0.0
+    for src, result in results.items():
+        if isinstance(result, Exception):
+            print(f"  ✗ {src.name}: {result}")
+        else:
+            total_cpu += result['cpu'] or 0
+            print(f"  ✓ {result['dest'].name}: {format_stats(result)}")
+
+    wall = time.monotonic() - started
+    print(f"\nDone in {wall:.1f}s, {total_cpu:.1f} CPU seconds "
+          f"({total_cpu / wall if wall else 0:.1f} cores busy on average)")
@@ -1,35 +1,19 @@
-import boto3
-import os
 import sys
 from pathlib import Path
 
+import multipart_upload
+from catalog import publish_catalog
+from r2_storage import iter_objects
+
 # Set UTF-8 encoding for console output
 sys.stdout.reconfigure(encoding='utf-8')
 
-# Cloudflare R2 credentials
-ACCESS_KEY = "3fe1d0fac3028b108dfb1434fbeda5ab"
-SECRET_KEY = "7e39e93560a2555e2e20c57a6ea094746212d3360ee13395d8ddb40c69924516"
-ACCOUNT_ID = "daa5cfc7d0326ab77077899860d9ae03"
-BUCKET_NAME = "gparchive"
-
-# R2 endpoint
-ENDPOINT_URL = f"https://{ACCOUNT_ID}.r2.cloudflarestorage.com"
-
 # Files to upload
 FILES_TO_UPLOAD = [
     r"C:\Users\schmi\Downloads\gp_proxy\archive\Gilles Peterson, Gary Bartz in conversation.mp3",
     r"C:\Users\schmi\Downloads\gp_proxy\archive\Gilles Peterson, 10⧸01⧸2026.mp3"
 ]
 
-# Create S3 client for R2
-s3_client = boto3.client(
-    's3',
-    endpoint_url=ENDPOINT_URL,
-    aws_access_key_id=ACCESS_KEY,
-    aws_secret_access_key=SECRET_KEY,
-    region_name='auto'
-)
-
 def upload_files():
     success_count = 0
 
@@ -48,11 +32,10 @@ def upload_files():
         print("-" * 60)
 
         try:
-            s3_client.upload_file(
-                str(file_path),
-                BUCKET_NAME,
+            multipart_upload.upload_file(
+                file_path,
                 file_name,
-                Callback=lambda bytes_transferred: print('.', end='', flush=True)
+                progress=lambda bytes_transferred: print('.', end='', flush=True)
             )
             print(f"\n✓ Successfully uploaded: {file_name}")
             success_count += 1
@@ -62,13 +45,22 @@ def upload_files():
     print("\n" + "=" * 60)
     print(f"Upload complete! {success_count}/{len(FILES_TO_UPLOAD)} files uploaded successfully.")
 
+    # Rebuild the episode catalog served by /api/episodes
+    try:
+        publish_catalog(refresh=True)
+        print("✓ Episode catalog updated")
+    except Exception as e:
+        print(f"✗ Error updating episode catalog: {str(e)}")
+
     # List all files in bucket
     print("\nAll files in bucket:")
     try:
-        response = s3_client.list_objects_v2(Bucket=BUCKET_NAME)
-        if 'Contents' in response:
-            total_files = len(response['Contents'])
-            total_size = sum(obj['Size'] for obj in response['Contents'])
+        total_files = 0
+        total_size = 0
+        for obj in iter_objects():
+            total_files += 1
+            total_size += obj['Size']
+        if total_files:
             print(f"  Total episodes: {total_files}")
             print(f"  Total size: {total_size / (1024**3):.2f} GB")
         else:
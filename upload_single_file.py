@@ -1,32 +1,16 @@
-import boto3
-import os
 import sys
 from pathlib import Path
 
+import multipart_upload
+from catalog import publish_catalog
+from r2_storage import iter_objects
+
 # Set UTF-8 encoding for console output
 sys.stdout.reconfigure(encoding='utf-8')
 
-# Cloudflare R2 credentials
-ACCESS_KEY = "3fe1d0fac3028b108dfb1434fbeda5ab"
-SECRET_KEY = "7e39e93560a2555e2e20c57a6ea094746212d3360ee13395d8ddb40c69924516"
-ACCOUNT_ID = "daa5cfc7d0326ab77077899860d9ae03"
-BUCKET_NAME = "gparchive"
-
-# R2 endpoint
-ENDPOINT_URL = f"https://{ACCOUNT_ID}.r2.cloudflarestorage.com"
-
 # File to upload
 FILE_TO_UPLOAD = r"C:\Users\schmi\Downloads\gp_proxy\archive\Gilles Peterson, 13⧸12⧸2025.mp3"
 
-# Create S3 client for R2
-s3_client = boto3.client(
-    's3',
-    endpoint_url=ENDPOINT_URL,
-    aws_access_key_id=ACCESS_KEY,
-    aws_secret_access_key=SECRET_KEY,
-    region_name='auto'
-)
-
 def upload_file():
     file_path = Path(FILE_TO_UPLOAD)
 
@@ -43,11 +27,10 @@ def upload_file():
 
     try:
         # Upload file
-        s3_client.upload_file(
-            str(file_path),
-            BUCKET_NAME,
+        multipart_upload.upload_file(
+            file_path,
             file_name,
-            Callback=lambda bytes_transferred: print('.', end='', flush=True)
+            progress=lambda bytes_transferred: print('.', end='', flush=True)
         )
         print(f"\n✓ Successfully uploaded: {file_name}")
 
@@ -58,15 +41,22 @@ def upload_file():
     print("\n" + "=" * 60)
     print("Upload complete!")
 
+    # Rebuild the episode catalog served by /api/episodes
+    try:
+        publish_catalog(refresh=True)
+        print("✓ Episode catalog updated")
+    except Exception as e:
+        print(f"✗ Error updating episode catalog: {str(e)}")
+
     # List uploaded files
     print("\nFiles in bucket:")
     try:
-        response = s3_client.list_objects_v2(Bucket=BUCKET_NAME)
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                size_mb = obj['Size'] / (1024 * 1024)
-                print(f"  - {obj['Key']} ({size_mb:.2f} MB)")
-        else:
+        count = 0
+        for obj in iter_objects():
+            size_mb = obj['Size'] / (1024 * 1024)
+            print(f"  - {obj['Key']} ({size_mb:.2f} MB)")
+            count += 1
+        if not count:
             print("  No files found in bucket")
     except Exception as e:
         print(f"  Error listing files: {str(e)}")
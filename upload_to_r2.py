@@ -1,33 +1,84 @@
-import boto3
-import os
+"""
+Bulk backfill of the local archive folder to R2
+
+Uploads every *.mp3 in ARCHIVE_FOLDER, several files at a time. Files that
+are already in the bucket with the same size and checksum (compared against
+one bucket listing, not a HEAD per file) are skipped, so re-runs only send
+what is new or changed.
+
+A tracklist saved next to an episode as `<name>.txt` (one
+'[H:]MM:SS Artist - Title' per line) is embedded as chapters in the
+uploaded copy; the local files themselves are never modified.
+
+Usage:
+    python upload_to_r2.py [--workers 3] [--dry-run] [--assume-mbps 20]
+"""
+import argparse
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+import multipart_upload
+from catalog import publish_catalog
+from ingest import ingest_file
+from manifest import get_manifest
+from naming import episode_id
+from r2_storage import iter_objects
+
 # Set UTF-8 encoding for console output
 sys.stdout.reconfigure(encoding='utf-8')
 
-# Cloudflare R2 credentials
-ACCESS_KEY = "3fe1d0fac3028b108dfb1434fbeda5ab"
-SECRET_KEY = "7e39e93560a2555e2e20c57a6ea094746212d3360ee13395d8ddb40c69924516"
-ACCOUNT_ID = "daa5cfc7d0326ab77077899860d9ae03"
-BUCKET_NAME = "gparchive"
-
-# R2 endpoint
-ENDPOINT_URL = f"https://{ACCOUNT_ID}.r2.cloudflarestorage.com"
-
 # Archive folder
 ARCHIVE_FOLDER = r"C:\Users\schmi\Downloads\gp_proxy\archive"
 
-# Create S3 client for R2
-s3_client = boto3.client(
-    's3',
-    endpoint_url=ENDPOINT_URL,
-    aws_access_key_id=ACCESS_KEY,
-    aws_secret_access_key=SECRET_KEY,
-    region_name='auto'
-)
-
-def upload_files():
+# Files uploaded concurrently (each one also uses multipart part threads)
+UPLOAD_WORKERS = 3
+
+# Uplink speed assumed for dry-run estimates when no bandwidth cap is set
+ASSUMED_MBPS = 20
+
+def plan_uploads(mp3_files, workers):
+    """Split local files into (to_upload, identical) using one bucket listing"""
+    remote = {obj['Key']: (obj['Size'], obj['ETag']) for obj in iter_objects(delimiter='/')}
+    manifest = get_manifest()
+
+    def check(mp3_file):
+        entry = remote.get(mp3_file.name)
+        if entry is None:
+            return mp3_file, False
+        size, etag = entry
+        if multipart_upload.matches_remote(mp3_file, etag, size):
+            return mp3_file, True
+        row = manifest.get(mp3_file.name)
+        meta = row['meta'] if row else {}
+        # Uploaded as a copy with chapters embedded: compare with the file as it was
+        untagged_etag = meta.get('untagged_etag')
+        if untagged_etag and multipart_upload.matches_remote(mp3_file, untagged_etag, meta['untagged_size']):
+            return mp3_file, True
+        # Loudness tagging re-copies the object, which changes its ETag
+        source_etag = meta.get('source_etag')
+        return mp3_file, bool(source_etag) and multipart_upload.matches_remote(mp3_file, source_etag, size)
+
+    to_upload, identical = [], []
+    # Hashing is disk-bound, so check candidates in parallel too
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for mp3_file, same in pool.map(check, mp3_files):
+            (identical if same else to_upload).append(mp3_file)
+    return to_upload, identical
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}h {(seconds % 3600) // 60:02d}m {seconds % 60:02d}s"
+
+def upload_one(mp3_file):
+    file_name = mp3_file.name
+    tracklist = mp3_file.with_suffix('.txt')
+    ingest_file(mp3_file, file_name, episode_id=episode_id(file_name),
+                tracklist=tracklist if tracklist.exists() else None)
+    return mp3_file.stat().st_size
+
+def upload_files(workers=UPLOAD_WORKERS, dry_run=False, assume_mbps=ASSUMED_MBPS):
     archive_path = Path(ARCHIVE_FOLDER)
 
     if not archive_path.exists():
@@ -35,50 +86,73 @@ def upload_files():
         return
 
     # Get all MP3 files
-    mp3_files = list(archive_path.glob("*.mp3"))
+    mp3_files = sorted(archive_path.glob("*.mp3"))
 
     if not mp3_files:
         print("No MP3 files found in the archive folder")
         return
 
-    print(f"Found {len(mp3_files)} MP3 files to upload")
+    print(f"Found {len(mp3_files)} MP3 files in the archive folder")
+    print("Comparing with bucket contents...")
+    to_upload, identical = plan_uploads(mp3_files, workers)
+
+    total_bytes = sum(f.stat().st_size for f in to_upload)
+    print(f"  {len(identical)} already in R2 (same size and checksum), skipping")
+    print(f"  {len(to_upload)} to upload ({total_bytes / (1024 ** 3):.2f} GB)")
     print("-" * 60)
 
-    for mp3_file in mp3_files:
-        file_name = mp3_file.name
-        file_size_mb = mp3_file.stat().st_size / (1024 * 1024)
+    if dry_run:
+        mbps = multipart_upload.BANDWIDTH_LIMIT_MBPS or assume_mbps
+        for mp3_file in to_upload:
+            print(f"  would upload: {mp3_file.name} ({mp3_file.stat().st_size / (1024 * 1024):.2f} MB)")
+        eta = total_bytes * 8 / (mbps * 1_000_000)
+        print(f"\nDry run: {total_bytes / (1024 * 1024):.1f} MB would transfer, "
+              f"about {format_duration(eta)} at {mbps:g} Mbit/s")
+        return
+
+    if not to_upload:
+        print("Nothing to upload.")
+        return
 
-        print(f"\nUploading: {file_name}")
-        print(f"Size: {file_size_mb:.2f} MB")
+    started = time.monotonic()
+    uploaded_bytes = 0
+    success_count = 0
 
-        try:
-            # Upload file
-            s3_client.upload_file(
-                str(mp3_file),
-                BUCKET_NAME,
-                file_name,
-                Callback=lambda bytes_transferred: print('.', end='', flush=True)
-            )
-            print(f"\n✓ Successfully uploaded: {file_name}")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(upload_one, f): f for f in to_upload}
+        for future in as_completed(futures):
+            file_name = futures[future].name
+            try:
+                uploaded_bytes += future.result()
+                success_count += 1
+                print(f"✓ Successfully uploaded: {file_name}")
+            except Exception as e:
+                print(f"✗ Error uploading {file_name}: {str(e)}")
 
-        except Exception as e:
-            print(f"\n✗ Error uploading {file_name}: {str(e)}")
+    elapsed = time.monotonic() - started
+    rate = uploaded_bytes * 8 / elapsed / 1_000_000 if elapsed else 0
 
     print("\n" + "=" * 60)
-    print("Upload complete!")
+    print(f"Upload complete! {success_count}/{len(to_upload)} files, "
+          f"{uploaded_bytes / (1024 * 1024):.1f} MB in {format_duration(elapsed)} ({rate:.1f} Mbit/s)")
 
-    # List uploaded files
-    print("\nFiles in bucket:")
+    # Rebuild the episode catalog served by /api/episodes
     try:
-        response = s3_client.list_objects_v2(Bucket=BUCKET_NAME)
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                size_mb = obj['Size'] / (1024 * 1024)
-                print(f"  - {obj['Key']} ({size_mb:.2f} MB)")
-        else:
-            print("  No files found in bucket")
+        publish_catalog(refresh=True)
+        print("✓ Episode catalog updated")
     except Exception as e:
-        print(f"  Error listing files: {str(e)}")
+        print(f"✗ Error updating episode catalog: {str(e)}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bulk upload the local archive folder to R2")
+    parser.add_argument('--workers', type=int, default=UPLOAD_WORKERS,
+                        help=f"files uploaded concurrently (default {UPLOAD_WORKERS})")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="only report what would be uploaded and how long it would take")
+    parser.add_argument('--assume-mbps', type=float, default=ASSUMED_MBPS,
+                        help=f"uplink speed for dry-run estimates (default {ASSUMED_MBPS} Mbit/s)")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    upload_files()
+    args = parse_args()
+    upload_files(workers=args.workers, dry_run=args.dry_run, assume_mbps=args.assume_mbps)
@@ -0,0 +1,254 @@
+"""
+Integrity checks for downloaded episodes, run before anything is uploaded
+
+A download that was cut short, or a leftover partial file, can still be a
+perfectly playable file, just a short or damaged one. Before a download
+counts as done (and so before it can be uploaded) its file must pass:
+  - size: at least MIN_SIZE, at a plausible average bitrate for its
+    duration;
+  - frame sync: an mp3's MPEG frames must run back to back to the end of
+    the file (a gap is lost sync, a cut-off last frame a truncation); an
+    m4a's top-level MP4 boxes must tile the file exactly, with an ftyp
+    first and a moov and mdat present;
+  - decoded duration: ffmpeg decodes the whole file. More than
+    MAX_DECODE_ERRORS decode errors fail it, and the decoded length must
+    match the container's (mp3 frames / MP4 movie header) and the
+    duration BBC lists for the episode.
+
+Usage:
+    python verify.py FILE... [--duration SECONDS] [--quick]
+
+    from verify import IntegrityError, verify_audio
+    info = verify_audio(path, expected_duration=10800)   # raises IntegrityError
+
+Requirements:
+    - ffmpeg on PATH (not needed with decode_audio=False / --quick)
+"""
+
+import argparse
+import struct
+import subprocess
+import sys
+from pathlib import Path
+
+from mp3frames import iter_frames
+from naming import audio_ext
+from transcode import priority_kwargs, priority_prefix, progress_seconds
+
+MIN_SIZE = 1024 * 1024
+# Plausible average bitrates (kbps): BBC's AAC streams are 96-320, an mp3
+# re-encode at -q:a 0 about 130-260
+MIN_KBPS = 32
+MAX_KBPS = 400
+# Decoded vs listed duration: BBC rounds to the minute and trims differ a little
+DURATION_TOLERANCE = 60
+# Decoded vs container duration: both come from the same bytes
+CONTAINER_TOLERANCE = 2
+# A glitch or two at a stream splice is BBC's, not a broken download
+MAX_DECODE_ERRORS = 5
+ID3V1_SIZE = 128
+
+
+class IntegrityError(RuntimeError):
+    """A file failed verification; the message lists every problem found"""
+
+
+def _mp3_duration(path, size, problems):
+    """Duration from the mp3's frame headers, noting lost sync and truncation in `problems`"""
+    frames = audio_bytes = 0
+    duration = 0.0
+    first = end = None
+    with open(path, 'rb') as f:
+        for offset, length, samples, sample_rate in iter_frames(f):
+            if first is None:
+                first = offset
+            frames += 1
+            audio_bytes += length
+            duration += samples / sample_rate
+            end = offset + length
+        f.seek(max(0, size - ID3V1_SIZE))
+        tail = f.read()
+
+    if not frames:
+        problems.append("no MPEG audio frames")
+        return None
+    if end - first > audio_bytes:
+        problems.append(f"frame sync lost ({end - first - audio_bytes} bytes between frames)")
+    trailing = size - end
+    if trailing and not (trailing == ID3V1_SIZE and tail.startswith(b'TAG')):
+        problems.append(f"{trailing} bytes after the last whole frame (truncated?)")
+    return duration
+
+
+def _mp4_boxes(f, start, end):
+    """(type, offset, size, header size) of each box in [start, end); raises IntegrityError if they don't tile it"""
+    pos = start
+    while pos < end:
+        f.seek(pos)
+        header = f.read(16)
+        if len(header) < 8:
+            raise IntegrityError(f"truncated box header at byte {pos}")
+        size, kind = struct.unpack_from('>I4s', header)
+        header_size = 8
+        if size == 1 and len(header) == 16:
+            size, header_size = struct.unpack_from('>Q', header, 8)[0], 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size or pos + size > end:
+            name = kind.decode('latin-1')
+            raise IntegrityError(f"'{name}' box at byte {pos} runs past the end of the file (truncated?)")
+        yield kind, pos, size, header_size
+        pos += size
+
+
+def _mp4_duration(path, size, problems):
+    """Duration from the MP4 movie header, noting a broken box structure in `problems`
+
+    None for fragmented MP4s (streamed remuxes), whose movie header has no duration.
+    """
+    try:
+        with open(path, 'rb') as f:
+            boxes = list(_mp4_boxes(f, 0, size))
+            kinds = [kind for kind, *_ in boxes]
+            if not kinds or kinds[0] != b'ftyp':
+                problems.append("no 'ftyp' box at the start")
+            for required in (b'moov', b'mdat'):
+                if required not in kinds:
+                    problems.append(f"no '{required.decode()}' box")
+            moov = next((box for box in boxes if box[0] == b'moov'), None)
+            if moov is None:
+                return None
+            _, pos, moov_size, header_size = moov
+            for kind, child, _, child_header in _mp4_boxes(f, pos + header_size, pos + moov_size):
+                if kind != b'mvhd':
+                    continue
+                f.seek(child + child_header)
+                body = f.read(32)
+                if body[0] == 1:
+                    timescale, duration = struct.unpack_from('>IQ', body, 20)
+                else:
+                    timescale, duration = struct.unpack_from('>II', body, 12)
+                return duration / timescale if timescale and duration else None
+            problems.append("no 'mvhd' box in 'moov'")
+    except (IntegrityError, struct.error) as e:
+        problems.append(str(e) or "malformed MP4 box")
+    return None
+
+
+def decode(path, low_priority=True):
+    """(decoded seconds or None, error lines) from decoding all of `path` with ffmpeg"""
+    result = subprocess.run(
+        [
+            *priority_prefix(low_priority),
+            'ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error',
+            '-progress', 'pipe:1',
+            '-i', str(path),
+            '-vn', '-f', 'null', '-',
+        ],
+        capture_output=True,
+        text=True,
+        encoding='utf-8',
+        errors='replace',
+        **priority_kwargs(low_priority),
+    )
+    positions = [progress_seconds(line) for line in result.stdout.splitlines()]
+    positions = [seconds for seconds in positions if seconds is not None]
+    errors = [line.strip() for line in result.stderr.splitlines() if line.strip()]
+    if result.returncode != 0 and not errors:
+        errors.append(f"ffmpeg exited with {result.returncode}")
+    return (positions[-1] if positions else None), errors
+
+
+def check_decode(duration, errors, expected_duration=None):
+    """Problems with a decode's result: too many errors, or not the expected length"""
+    problems = []
+    if len(errors) > MAX_DECODE_ERRORS:
+        problems.append(f"{len(errors)} decode errors, first: {errors[0]}")
+    if not duration:
+        problems.append("no audio decoded")
+    elif expected_duration and abs(duration - expected_duration) > DURATION_TOLERANCE:
+        problems.append(f"decodes to {_fmt(duration)}, BBC lists {_fmt(expected_duration)}")
+    return problems
+
+
+def verify_audio(path, expected_duration=None, decode_audio=True):
+    """Check an mp3/m4a before upload; returns {'size', 'duration', 'container_duration', 'decode_errors'}
+
+    Raises IntegrityError listing every problem found. `expected_duration`
+    (seconds) is usually BBC's listed duration for the episode. Without
+    `decode_audio`, the size, structure and header duration are checked
+    but nothing is decoded.
+    """
+    path = Path(path)
+    size = path.stat().st_size
+    problems = []
+    if size < MIN_SIZE:
+        problems.append(f"only {size} bytes")
+
+    ext = audio_ext(path.name)
+    if ext == '.mp3':
+        container_duration = _mp3_duration(path, size, problems)
+    elif ext == '.m4a':
+        container_duration = _mp4_duration(path, size, problems)
+    else:
+        raise ValueError(f"not an episode audio file: {path.name}")
+
+    duration, errors = None, []
+    if decode_audio:
+        duration, errors = decode(path)
+        problems += check_decode(duration, errors, expected_duration)
+        if duration and container_duration and abs(duration - container_duration) > CONTAINER_TOLERANCE:
+            problems.append(f"decodes to {_fmt(duration)}, its headers say {_fmt(container_duration)}")
+    elif container_duration and expected_duration and abs(container_duration - expected_duration) > DURATION_TOLERANCE:
+        problems.append(f"its headers say {_fmt(container_duration)}, BBC lists {_fmt(expected_duration)}")
+
+    seconds = duration or container_duration or expected_duration
+    if seconds:
+        kbps = size * 8 / seconds / 1000
+        if not MIN_KBPS <= kbps <= MAX_KBPS:
+            problems.append(f"{kbps:.0f} kbps average over {_fmt(seconds)} is implausible")
+
+    if problems:
+        raise IntegrityError(f"{path.name} failed verification: {'; '.join(problems)}")
+    return {
+        'size': size,
+        'duration': duration,
+        'container_duration': container_duration,
+        'decode_errors': len(errors),
+    }
+
+
+def format_report(info):
+    """One-line summary of a passed verification"""
+    seconds = info['duration'] or info['container_duration']
+    parts = [f"{info['size'] / (1024 * 1024):.1f} MB"]
+    if seconds:
+        parts.append(_fmt(seconds) + (" decoded" if info['duration'] else ""))
+    if info['decode_errors']:
+        parts.append(f"{info['decode_errors']} decode errors")
+    return ", ".join(parts)
+
+
+def _fmt(seconds):
+    minutes, secs = divmod(int(round(seconds)), 60)
+    return f"{minutes // 60}:{minutes % 60:02d}:{secs:02d}"
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description="Check downloaded episodes before upload")
+    parser.add_argument('files', nargs='+', type=Path)
+    parser.add_argument('--duration', type=float, default=None, help="expected duration in seconds")
+    parser.add_argument('--quick', action='store_true', help="size and structure checks only, no decode")
+    args = parser.parse_args()
+
+    failed = 0
+    for path in args.files:
+        try:
+            info = verify_audio(path, args.duration, decode_audio=not args.quick)
+            print(f"✓ {path.name}: {format_report(info)}")
+        except IntegrityError as e:
+            failed += 1
+            print(f"✗ {e}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,347 @@
+"""
+Watch the BBC programme feed and archive new episodes as they appear
+
+A long-running alternative to the weekly Task Scheduler run of
+auto_download_weekly.py, which only looks at the newest episode once a
+week. An episode published late, or a failed run, was missed until
+someone noticed.
+
+The watcher polls the programme's episode page with conditional requests
+(If-None-Match / If-Modified-Since; if BBC sends neither validator, a hash
+of the page is compared instead). Only when it has changed, or an earlier
+download is still pending, are the episodes listed. Every listed episode
+missing from the bucket goes through the download pipeline, so new
+episodes are in R2 within minutes of appearing.
+
+Polling adapts to the broadcast slot (the weekday most recent archive
+episodes aired on, at SLOT_TIME):
+  - from SLOT_LEAD before the slot until the week's episode is in the
+    bucket, every POLL_FAST, doubling every BACKOFF_DOUBLING once it's
+    FAST_WINDOW late (up to POLL_SLOW);
+  - once the episode is archived, every POLL_SLOW until the next slot;
+  - after errors (VPN down, BBC unreachable, failed downloads),
+    exponential back-off with jitter up to MAX_ERROR_BACKOFF.
+Episodes whose jobs the queue is backing off (or has marked failed, see
+job_queue.py) aren't errors: they're logged and left to the queue, and the
+feed is listed again once the first retry is due.
+
+Only one watcher runs at a time (an OS lock on watcher.lock, released even
+if the process dies). State (validators, pending episodes, error count) is
+written to watcher_state.json atomically, so a crash never leaves a
+half-written file.
+
+Usage:
+    python watcher.py            # run until interrupted
+    python watcher.py --once     # one poll, e.g. from Task Scheduler
+
+Requirements:
+    - UK VPN, yt-dlp, boto3 and ffmpeg, as for auto_download_weekly.py
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import signal
+import sys
+import urllib.error
+import urllib.request
+from collections import Counter
+from datetime import datetime, time, timedelta
+from pathlib import Path
+
+from bbc_metadata import PROGRAMME_ID, USER_AGENT, list_episodes, resolve_episodes
+from catalog import publish_catalog
+from download_recent_missing import run_downloads
+from job_queue import FAILED, get_job_queue
+from manifest import get_manifest
+from naming import is_audio_key
+from pipeline import log
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+    BROADCAST_TZ = ZoneInfo('Europe/London')
+except (ImportError, ZoneInfoNotFoundError):
+    # Windows without the tzdata package: fall back to local time
+    BROADCAST_TZ = None
+
+FEED_URL = f"https://www.bbc.co.uk/programmes/{PROGRAMME_ID}/episodes/player"
+FEED_LIMIT = 10
+REQUEST_TIMEOUT = 30
+
+STATE_PATH = Path(__file__).parent / "watcher_state.json"
+LOCK_PATH = Path(__file__).parent / "watcher.lock"
+
+# Re-list the bucket if the local manifest is older than this (seconds)
+MANIFEST_MAX_AGE = 3600
+
+# The show ends at about this time (UK) on its broadcast day
+SLOT_TIME = time(18, 0)
+DEFAULT_WEEKDAY = 5    # Saturday
+# Archive dates the broadcast weekday is inferred from
+SLOT_HISTORY = 8
+
+SLOT_LEAD = timedelta(minutes=30)
+FAST_WINDOW = timedelta(hours=12)
+BACKOFF_DOUBLING = timedelta(hours=6)
+POLL_FAST = timedelta(minutes=5)
+POLL_SLOW = timedelta(hours=6)
+MAX_ERROR_BACKOFF = timedelta(hours=1)
+# POLL_FAST * 2**10 is well past MAX_ERROR_BACKOFF
+MAX_BACKOFF_EXPONENT = 10
+
+
+class InstanceLock:
+    """Exclusive lock on a file, so only one watcher runs at a time"""
+
+    def __init__(self, path=LOCK_PATH):
+        self.path = Path(path)
+        self._file = None
+
+    def acquire(self):
+        """True if the lock was taken, False if another process holds it"""
+        f = open(self.path, 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            f.close()
+            return False
+        f.truncate(0)
+        f.write(str(os.getpid()))
+        f.flush()
+        self._file = f
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
+
+
+def load_state(path=STATE_PATH):
+    try:
+        return json.loads(Path(path).read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        log(f"✗ {path} is unreadable, starting from a fresh state")
+        return {}
+
+
+def save_state(state, path=STATE_PATH):
+    """Write the state atomically: a temp file, fsynced, then renamed over the old one"""
+    path = Path(path)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def conditional_get(url, state):
+    """True if the page changed since the validators in `state` (which are updated)"""
+    headers = {'User-Agent': USER_AGENT}
+    if state.get('etag'):
+        headers['If-None-Match'] = state['etag']
+    if state.get('last_modified'):
+        headers['If-Modified-Since'] = state['last_modified']
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=REQUEST_TIMEOUT) as response:
+            body = response.read()
+            etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return False
+        raise
+
+    digest = hashlib.sha256(body).hexdigest()
+    changed = digest != state.get('sha256')
+    state.update(etag=etag, last_modified=last_modified, sha256=digest)
+    return changed
+
+
+def now():
+    return datetime.now(BROADCAST_TZ)
+
+
+def broadcast_weekday(manifest):
+    """Weekday most of the recent archive episodes aired on"""
+    dates = sorted({obj['date'] for obj in manifest.objects() if is_audio_key(obj['key']) and obj['date']})
+    weekdays = Counter(datetime.strptime(d, '%Y-%m-%d').weekday() for d in dates[-SLOT_HISTORY:])
+    return weekdays.most_common(1)[0][0] if weekdays else DEFAULT_WEEKDAY
+
+
+def last_slot(at, weekday):
+    """The latest broadcast slot that polling should already be watching for"""
+    days_back = (at.weekday() - weekday) % 7
+    slot = datetime.combine(at.date() - timedelta(days=days_back), SLOT_TIME, tzinfo=at.tzinfo)
+    if slot - SLOT_LEAD > at:
+        slot -= timedelta(weeks=1)
+    return slot
+
+
+def archived_since(manifest, day):
+    """True if the bucket has an episode broadcast on or after `day` (give or take a day)"""
+    cutoff = (day - timedelta(days=1)).isoformat()
+    return any(obj['date'] and obj['date'] >= cutoff for obj in manifest.objects() if is_audio_key(obj['key']))
+
+
+def next_interval(at, state, slot, have_episode):
+    """How long to sleep before the next poll"""
+    if state.get('errors'):
+        # Capped exponent: the error count keeps growing through a long outage
+        backoff = min(MAX_ERROR_BACKOFF, POLL_FAST * 2 ** min(state['errors'], MAX_BACKOFF_EXPONENT))
+        return backoff * random.uniform(0.8, 1.2)
+    if have_episode and not state.get('pending'):
+        next_lead = slot + timedelta(weeks=1) - SLOT_LEAD
+        return max(POLL_FAST, min(POLL_SLOW, next_lead - at))
+    late = at - slot - FAST_WINDOW
+    if late <= timedelta(0):
+        return POLL_FAST
+    return min(POLL_SLOW, POLL_FAST * 2 ** (late / BACKOFF_DOUBLING))
+
+
+def held_back(job, at):
+    """True (and logged) if the job queue has given up on a job or is backing it off"""
+    if job is None:
+        return False
+    if job['state'] == FAILED:
+        log(f"[watch] ✗ {job['id']} failed {job['attempts']} times, skipped until "
+            f"`python job_queue.py --retry-failed`: {job['last_error']}")
+        return True
+    if job['next_attempt'] > at:
+        log(f"[watch] {job['id']} is backing off after a failure, "
+            f"retry in {int((job['next_attempt'] - at) // 60)} min")
+        return True
+    return False
+
+
+def feed_episodes():
+    """Episodes on the programme page, with dates filled in from their episode pages"""
+    episodes = list_episodes(FEED_URL, limit=FEED_LIMIT, ttl=0)
+    undated = [ep['id'] for ep in episodes if not ep['date']]
+    resolved = resolve_episodes(undated) if undated else {}
+    for ep in episodes:
+        info = resolved.get(ep['id']) or {}
+        ep['date'] = ep['date'] or info.get('date') or ''
+        ep['title'] = info.get('title') or ep['title']
+    return [ep for ep in episodes if ep['date']]
+
+
+class Watcher:
+    def __init__(self, state_path=STATE_PATH):
+        self.state_path = state_path
+        self.state = load_state(state_path)
+        self._stop = asyncio.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    async def poll(self):
+        """One conditional check of the feed, downloading whatever is missing"""
+        manifest = get_manifest()
+        await asyncio.to_thread(manifest.refresh, max_age=MANIFEST_MAX_AGE)
+        changed = await asyncio.to_thread(conditional_get, FEED_URL, self.state)
+        self.state['last_poll'] = now().isoformat()
+        retry_due = (self.state.get('retry_at') or float('inf')) <= datetime.now().timestamp()
+        if not changed and not self.state.get('pending') and not retry_due:
+            return
+
+        episodes = await asyncio.to_thread(feed_episodes)
+        missing = [ep for ep in episodes if not manifest.has_episode(ep)]
+        # Not poll failures: the queue retries them when they're due, and
+        # counting them as errors would stop the fast polling for new episodes
+        queue = get_job_queue()
+        at = datetime.now().timestamp()
+        jobs = {ep['id']: queue.get(ep['id']) for ep in missing}
+        waiting = {job_id for job_id, job in jobs.items() if held_back(job, at)}
+        # Re-list the feed once the first of them is due again
+        self.state['retry_at'] = min((jobs[job_id]['next_attempt'] for job_id in waiting
+                                      if jobs[job_id]['state'] != FAILED), default=None)
+        if missing:
+            log(f"[watch] {len(missing)} episodes to archive: {', '.join(ep['id'] for ep in missing)}")
+            self.state['pending'] = [ep['id'] for ep in missing]
+            save_state(self.state, self.state_path)
+            uploaded = await asyncio.to_thread(run_downloads, missing)
+            if uploaded:
+                await asyncio.to_thread(publish_catalog)
+                log(f"[watch] ✓ {uploaded} episodes archived, catalog updated")
+
+        self.state['pending'] = [ep['id'] for ep in missing
+                                 if ep['id'] not in waiting and not manifest.has_episode(ep)]
+        if self.state['pending']:
+            raise RuntimeError(f"still missing after the download run: {', '.join(self.state['pending'])}")
+
+    async def run(self, once=False):
+        while not self._stop.is_set():
+            try:
+                await self.poll()
+                self.state['errors'] = 0
+            except Exception as e:
+                self.state['errors'] = self.state.get('errors', 0) + 1
+                log(f"[watch] ✗ Poll failed ({self.state['errors']} in a row): {e}")
+            save_state(self.state, self.state_path)
+            if once:
+                return
+
+            manifest = get_manifest()
+            at = now()
+            slot = last_slot(at, broadcast_weekday(manifest))
+            interval = next_interval(at, self.state, slot, archived_since(manifest, slot.date()))
+            log(f"[watch] Next poll in {int(interval.total_seconds() // 60)} min")
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=interval.total_seconds())
+            except asyncio.TimeoutError:
+                pass
+
+
+async def watch(once=False):
+    watcher = Watcher()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, watcher.stop)
+        except NotImplementedError:
+            # Windows: Ctrl+C raises KeyboardInterrupt instead
+            pass
+    await watcher.run(once)
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description="Watch the BBC programme feed and archive new episodes")
+    parser.add_argument('--once', action='store_true', help="poll once and exit")
+    args = parser.parse_args()
+
+    lock = InstanceLock()
+    if not lock.acquire():
+        print(f"✗ Another watcher is already running ({LOCK_PATH})")
+        sys.exit(1)
+    log(f"[watch] Watching {FEED_URL}")
+    try:
+        asyncio.run(watch(args.once))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        lock.release()
+        log("[watch] Stopped")